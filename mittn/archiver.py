@@ -1,11 +1,53 @@
-from sqlalchemy import create_engine
+import atexit
+import threading
+import uuid
+from queue import Queue
+
+from sqlalchemy import case, create_engine, func
 from sqlalchemy.orm.session import sessionmaker
 
+from mittn.blob import Blob, listen_for_blobs
+from mittn.metrics import Metrics
+from mittn.migration import migrate
+
+class ArchiverError(Exception):
+    """Issues could not be stored. errors has the exception of each."""
+
+    def __init__(self, errors):
+        super(ArchiverError, self).__init__(
+            "%d issue(s) could not be stored: %s"
+            % (len(errors), '; '.join(str(error) for error in errors)))
+        self.errors = errors
+
+
 class Archiver(object):
 
-    def __init__(self, db_url=None):
+    def __init__(self, db_url=None, fingerprint_cache=False, batch_size=1,
+                 run_id=None, background=False, queue_size=1000, metrics=None):
         self.db_url = db_url
         self.session = None
+        self.Session = None
+        self.issuecls = None
+        # Stored with every issue added, to tell test runs apart
+        self.run_id = run_id or uuid.uuid4().hex
+        # Keep the fingerprints of all known issues in memory instead of
+        # querying the database for every issue
+        self.fingerprint_cache = fingerprint_cache
+        self.fingerprints = None
+        # Commit new issues in batches of this many
+        self.batch_size = max(1, int(batch_size))
+        self.batch = []  # (issue, whether its fingerprint was cached by it)
+        # Check and store issues in a writer thread of its own, so that
+        # adding an issue does not wait for the database
+        self.background = background
+        self.queue_size = int(queue_size)
+        self.queue = None
+        self.writer = None
+        self.writer_errors = []
+        self.writer_lock = None
+        # Counts the known and the stored issues, and the time spent
+        # adding them
+        self.metrics = metrics or Metrics()
 
     def init(self,issuecls=None):
         """Opens the database specified in the feature file and creates tables
@@ -16,11 +58,30 @@ class Archiver(object):
 
         # Connect to the database
         db_engine = create_engine(self.db_url)
-        Session = sessionmaker(bind=db_engine)
-        self.session = Session()
+        self.Session = sessionmaker(bind=db_engine)
+        listen_for_blobs(self.Session)
+        self.session = self.Session()
+        self.issuecls = issuecls
 
         # Create DB tables (has no effect, if they already exist)
         issuecls.metadata.create_all(db_engine)
+        Blob.metadata.create_all(db_engine)
+        # Add the columns and indexes that tables created by earlier
+        # versions lack
+        migrate(db_engine, self.session, issuecls)
+
+        if self.fingerprint_cache:
+            self.load_fingerprints(issuecls)
+
+        if self.background:
+            self.start_writer()
+
+    def load_fingerprints(self, issuecls):
+        """Read the fingerprints of all the issues in the database into
+        an in-memory set, with a single query.
+        """
+        self.fingerprints = set(
+            row[0] for row in self.session.query(issuecls.fingerprint).yield_per(1000))
 
     def known_false_positive(self, issue):
         """Check whether issue already exists in the database
@@ -33,16 +94,29 @@ class Archiver(object):
         if self.session is None:
             # No false positive db is in use, all findings are treated as new
             return False
+        return self._known(self.session, issue)
 
+    def _known(self, session, issue):
         # Check whether we already know about this
+        issue.fingerprint = issue.compute_fingerprint()
+        if self.fingerprints is not None:
+            known = issue.fingerprint in self.fingerprints
+        else:
+            known = self._query_known(session, issue)
+        if known:
+            self.metrics.count('issues_known')
+        return known
 
-        q = self.session.query(type(issue))
+    def _query_known(self, session, issue):
+        # The fingerprint is indexed, the rest of the fields only rule out
+        # hash collisions
+        q = session.query(type(issue)).filter(
+            type(issue).fingerprint == issue.fingerprint)
         # filter all corresponding fields
         for cls_attr, attr in issue.unique_fields():
             q = q.filter(cls_attr == attr)
 
-        hits = q.all()
-        return len(hits) > 0
+        return q.first() is not None
 
     def add_issue(self, issue):
         """Add a finding into the database as a new finding
@@ -61,18 +135,235 @@ class Archiver(object):
                     issue=issue
                 ))
 
-        # Add the finding into the database
-        self.session.add(issue)
-        self.session.commit()
+        if self.queue is not None:
+            self._put(issue, False)
+            return
+
+        self.batch.append(self._add(self.session, issue))
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    @property
+    def pending(self):
+        """The number of issues added but not committed yet"""
+        return len(self.batch)
+
+    def _add(self, session, issue):
+        # Add the finding into the database. Returns the batch entry of
+        # the issue for _commit().
+        issue.fingerprint = issue.compute_fingerprint()
+        if issue.run_id is None:
+            issue.run_id = self.run_id
+        session.add(issue)
+        cached = self.fingerprints is not None and issue.fingerprint not in self.fingerprints
+        if cached:
+            self.fingerprints.add(issue.fingerprint)
+        return issue, cached
+
+    def _commit(self, session, batch):
+        """Commit a batch of added issues. If that fails, the issues are
+        stored again one at a time, so that only the ones that fail are
+        lost, and their fingerprints are taken out of the cache.
+
+        :return: List of the exceptions of the issues that failed
+
+        """
+        try:
+            session.commit()
+            self.metrics.count('issues_stored', len(batch))
+            return []
+        except Exception as e:
+            session.rollback()
+            if len(batch) == 1:
+                return self._forget([(batch[0], e)])
+            return self._commit_each(session, batch)
+
+    def _commit_each(self, session, batch):
+        # Store the issues of a rolled back batch one at a time
+        failed = []
+        for issue, cached in batch:
+            session.add(issue)
+            try:
+                session.commit()
+                self.metrics.count('issues_stored')
+            except Exception as e:
+                session.rollback()
+                failed.append(((issue, cached), e))
+        return self._forget(failed)
+
+    def _forget(self, failed):
+        # Take the issues that were not stored out of the fingerprint cache
+        for (issue, cached), e in failed:
+            if cached:
+                self.fingerprints.discard(issue.fingerprint)
+        return [e for entry, e in failed]
+
+    def flush(self):
+        """Commit the issues added since the last commit. In the background
+        mode, wait until the writer thread has stored all the issues added
+        so far.
+        """
+        with self.metrics.phase('archive'):
+            self._flush()
+
+    def _flush(self):
+        if self.queue is not None:
+            self.queue.join()
+            self._raise_writer_error()
+            return
+        if self.session is not None and self.batch:
+            batch, self.batch = self.batch, []
+            errors = self._commit(self.session, batch)
+            if errors:
+                raise ArchiverError(errors)
 
     def add_if_not_found(self, issue):
-        if not self.known_false_positive(issue):
-            self.add_issue(issue)
+        with self.metrics.phase('archive'):
+            if self.queue is not None:
+                self._put(issue, True)
+            elif not self.known_false_positive(issue):
+                self.add_issue(issue)
+
+    def start_writer(self):
+        """Start the writer thread of the background mode. Issues are
+        then put in a queue of at most queue_size issues, and the writer
+        thread checks, batches and commits them using a session of its
+        own. Adding an issue only waits if the queue is full.
+        """
+        self.queue = Queue(self.queue_size)
+        self.writer_lock = threading.Lock()
+        self.writer = threading.Thread(target=self._write, name='archiver writer')
+        self.writer.daemon = True
+        self.writer.start()
+        # Do not lose the queued issues if close() is not called
+        atexit.register(self.close)
+
+    def close(self):
+        """Store the issues still in the queue and stop the writer thread"""
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+            self.queue = None
+            atexit.unregister(self.close)
+            self._raise_writer_error()
+        self.flush()
+
+    def _put(self, issue, check_known):
+        self._raise_writer_error()
+        self.queue.put((issue, check_known))
+
+    def _raise_writer_error(self):
+        # All the errors of the writer thread since the last call
+        if not self.writer_errors:
+            return
+        with self.writer_lock:
+            errors, self.writer_errors = self.writer_errors, []
+        if errors:
+            raise ArchiverError(errors)
+
+    def _writer_failed(self, errors):
+        # Raised in the thread adding issues
+        with self.writer_lock:
+            self.writer_errors.extend(errors)
+
+    def _write(self):
+        session = self.Session()
+        batch = []
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    stopping = True
+                else:
+                    issue, check_known = item
+                    try:
+                        self._check_and_add(session, batch, issue, check_known)
+                    except Exception:
+                        # The failure may be of an issue of the batch, flushed
+                        # by the query for known issues. The rollback takes
+                        # the whole batch out of the session, so it is stored
+                        # one issue at a time, and the issue is tried again on
+                        # its own: only the issues that fail are lost.
+                        session.rollback()
+                        batch, pending = [], batch
+                        errors = self._commit_each(session, pending)
+                        try:
+                            self._check_and_add(session, batch, issue, check_known)
+                        except Exception as e:
+                            session.rollback()
+                            errors.append(e)
+                        self._writer_failed(errors)
+                # Commit when a batch is full or nothing else is waiting
+                if batch and (stopping or len(batch) >= self.batch_size or self.queue.empty()):
+                    batch, committed = [], batch
+                    self._writer_failed(self._commit(session, committed))
+            except Exception as e:
+                session.rollback()
+                for issue, cached in batch:
+                    if cached:
+                        self.fingerprints.discard(issue.fingerprint)
+                batch = []
+                self._writer_failed([e])
+            finally:
+                self.queue.task_done()
+        session.close()
+
+    def _check_and_add(self, session, batch, issue, check_known):
+        if not check_known or not self._known(session, issue):
+            batch.append(self._add(session, issue))
 
     def new_issue_count(self):
         if self.session is None:
             return 0
 
-        hits = self.session.query(type(self)).filter_by(new_issue=True).all()
+        self.flush()
+        return self.session.query(func.count(self.issuecls.issue_no)).filter(
+            self.issuecls.new_issue == True).scalar()
+
+    def summary(self, group_by=('scenario_id',), run_id=None, issueclasses=None):
+        """Count the new and known issues in the database, grouped by the
+        given fields. The counting is done by the database, no issues are
+        loaded.
+
+        :param group_by: Names of issue columns, e.g. 'scenario_id',
+            'resp_statuscode', 'issuetype' or 'run_id', or 'tool' for the
+            tool that found the issue
+        :param run_id: Only count the issues added in this test run
+        :param issueclasses: Issue classes to count, by default the one the
+            archiver was initialised with
+        :return: List of dicts with the group_by fields and the counts of
+            'new', 'known' and 'total' issues
+
+        """
+        if self.session is None:
+            return []
+
+        self.flush()
+        rows = []
+        # Each issue class is a tool of its own
+        fields = [name for name in group_by if name != 'tool']
+        for issuecls in issueclasses or [self.issuecls]:
+            columns = [column_for(issuecls, name) for name in fields]
+            new = func.sum(case([(issuecls.new_issue == True, 1)], else_=0))
+            q = self.session.query(func.count(issuecls.issue_no), new, *columns)
+            if run_id is not None:
+                q = q.filter(issuecls.run_id == run_id)
+            q = q.group_by(*columns).order_by(*columns)
+            for row in q:
+                total, new_count = row[0], row[1] or 0
+                summary = dict(zip(fields, row[2:]))
+                if 'tool' in group_by:
+                    summary['tool'] = issuecls.tool
+                summary.update(new=new_count, known=total - new_count, total=total)
+                rows.append(summary)
+        return rows
+
+
+def column_for(issuecls, name):
+    column = getattr(issuecls, name, None)
+    if column is None or not hasattr(column, 'property'):
+        raise ValueError("%s issues have no field %s" % (issuecls.tool, name))
+    return column
 
-        return len(hits)
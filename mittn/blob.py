@@ -0,0 +1,138 @@
+from sqlalchemy import Column, event, types
+from sqlalchemy.ext.declarative.api import declarative_base
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.exc import DetachedInstanceError
+import hashlib
+import zlib
+
+Base = declarative_base()
+
+
+class Blob(Base):
+    """ Compressed request and response data, shared by all the issues
+    (of any tool) that have the same content
+    """
+    __tablename__ = 'blobs'
+
+    digest = Column(types.String(64), primary_key=True)  # SHA-256 of the uncompressed data
+    size = Column(types.Integer, nullable=False)         # Size of the uncompressed data
+    data = Column(types.LargeBinary, nullable=False)     # zlib compressed
+
+    @staticmethod
+    def digest_of(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def from_data(data, digest=None):
+        return Blob(digest=digest or Blob.digest_of(data), size=len(data),
+                    data=zlib.compress(data))
+
+
+class BlobField(object):
+    """An issue field whose data is stored in the blob table. The issue
+    row only holds the digest of the data in <name>_digest; the data is
+    read from the blob table the first time the field is accessed.
+
+    Rows stored before the blob table existed have the data inline in
+    the column called <name>. That column is mapped as _<name>, and its
+    data is returned as is.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.digest_attr = name + '_digest'
+        self.inline_attr = '_' + name
+
+    def __get__(self, issue, cls):
+        if issue is None:
+            return self
+
+        pending = issue.__dict__.get('_blob_pending', {})
+        if self.name in pending:
+            return pending[self.name]
+        inline = getattr(issue, self.inline_attr)
+        if inline is not None:
+            return inline
+        digest = getattr(issue, self.digest_attr)
+        if digest is None:
+            return None
+
+        cache = issue.__dict__.setdefault('_blob_cache', {})
+        if digest not in cache:
+            session = object_session(issue)
+            if session is None:
+                raise DetachedInstanceError(
+                    "%s is not bound to a session; %s cannot be loaded"
+                    % (issue.__class__.__name__, self.name))
+            blob = session.query(Blob).get(digest)
+            cache[digest] = zlib.decompress(blob.data) if blob is not None else None
+        return cache[digest]
+
+    def __set__(self, issue, value):
+        # The data is moved into the blob table when the issue is flushed
+        issue.__dict__.setdefault('_blob_pending', {})[self.name] = value
+        setattr(issue, self.inline_attr, None)
+        setattr(issue, self.digest_attr, None)
+
+
+def blob_fields(issuecls):
+    """ The BlobFields of an issue class """
+    fields = []
+    for cls in issuecls.__mro__:
+        fields.extend(field for field in vars(cls).values() if isinstance(field, BlobField))
+    return fields
+
+
+def store_blob(session, data):
+    """Add data to the blob table, unless it is there already, and return
+    its digest.
+    """
+    digest = Blob.digest_of(data)
+    # Digests known to be in the database, or about to be
+    known = session.info.setdefault('blob_digests', set())
+    if digest not in known:
+        with session.no_autoflush:
+            if session.query(Blob.digest).filter(Blob.digest == digest).first() is None:
+                session.add(Blob.from_data(data, digest))
+        known.add(digest)
+    return digest
+
+
+def listen_for_blobs(session_factory):
+    """Move the data of the issue BlobFields into the blob table in the
+    sessions made with session_factory, e.g. the sessionmaker of an
+    Archiver. Other sessions of the process are not affected.
+    """
+    event.listen(session_factory, 'before_flush', store_pending_blobs)
+    event.listen(session_factory, 'after_commit', forget_moved_blobs)
+    event.listen(session_factory, 'after_rollback', forget_blob_digests)
+
+
+def store_pending_blobs(session, flush_context, instances):
+    # Move the data set on issue BlobFields into the blob table
+    for issue in list(session.new) + list(session.dirty):
+        pending = issue.__dict__.get('_blob_pending')
+        if not pending:
+            continue
+        for field in blob_fields(type(issue)):
+            if field.name not in pending:
+                continue
+            data = pending.pop(field.name)
+            if data is None:
+                continue
+            digest = store_blob(session, data)
+            setattr(issue, field.digest_attr, digest)
+            issue.__dict__.setdefault('_blob_cache', {})[digest] = data
+            session.info.setdefault('blob_moved', []).append((issue, field.name, data))
+
+
+def forget_moved_blobs(session):
+    session.info.pop('blob_moved', None)
+
+
+def forget_blob_digests(session):
+    # The blobs added in the rolled back transaction are gone. The data of
+    # the issues goes back to be stored again, if they are added again.
+    session.info.pop('blob_digests', None)
+    for issue, name, data in session.info.pop('blob_moved', ()):
+        issue.__dict__.setdefault('_blob_pending', {})[name] = data
@@ -31,3 +31,10 @@ class Config(object):
                         else:
                             s = None
                     setattr(self,key,s)
+
+
+def config_bool(value):
+    """Interpret a configuration file value as a boolean"""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'yes', 'true', 'on')
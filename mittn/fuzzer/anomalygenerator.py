@@ -1,7 +1,9 @@
 from mittn.fuzzer.static_anomalies import STATIC_ANOMALIES
 # TODO: get rid of six, as this project is no longer compatible with python2.7
 import six
-import copy
+from urllib import parse
+
+from mittn.fuzzer.injectionplan import InjectionPlan
 
 class AnomalyGenerator(object):
 
@@ -9,7 +11,7 @@ class AnomalyGenerator(object):
         self.radamsa = radamsa
 
     def collect_values(self, source, target, target_key=None):
-        """Recursively collect all values from a data structure into a dict where values are organised under keys,
+        """Collect all values from a data structure into a dict where values are organised under keys,
         or a "None" key if they weren't found under any key.
 
         For example: {'foo': {'bar': 1, 'baz': 2}, 'toka': 1}
@@ -26,31 +28,35 @@ class AnomalyGenerator(object):
         :param target_key: Under which key to store the collected values
 
         """
-        # Each key found in source will have a list of values
-        if target_key not in target:
-            target[target_key] = []
+        # Walk with an explicit stack instead of recursion, so that deeply
+        # nested structures do not hit the recursion limit
+        stack = [(source, target_key)]
+        while stack:
+            source, target_key = stack.pop()
+
+            # Each key found in source will have a list of values
+            if target_key not in target:
+                target[target_key] = []
 
-        # If we see a dict, we will get all the values under that key
-        if isinstance(source, dict):
-            for key, value in six.iteritems(source):
-                self.collect_values(value, target, target_key=key)
+            # If we see a dict, we will get all the values under that key
+            if isinstance(source, dict):
+                stack.extend(reversed([(value, key) for key, value in six.iteritems(source)]))
 
-        # If we see a list, we will add all values under current key
-        elif isinstance(source, list):
-            for el in source:
-                self.collect_values(el, target, target_key=target_key)
+            # If we see a list, we will add all values under current key
+            elif isinstance(source, list):
+                stack.extend(reversed([(el, target_key) for el in source]))
 
-        # If we see an actual value, we will add the value under both the
-        # current key and the "None" key
-        elif isinstance(source, (six.integer_types, six.string_types, six.text_type, float, bool)) or source is None:
-            target[target_key].append(source)
-            target[None].append(source)
+            # If we see an actual value, we will add the value under both the
+            # current key and the "None" key
+            elif isinstance(source, (six.integer_types, six.string_types, six.text_type, float, bool)) or source is None:
+                target[target_key].append(source)
+                target[None].append(source)
 
-        else:
-            raise NotImplementedError
+            else:
+                raise NotImplementedError
 
     def create_anomalies(self, branch, anomaly_dict, anomaly_key=None):
-        """Walk through a data structure recursively and replace each key and value with an injected (fuzz) case
+        """Walk through a data structure and replace each key and value with an injected (fuzz) case
         one by one.
 
         The anomaly that is injected is taken from a dict of anomalies. The dict has a "generic" anomaly with
@@ -64,77 +70,103 @@ class AnomalyGenerator(object):
         :return: list
 
         """
-        if isinstance(branch, dict):
-            fuzzed_branch = []
-
-            # Add cases where *single key* has been replaced with its fuzzed version (value is unchanged)
-            for key in branch.keys():
-                fuzzdict = branch.copy()
-
-                # Replace key (unchanged value)
-                try:
-                    new_key = str(anomaly_dict[None])  # Keys need to be strings (why?)
-                except UnicodeEncodeError:
-                    # Key was too broken to be a string, revenge using key 0xFFFF
-                    new_key = '\xff\xff'
-                fuzzdict[new_key] = fuzzdict.pop(key)
-
-                fuzzed_branch.append(fuzzdict)
-
-            # Add cases where *single value* has been replaced with its fuzzed version (key is unchanged)
-            for key, value in six.iteritems(branch):
-                sub_branches = self.create_anomalies(value, anomaly_dict, anomaly_key=key)
-                for sub_branch in sub_branches:
-                    fuzzdict = branch.copy()
-                    fuzzdict[key] = sub_branch
-                    fuzzed_branch.append(fuzzdict)
-
-            return fuzzed_branch
-
-        elif isinstance(branch, list):
-            fuzzed_branch = []
-
-            # Add cases where *single list item* has been replaced with its fuzzed version
-            for i, el in enumerate(branch):
-                sub_branches = self.create_anomalies(el, anomaly_dict, anomaly_key=anomaly_key)
-                for sub_branch in sub_branches:
-                    fuzzdict = copy.copy(branch)
-                    fuzzdict[i] = sub_branch
-                    fuzzed_branch.append(fuzzdict)
-
-            return fuzzed_branch
-
-        # A leaf node; return just a list of anomalies for a value
-        elif isinstance(branch, (six.integer_types, six.string_types, six.text_type, float, bool)) or branch is None:
-            anomaly = anomaly_dict.get(anomaly_key, anomaly_dict.get(None))
-            return [anomaly]
-
-        # If the data structure contains something that a unserialised JSON
-        # cannot contain; instead of just removing it, we return it as-is without
-        # injection
-        # FIXME: JSON probably cannot contain the *non-fuzzed* version of it (fuzzed version is str), so let's disable this!
-        # return [branch]
-        raise NotImplementedError
-
-    def generate_anomalies(self, wireframe, submissions, amount):
-        # Collect values per key from all submissions
-        values = {}
-        for submission in submissions:
-            self.collect_values(submission, values)
+        return list(self.iter_anomalies(branch, anomaly_dict, anomaly_key))
+
+    def iter_anomalies(self, branch, anomaly_dict, anomaly_key=None, plan=None):
+        """Like create_anomalies(), but yield the fuzzed variants one at a time.
+
+        Each variant only copies the dicts and lists on the path from the
+        root to the injected key or value; all the other branches are
+        shared with the original data structure, so they must not be
+        modified.
+
+        :param plan: InjectionPlan of branch, computed if not given
+
+        """
+        if plan is None:
+            plan = InjectionPlan.from_submission(branch, anomaly_key)
+        for point in plan:
+            yield point.apply(branch, anomaly_dict)
 
-        # Create the list of fuzz injections using a helper generator
-        fuzzed_anomalies = self.radamsa.fuzz_values(values, amount)
+    def fuzz_submissions(self, submission_lists, amount):
+        """Create fuzz injections for several lists of submissions (e.g. one
+        list for each target) with a single call to the fuzzer backend.
 
-        for index in range(0, amount):
+        :param submission_lists: List of lists of valid submissions
+        :param amount: How many injections to create for each key
+        :return: List of fuzz dicts, one for each list of submissions
+
+        """
+        # Collect values per key from all submissions
+        valuedicts = []
+        for submissions in submission_lists:
+            values = {}
+            for submission in submissions:
+                self.collect_values(submission, values)
+            valuedicts.append(values)
+
+        if hasattr(self.radamsa, 'fuzz_batch'):
+            return self.radamsa.fuzz_batch(valuedicts, amount)
+        return [self.radamsa.fuzz_values(values, amount) for values in valuedicts]
+
+    def generate_anomalies(self, wireframe, submissions, amount, fuzzed_anomalies=None, plan=None):
+        for index, point, injection in self.generate_cases(wireframe, submissions, amount,
+                                                           fuzzed_anomalies, plan):
+            yield point.apply(wireframe, injection)
+
+    def generate_cases(self, wireframe, submissions, amount, fuzzed_anomalies=None, plan=None,
+                       indices=None):
+        """Like generate_anomalies(), but instead of the fuzzed submissions
+        yield (anomaly index, InjectionPoint, anomaly dict) for every case.
+        The fuzzed submission is point.apply(wireframe, anomaly dict).
+        Only the anomalies with the given indices are used, if given.
+        """
+        # Create the list of fuzz injections using a helper generator,
+        # unless they were already created in a batch
+        if fuzzed_anomalies is None:
+            fuzzed_anomalies = self.fuzz_submissions([submissions], amount)[0]
+        if plan is None:
+            plan = InjectionPlan.from_submission(wireframe)
+
+        for index in (range(0, amount) if indices is None else indices):
             # Walk through the submission and inject at every key, value
 
             injection = {}
             for key, value in six.iteritems(fuzzed_anomalies):
                 injection[key] = value[index]
 
-            for fuzzed_submission in self.create_anomalies(wireframe, injection):
-                yield fuzzed_submission
+            for point in plan:
+                yield index, point, injection
 
-    def generate_static(self, anomaly_list=STATIC_ANOMALIES):
+    def generate_static(self, anomaly_list=STATIC_ANOMALIES, encodings=('raw',)):
+        """Yield the static anomalies, with the strings in each of the given
+        encodings:
+
+        raw: as is
+        url: percent-encoded, for servers that decode the value once more
+        utf8: as UTF-8 bytes, which are serialised like the fuzz values:
+            in JSON one character per byte, so that non-ASCII characters
+            arrive double encoded
+
+        Anomalies that are not strings are yielded once, as is. Encoded
+        variants that are the same as an earlier one are skipped.
+
+        """
         for anomaly in anomaly_list:
-            yield anomaly
+            if not isinstance(anomaly, six.string_types):
+                yield anomaly
+                continue
+            variants = []
+            for encoding in encodings:
+                if encoding == 'raw':
+                    variant = anomaly
+                elif encoding == 'url':
+                    variant = parse.quote(anomaly, safe='')
+                elif encoding == 'utf8':
+                    # ASCII would be sent the same as the raw string
+                    variant = anomaly.encode('utf-8') if any(ord(c) > 127 for c in anomaly) else anomaly
+                else:
+                    raise ValueError("Unknown encoding %s, use raw, url or utf8" % encoding)
+                if variant not in variants:
+                    variants.append(variant)
+                    yield variant
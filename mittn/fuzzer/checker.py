@@ -2,18 +2,35 @@ from requests import RequestException
 from requests.models import Response
 import re
 
+from mittn.metrics import Metrics
+
+# Characters that make a body error pattern a regular expression
+REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+
+
 class Checker(object):
 
-    def __init__(self, allowed_codes, disallowed_codes, body_errors):
+    def __init__(self, allowed_codes, disallowed_codes, body_errors, scan_limit=None,
+                 metrics=None):
         self.allowed_status_codes    = unpack_rangeparts(allowed_codes   )
         self.disallowed_status_codes = unpack_rangeparts(disallowed_codes)
         self.body_errors = body_errors
+        self.matcher = BodyErrorMatcher(body_errors or [], scan_limit)
+        self.metrics = metrics or Metrics()
 
     def check(self, resp_or_exc):
         """
         Check wether the server responded with something that indicated an
         error in the server.
         """
+        with self.metrics.phase('check'):
+            failed = self._check(resp_or_exc)
+        self.metrics.count('responses_checked')
+        if failed:
+            self.metrics.count('responses_failed')
+        return failed
+
+    def _check(self, resp_or_exc):
         if isinstance(resp_or_exc, RequestException):
             return True
         elif isinstance(resp_or_exc, Response):
@@ -26,15 +43,61 @@ class Checker(object):
             ):
                 return True
             elif self.body_errors:
-                matches = [index for index, el in enumerate(self.body_errors) if re.search(el, resp_or_exc.text, re.IGNORECASE)]
+                matches = self.matcher.match(resp_or_exc)
                 if matches:
-                    resp_or_exc.server_error_text_matched = ', '.join([self.body_errors[m] for m in matches])  # Hacky
+                    resp_or_exc.server_error_text_matched = ', '.join(matches)  # Hacky
                     return True
         else:
             raise NotImplementedError
 
         return False
 
+class BodyErrorMatcher(object):
+    """Finds which of the body error patterns occur in a response body.
+
+    The body is decoded to text like the checker always did (resp.text),
+    and each pattern is searched for case-insensitively. Plain string
+    patterns, the usual case, are looked up with a substring search in a
+    single lower-cased copy of the text, which is far cheaper than a
+    case-insensitive regular expression per pattern. Patterns using
+    regular expression syntax are compiled one by one, so that their
+    groups, backreferences and inline flags work as written.
+    """
+
+    def __init__(self, patterns, scan_limit=None):
+        self.patterns = patterns
+        # Scan at most this many characters of the body
+        self.scan_limit = scan_limit
+        self.literal_patterns = []  # (pattern, lower-cased pattern)
+        self.regex_patterns = []    # (pattern, compiled regex)
+
+        for pattern in patterns:
+            if pattern.isascii() and not any(c in REGEX_SPECIAL for c in pattern):
+                self.literal_patterns.append((pattern, pattern.lower()))
+            else:
+                self.regex_patterns.append((pattern, re.compile(pattern, re.IGNORECASE)))
+
+    def match(self, resp):
+        """Return the patterns found in the body of a Response, in the
+        order they were configured in.
+        """
+        found = set()
+        text = resp.text
+        if self.scan_limit is not None:
+            text = text[:self.scan_limit]
+
+        if self.literal_patterns:
+            lower_text = text.lower()
+            for pattern, literal in self.literal_patterns:
+                if literal in lower_text:
+                    found.add(pattern)
+
+        for pattern, compiled in self.regex_patterns:
+            if compiled.search(text):
+                found.add(pattern)
+
+        return [pattern for pattern in self.patterns if pattern in found]
+
 def unpack_rangeparts(rangeparts):
     """Input an integer range spec like ["200","205-207"] and return a list of
     integers like [200, 205, 206, 207]
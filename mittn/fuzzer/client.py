@@ -1,17 +1,74 @@
 import socket
 import codecs
+import threading
 
 from requests import Request, RequestException
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
 from requests.sessions import Session
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 from mittn.fuzzer.utils import *
+from mittn.metrics import Metrics
 
 FQDN = socket.getfqdn()
 HOSTNAME = socket.gethostbyname(socket.gethostname())
 
+# Whether the last request of a thread got a pooled connection that had
+# been used before, see ReuseTrackingMixin
+reuse = threading.local()
+
+
+class ReuseTrackingMixin(object):
+    # A connection pool that records in reuse whether it handed out a
+    # connection that is already open. A new connection, or one that the
+    # pool found closed, has no socket until it connects.
+
+    def _get_conn(self, timeout=None):
+        conn = super(ReuseTrackingMixin, self)._get_conn(timeout)
+        reuse.reused = getattr(conn, 'sock', None) is not None
+        return conn
+
+
+class ReuseTrackingHTTPConnectionPool(ReuseTrackingMixin, HTTPConnectionPool):
+    pass
+
+
+class ReuseTrackingHTTPSConnectionPool(ReuseTrackingMixin, HTTPSConnectionPool):
+    pass
+
+
+class KeepaliveAdapter(HTTPAdapter):
+    """Keeps connections open in pools of at most pool_size connections
+    per host, which track whether a request got a reused connection.
+    """
+
+    def __init__(self, pool_size):
+        # Block instead of opening more than pool_size connections to
+        # a host, so the pool stays bounded under concurrency
+        super(KeepaliveAdapter, self).__init__(pool_maxsize=pool_size, pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(KeepaliveAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': ReuseTrackingHTTPConnectionPool,
+            'https': ReuseTrackingHTTPSConnectionPool,
+        }
+
+
 class Client(Session):
 
-    def __init__(self):
+    # Attributes kept when a client is pickled for a worker process
+    __attrs__ = Session.__attrs__ + ['timeout', 'keepalive', 'pool_size', 'metrics']
+
+    def __init__(self, keepalive=False, pool_size=10, metrics=None):
+        """
+        :param keepalive: Reuse connections between fuzz cases instead of
+            opening a new one (and doing a TLS handshake) for every case
+        :param pool_size: Maximum number of connections kept per host when
+            keepalive is used
+        :param metrics: Metrics the requests are counted in
+        """
         #XXX here we are overriding the 'strict' error handler with the
         #'ignore' handler of the codecs module. This will make utf-8
         #conversion succeed by removing invalid characters from the 
@@ -29,31 +86,77 @@ class Client(Session):
             #'X-Valid-Case-Instrumentation': 'This is a valid request that should succeed',
         })
 
+        self.keepalive = keepalive
+        self.pool_size = pool_size
+        self.metrics = metrics or Metrics()
+        if keepalive:
+            self.headers['Connection'] = 'keep-alive'
+            adapter = KeepaliveAdapter(pool_size)
+            self.mount('http://', adapter)
+            self.mount('https://', adapter)
+
+    def __setstate__(self, state):
+        # The error handler is process wide, so a worker process needs it too
+        codecs.register_error('strict', lambda err:('', err.start+1))
+        super(Client, self).__setstate__(state)
+
     def do_target(self, target, method, payload):
-        req = Request(
-            method  = method,
-            headers = self.headers)
+        return self.send_body(target, method, self.serialise(target, payload))
 
+    def serialise(self, target, payload):
+        """Serialise a submission as it is sent to the target"""
         if target.submission_type == 'urlparams':
-            payload = dict_to_urlparams(payload)
-            req.url = target.uri + '?' + payload
-
+            return dict_to_urlparams(payload)
         elif target.submission_type == 'json':
-            payload  = serialise_to_json(payload, True)
-            req.url  = target.uri
-            req.data = payload
-
+            return serialise_to_json(payload, True)
         elif target.submission_type == 'urlencode':
-            payload = serialise_to_url(payload)
-            req.url  = target.uri
-            req.data = payload
+            return serialise_to_url(payload)
         else:
             raise NotImplementedError
 
-        try:
-            resp = self.send(
-                request = req.prepare(),
-                timeout = self.timeout)
-        except RequestException as e:
-            return e
-        return resp
+    def send_body(self, target, method, body):
+        """Send a submission serialised with serialise() to the target"""
+        start = self.metrics.clock()
+        with self.metrics.phase('send'):
+            resp_or_exc = self._send_body(target, method, body)
+        self.record(target, resp_or_exc, self.metrics.clock() - start)
+        return resp_or_exc
+
+    def record(self, target, resp_or_exc, seconds):
+        """Count a request and its latency in the metrics"""
+        if isinstance(resp_or_exc, RequestException):
+            outcome = type(resp_or_exc).__name__
+        else:
+            outcome = str(resp_or_exc.status_code)
+        self.metrics.count('requests', target=target.scenario_id, outcome=outcome)
+        self.metrics.observe('request_seconds', seconds, target=target.scenario_id)
+
+    def _send_body(self, target, method, body):
+        req = Request(
+            method  = method,
+            headers = self.headers)
+
+        if target.submission_type == 'urlparams':
+            req.url = target.uri + '?' + body
+        else:
+            req.url  = target.uri
+            req.data = body
+
+        prepared = req.prepare()
+        # The server may have closed a pooled connection just as the case
+        # was sent on it, for example when it was idle for too long. The
+        # case is then sent again, at the latest on a new connection. A
+        # case that fails on a new connection, or times out, is reported.
+        for attempt in range(self.pool_size + 1):
+            reuse.reused = False
+            try:
+                return self.send(
+                    request = prepared,
+                    timeout = self.timeout)
+            except ConnectionError as e:
+                if not reuse.reused or isinstance(e, Timeout):
+                    return e
+                error = e
+            except RequestException as e:
+                return e
+        return error
@@ -0,0 +1,117 @@
+import functools
+import hashlib
+import math
+import re
+import zlib
+from collections import Counter, OrderedDict
+
+from requests import RequestException
+
+# Words and numbers the body similarity hash is computed from
+TOKEN_RE = re.compile(rb'\w+')
+
+# Only the start of long bodies is hashed
+SIMHASH_LIMIT = 64 * 1024
+
+
+def response_signature(resp_or_exc):
+    """A cheap signature of a response: the status code (or the exception),
+    the length of the body rounded to a power of two, the set of header
+    names, and a similarity hash of the body. Responses that look the same
+    have the same signature, apart from a few bits of the similarity hash.
+
+    :return: signature as a string, '<status>:<length>:<headers>:<simhash>'
+    """
+    if isinstance(resp_or_exc, RequestException):
+        status = type(resp_or_exc).__name__
+        resp = resp_or_exc.response
+    else:
+        status = str(resp_or_exc.status_code)
+        resp = resp_or_exc
+
+    if resp is not None:
+        body = resp.content or b''
+        header_names = ','.join(sorted(name.lower() for name in resp.headers))
+    else:
+        body = b''
+        header_names = ''
+
+    length = int(math.log(len(body), 2)) + 1 if body else 0
+    headers = zlib.crc32(header_names.encode('utf-8'))
+    return '%s:%d:%08x:%016x' % (status, length, headers, simhash(body[:SIMHASH_LIMIT]))
+
+
+# The bits of a token hash are counted in lanes of an integer, one lane
+# per bit, wide enough for the number of tokens in SIMHASH_LIMIT bytes
+LANE_BITS = 32
+LANE_MASK = (1 << LANE_BITS) - 1
+# For each byte of a 64-bit hash, from the least significant one, and each
+# byte value: the bits of the byte spread out into their lanes
+BYTE_LANES = [[sum(1 << ((8 * position + bit) * LANE_BITS) for bit in range(8) if value >> bit & 1)
+               for value in range(256)]
+              for position in range(8)]
+
+
+@functools.lru_cache(maxsize=16384)
+def _token_lanes(token):
+    # The lanes of the bits set in the hash of a token. Error pages of a
+    # target share most of their words, so the hashes are cached.
+    digest = hashlib.blake2b(token, digest_size=8).digest()
+    return sum(BYTE_LANES[position][value] for position, value in enumerate(reversed(digest)))
+
+
+def simhash(data):
+    """64-bit similarity hash of the words in data: similar data have
+    hashes that differ in only a few bits.
+    """
+    # Each token adds its count to the lanes of the bits set in its hash,
+    # so all the bits are counted with one integer addition. A bit of the
+    # result is set if it is set in the hashes of most of the tokens.
+    lanes = 0
+    total = 0
+    for token, count in Counter(TOKEN_RE.findall(data)).items():
+        lanes += _token_lanes(token) * count
+        total += count
+    return sum(1 << bit for bit in range(64)
+               if 2 * (lanes >> (bit * LANE_BITS) & LANE_MASK) > total)
+
+
+class ResponseClusters(object):
+    """Groups the issues of a run by their responses. Issues of the same
+    scenario and method whose responses have the same status, length
+    bucket, header names and error text, and body similarity hashes at
+    most max_distance bits apart, are a cluster. The first issue of a
+    cluster represents it, and counts the hits of the cluster.
+    """
+
+    def __init__(self, max_distance=10):
+        self.max_distance = max_distance
+        # Exact part of the signature -> [(simhash, representative issue)]
+        self.clusters = OrderedDict()
+
+    def add(self, issue):
+        """Add an issue that has a signature. Returns True if it is the
+        first issue of a new cluster.
+        """
+        status, length, headers, body_hash = issue.signature.rsplit(':', 3)
+        key = (issue.scenario_id, issue.req_method, issue.server_error_text_matched,
+               status, length, headers)
+        body_hash = int(body_hash, 16)
+        cluster = self.clusters.setdefault(key, [])
+        for representative_hash, representative in cluster:
+            if bin(representative_hash ^ body_hash).count('1') <= self.max_distance:
+                representative.hit_count += 1
+                return False
+        issue.hit_count = 1
+        cluster.append((body_hash, issue))
+        return True
+
+    def issues(self):
+        """The representative issues, in the order their clusters were found"""
+        found = []
+        for cluster in self.clusters.values():
+            found.extend(issue for body_hash, issue in cluster)
+        return found
+
+    def __len__(self):
+        return sum(len(cluster) for cluster in self.clusters.values())
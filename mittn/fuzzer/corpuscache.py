@@ -0,0 +1,163 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+
+from mittn.fuzzer.utils import sample_values
+
+# Start of every cache file, followed by the number of values
+MAGIC = b'MCC1'
+HEADER = struct.Struct('<4sI')
+LENGTH = struct.Struct('<I')
+
+
+class CorpusCache(object):
+    """Keeps the fuzz values a fuzzer backend creates on disk and hands
+    them out again when the same values are asked for, instead of running
+    the backend.
+
+    The values of each list of valid values are stored in a file of their
+    own, named by a hash of the valid values, the backend, its seed and
+    the number of values. A file holds the values length-prefixed one
+    after another and is read through mmap. When the files take more
+    than max_size bytes, the least recently used ones are removed.
+    """
+
+    def __init__(self, backend, directory, max_size=100 * 1024 * 1024):
+        self.backend = backend
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def name(self):
+        return getattr(self.backend, 'name', type(self.backend).__name__)
+
+    @property
+    def seed(self):
+        return getattr(self.backend, 'seed', None)
+
+    @seed.setter
+    def seed(self, seed):
+        self.backend.seed = seed
+
+    def fuzz_values(self, valuedict, no_of_fuzzcases):
+        """Run every key's valid value list through a fuzzer.
+
+        :param valuedict: Dict of collected valid values
+        :param no_of_fuzzcases: How many injection cases to produce
+
+        """
+        return self.fuzz_batch([valuedict], no_of_fuzzcases)[0]
+
+    def fuzz_batch(self, valuedicts, no_of_fuzzcases):
+        """Like the fuzz_batch() of the backend, but only the lists of valid
+        values that are not in the cache are run through the backend, all
+        in one batch.
+        """
+        fuzzlists = OrderedDict()
+        for valuedict in valuedicts:
+            for key in valuedict.keys():
+                samples = sample_values(valuedict, key)
+                if samples not in fuzzlists:
+                    fuzzlists[samples] = self.read(self.path(samples, no_of_fuzzcases))
+
+        misses = [samples for samples, fuzzlist in fuzzlists.items() if fuzzlist is None]
+        if misses:
+            # The backend collects the samples of each dict again, so hand
+            # them over as the strings they were made from
+            fuzzes = self._backend_batch(
+                [{None: [sample.decode('utf-8') for sample in samples]} for samples in misses],
+                no_of_fuzzcases)
+            for samples, fuzz in zip(misses, fuzzes):
+                fuzzlists[samples] = fuzz[None]
+                self.write(self.path(samples, no_of_fuzzcases), fuzz[None])
+            self.evict()
+
+        return [dict((key, fuzzlists[sample_values(valuedict, key)])
+                     for key in valuedict.keys())
+                for valuedict in valuedicts]
+
+    def _backend_batch(self, valuedicts, no_of_fuzzcases):
+        if hasattr(self.backend, 'fuzz_batch'):
+            return self.backend.fuzz_batch(valuedicts, no_of_fuzzcases)
+        return [self.backend.fuzz_values(values, no_of_fuzzcases) for values in valuedicts]
+
+    def path(self, samples, no_of_fuzzcases):
+        """The cache file of the fuzz values of a list of valid values"""
+        digest = hashlib.sha256()
+        digest.update(('%s\0%s\0%d\0' % (
+            self.name, self.seed,
+            no_of_fuzzcases)).encode('utf-8'))
+        for sample in samples:
+            digest.update(LENGTH.pack(len(sample)))
+            digest.update(sample)
+        return os.path.join(self.directory, digest.hexdigest() + '.corpus')
+
+    @staticmethod
+    def read(path):
+        """Read a cache file, or return None if there is no valid one"""
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < HEADER.size:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    magic, count = HEADER.unpack_from(m)
+                    if magic != MAGIC:
+                        return None
+                    values = []
+                    offset = HEADER.size
+                    for _ in range(count):
+                        length, = LENGTH.unpack_from(m, offset)
+                        offset += LENGTH.size
+                        if offset + length > len(m):
+                            return None
+                        values.append(m[offset:offset + length])
+                        offset += length
+        except (OSError, ValueError, struct.error):
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return values
+
+    def write(self, path, values):
+        # Written under a temporary name first, so that a concurrent run
+        # never reads a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, len(values)))
+                for value in values:
+                    f.write(LENGTH.pack(len(value)))
+                    f.write(value)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def evict(self):
+        """Remove the least recently used files until the cache is no
+        larger than max_size.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.corpus'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Removed by another run
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,46 @@
+class FuzzCase(object):
+    """A single fuzzed request: the anomaly with the given index injected at
+    an injection point of a target, sent with a method.
+    """
+
+    __slots__ = ('target', 'index', 'point', 'method_no', 'method', 'injection', 'body')
+
+    def __init__(self, target, index, point, method_no, method, injection, body):
+        self.target = target        # the Target the case is sent to
+        self.index = index          # index of the anomaly
+        self.point = point          # the InjectionPoint of the target's plan
+        self.method_no = method_no  # position of the method in the configured methods
+        self.method = method        # HTTP method
+        self.injection = injection  # the anomaly dict the anomaly is picked from
+        self.body = body            # the fuzzed submission, serialised
+
+    @property
+    def payload(self):
+        """The fuzzed submission as a data structure"""
+        return self.point.apply(self.target.valid_submission, self.injection)
+
+    @property
+    def case_id(self):
+        """Identifies the case within the run that created it, see
+        MittnFuzzer.replay()
+        """
+        return '%s:%d:%d:%s' % (self.target.scenario_id, self.index, self.point.index, self.method)
+
+    @staticmethod
+    def parse_case_id(case_id):
+        """Split a case id into (scenario id, anomaly index, injection
+        point index, method)
+        """
+        try:
+            # The scenario id may have colons of its own
+            scenario_id, index, point_index, method = case_id.rsplit(':', 3)
+            return scenario_id, int(index), int(point_index), method
+        except ValueError:
+            raise ValueError("Invalid case id %r" % case_id)
+
+    @property
+    def order(self):
+        """Sort key that puts the cases of a target in the order they are
+        generated in.
+        """
+        return (self.index, self.point.index, self.method_no)
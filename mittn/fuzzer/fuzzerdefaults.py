@@ -6,16 +6,46 @@ class FuzzerDefaults(object):
                 "allowed_status_codes",
                 "disallowed_status_codes",
                 "body_errors",
+                "static_encodings",
                 ]
         self.defaults = """
 [fuzzer]
+fingerprint_cache=false
+insert_batch_size=1
+run_id=
+background_archiver=false
+archiver_queue_size=1000
 methods=GET,POST
+injection=fuzz
+static_encodings=raw,url,utf8
+mutator=radamsa
 radamsa_path=/usr/bin/radamsa
+seed=
+corpus_cache=
+corpus_cache_size=100
 timeout=30
 allowed_status_codes=
     200,404
 disallowed_status_codes=
 anomalies=1
+time_budget=
+coverage_file=
+turn_cases=100
+concurrency=1
+interleave=false
+host_concurrency=
+adaptive=false
+min_concurrency=1
+min_rate=
+max_rate=
+latency_target=
+keepalive=false
+pool_size=10
+http_engine=requests
+pipeline=1
+response_body_limit=1048576
+processes=1
+shard=
 body_errors=string,server error,
     invalid response, bad gateway,
     internal ASP error, service unavailable,
@@ -24,4 +54,15 @@ body_errors=string,server error,
     backend error, mysql, root:,
     parse error,exhausted,
     warning, denied
+body_scan_limit=
+cluster_responses=false
+cluster_distance=10
+metrics_json=
+metrics_prometheus=
+metrics_interval=
+trace_file=
+trace_limit=100000
+profile_phase=
+profile_mode=cprofile
+profile_file=
 """
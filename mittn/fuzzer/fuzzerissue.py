@@ -4,6 +4,7 @@ import datetime
 from requests.exceptions import RequestException
 from requests.models import Response
 from mittn.issue import Issue
+from mittn.blob import BlobField
 from sqlalchemy.ext.declarative.api import declarative_base
 
 import json
@@ -14,6 +15,7 @@ HOSTNAME = socket.gethostbyname(socket.gethostname())
 Base = declarative_base(cls=Issue)
 class FuzzerIssue(Base):
     __tablename__ = 'httpfuzzer_issues'
+    tool = 'httpfuzzer'
 
     # We use LargeBinary to store those fields that could contain somehow
     # bad Unicode, just in case some component downstream tries to parse
@@ -27,13 +29,36 @@ class FuzzerIssue(Base):
     server_error_text_matched = Column(types.String)
 
     req_method = Column(types.String)
-    req_headers = Column(types.LargeBinary)
-    req_body = Column(types.LargeBinary)
+    req_headers = BlobField('req_headers')
+    req_body = BlobField('req_body')
+
+    # Identify the fuzz case, to send it again with MittnFuzzer.replay()
+    seed = Column(types.String)
+    case_id = Column(types.String)
+
+    # The response signature of the cluster of similar responses this
+    # issue represents, and how many responses of the run were in it,
+    # see clustering.py
+    signature = Column(types.String)
+    hit_count = Column(types.Integer, default=1)
 
     resp_statuscode = Column(types.String)
-    resp_headers = Column(types.LargeBinary)
-    resp_body = Column(types.LargeBinary)
-    resp_history = Column(types.LargeBinary)
+    resp_headers = BlobField('resp_headers')
+    resp_body = BlobField('resp_body')
+    resp_history = BlobField('resp_history')
+
+    # The request and response data is stored compressed in the blob
+    # table, see blob.py. Issues stored before that have it inline.
+    req_headers_digest = Column(types.String(64))
+    req_body_digest = Column(types.String(64))
+    resp_headers_digest = Column(types.String(64))
+    resp_body_digest = Column(types.String(64))
+    resp_history_digest = Column(types.String(64))
+    _req_headers = Column('req_headers', types.LargeBinary)
+    _req_body = Column('req_body', types.LargeBinary)
+    _resp_headers = Column('resp_headers', types.LargeBinary)
+    _resp_body = Column('resp_body', types.LargeBinary)
+    _resp_history = Column('resp_history', types.LargeBinary)
 
     def unique_fields(self):
         """ Returns class attributes and fields used when checking for false
@@ -56,7 +81,7 @@ class FuzzerIssue(Base):
                     self.server_error_text_matched)]
 
     @staticmethod
-    def from_resp_or_exc(scenario_id, resp_or_exc):
+    def from_resp_or_exc(scenario_id, resp_or_exc, case_id=None, seed=None):
 
         issue = FuzzerIssue(
             new_issue=True,
@@ -65,6 +90,8 @@ class FuzzerIssue(Base):
             scenario_id=scenario_id,
             server_error_text_detected=False,
             server_timeout=False,
+            case_id=case_id,
+            seed=str(seed) if seed is not None else None,
         )
 
         if isinstance(resp_or_exc, RequestException):
@@ -0,0 +1,46 @@
+# The hooks MittnFuzzer calls, with their arguments
+HOOKS = {
+    'before_generate': '(targets)',
+    'after_generate': '(targets, anomalies)',
+    'after_serialize': '(case)',
+    'after_send': '(target, case, response)',
+    'after_check': '(target, case, response, failed)',
+    'on_issue': '(issue)',
+}
+
+
+class Hooks(object):
+    """Callbacks called at the steps of a fuzzer run, e.g. to time or log
+    them without changing the fuzzer:
+
+        fuzzer.hooks.register('after_check', callback)
+
+    The callbacks are called with the arguments in HOOKS, and what they
+    return is ignored. They are all called in the thread that runs the
+    fuzzer, never at the same time: with concurrency, after_send is
+    called when the response is checked, not in the thread that sent the
+    case. With processes, after_serialize, after_send and after_check are
+    called in the worker processes, so their callbacks must be picklable,
+    e.g. functions of a module. on_issue is called in the process that
+    archives the issue.
+    """
+
+    def __init__(self):
+        self.callbacks = dict((name, ()) for name in HOOKS)
+
+    def register(self, name, callback):
+        if name not in HOOKS:
+            raise ValueError("Unknown hook %s, use one of %s"
+                    % (name, ', '.join(sorted(HOOKS))))
+        # Tuples, so that a step in another thread never sees a list
+        # being changed
+        self.callbacks[name] = self.callbacks[name] + (callback,)
+
+    def unregister(self, name, callback):
+        callbacks = list(self.callbacks[name])
+        callbacks.remove(callback)
+        self.callbacks[name] = tuple(callbacks)
+
+    def call(self, name, *args):
+        for callback in self.callbacks[name]:
+            callback(*args)
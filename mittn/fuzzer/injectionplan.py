@@ -0,0 +1,171 @@
+import copy
+import random
+
+import six
+
+
+class InjectionPoint(object):
+    """A single key or value in a submission that can be replaced with
+    an anomaly.
+    """
+
+    def __init__(self, index, path, kind, key, value_type):
+        self.index = index            # position in the full plan of the submission
+        self.path = path              # dict keys and list indices from the root to the key or value
+        self.kind = kind              # 'key' if the key itself is replaced, 'value' otherwise
+        self.key = key                # the key the anomaly is picked with, None if not under a key
+        self.value_type = value_type  # type of the valid value at path
+
+    def __repr__(self):
+        return '<InjectionPoint %d %s %s (%s)>' % (
+            self.index, self.kind, self.pointer, self.value_type.__name__)
+
+    @property
+    def pointer(self):
+        """The path as a JSON pointer like string, e.g. /foo/0/bar"""
+        return '/' + '/'.join(str(step) for step in self.path)
+
+    def anomaly(self, anomaly_dict):
+        """Pick the anomaly injected at this point from an anomaly dict with
+        a generic anomaly under the None key and possibly specific ones
+        under other keys.
+        """
+        if self.kind == 'key':
+            # Keys need to be strings (why?)
+            try:
+                return str(anomaly_dict[None])
+            except UnicodeEncodeError:
+                # Key was too broken to be a string, revenge using key 0xFFFF
+                return '\xff\xff'
+        return anomaly_dict.get(self.key, anomaly_dict.get(None))
+
+    def apply(self, submission, anomaly_dict):
+        """Return a copy of submission with the anomaly injected at this point.
+
+        Only the dicts and lists on the path are copied; all the other
+        branches are shared with submission, so they must not be modified.
+        """
+        anomaly = self.anomaly(anomaly_dict)
+        if self.kind == 'key':
+            return replace_at(submission, self.path[:-1],
+                              lambda branch: replace_key(branch, self.path[-1], anomaly))
+        return replace_at(submission, self.path, lambda value: anomaly)
+
+
+class InjectionPlan(object):
+    """The injection points of a submission, in the order the fuzz cases are
+    created: at each dict, first every key, then everything under each
+    value.
+
+    A plan is computed once per Target and used for every anomaly and
+    method. It can be narrowed down with filter() and sample() before
+    fuzzing; the points keep their index in the full plan.
+    """
+
+    def __init__(self, points):
+        self.points = list(points)
+
+    @classmethod
+    def from_submission(cls, submission, anomaly_key=None):
+        """Compute the plan of a submission.
+
+        :param submission: The valid submission as a data structure
+        :param anomaly_key: The key the submission is under, if any
+
+        """
+        points = []
+        # Walk with an explicit stack instead of recursion, so that deeply
+        # nested structures do not hit the recursion limit.
+        # Nodes to visit as (path from root, node, key the node is under)
+        stack = [((), submission, anomaly_key)]
+        while stack:
+            path, node, node_key = stack.pop()
+
+            if isinstance(node, dict):
+                # Cases where *single key* has been replaced with its fuzzed version (value is unchanged)
+                for key, value in six.iteritems(node):
+                    points.append(InjectionPoint(len(points), path + (key,), 'key', key, type(value)))
+
+                # Cases where *single value* has been replaced with its fuzzed version (key is unchanged)
+                stack.extend(reversed([(path + (key,), value, key)
+                                       for key, value in six.iteritems(node)]))
+
+            elif isinstance(node, list):
+                # Cases where *single list item* has been replaced with its fuzzed version
+                stack.extend(reversed([(path + (i,), el, node_key)
+                                       for i, el in enumerate(node)]))
+
+            # A leaf node; the value can be replaced with an anomaly
+            elif isinstance(node, (six.integer_types, six.string_types, six.text_type, float, bool)) or node is None:
+                points.append(InjectionPoint(len(points), path, 'value', node_key, type(node)))
+
+            # If the data structure contains something that a unserialised JSON
+            # cannot contain; instead of just removing it, we return it as-is without
+            # injection
+            # FIXME: JSON probably cannot contain the *non-fuzzed* version of it (fuzzed version is str), so let's disable this!
+            else:
+                raise NotImplementedError
+        return cls(points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __getitem__(self, item):
+        return self.points[item]
+
+    def __repr__(self):
+        return '<InjectionPlan of %d points>' % len(self.points)
+
+    def filter(self, predicate=None, kind=None, keys=None):
+        """Return a plan with only the matching points.
+
+        :param predicate: Function taking an InjectionPoint
+        :param kind: 'key' or 'value'
+        :param keys: Collection of key names the points must be under
+
+        """
+        points = self.points
+        if kind is not None:
+            points = [p for p in points if p.kind == kind]
+        if keys is not None:
+            points = [p for p in points if p.key in keys]
+        if predicate is not None:
+            points = [p for p in points if predicate(p)]
+        return InjectionPlan(points)
+
+    def sample(self, amount, seed=None):
+        """Return a plan with a random selection of at most amount points,
+        in their original order.
+        """
+        if amount >= len(self.points):
+            return InjectionPlan(self.points)
+        chosen = random.Random(seed).sample(range(len(self.points)), amount)
+        return InjectionPlan(self.points[i] for i in sorted(chosen))
+
+
+def replace_key(branch, key, new_key):
+    fuzzdict = branch.copy()
+    fuzzdict[new_key] = fuzzdict.pop(key)
+    return fuzzdict
+
+
+def replace_at(root, path, replace):
+    """Return a copy of root where the branch at path has been replaced
+    with replace(branch). Only the containers along the path are copied.
+    """
+    nodes = [root]
+    for step in path:
+        nodes.append(nodes[-1][step])
+
+    new_branch = replace(nodes.pop())
+    for node, step in zip(reversed(nodes), reversed(path)):
+        if isinstance(node, dict):
+            fuzzdict = node.copy()
+        else:
+            fuzzdict = copy.copy(node)
+        fuzzdict[step] = new_branch
+        new_branch = fuzzdict
+    return new_branch
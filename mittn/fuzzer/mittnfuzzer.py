@@ -1,31 +1,125 @@
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
 from mittn.archiver import Archiver
 from mittn.fuzzer.pythonradamsa import PythonRadamsa
+from mittn.fuzzer.pythonmutator import PythonMutator
+from mittn.fuzzer.corpuscache import CorpusCache
 from mittn.fuzzer.anomalygenerator import AnomalyGenerator
 from mittn.fuzzer.checker import Checker
 from mittn.fuzzer.client import Client
+from mittn.fuzzer.rawclient import RawClient
+from mittn.fuzzer.sendpool import SendPool
+from mittn.fuzzer.ratecontrol import AdaptiveController
+from mittn.fuzzer.fuzzcase import FuzzCase
+from mittn.fuzzer.injectionplan import InjectionPlan
+from mittn.fuzzer.shard import Shard
+from mittn.fuzzer.scheduler import BudgetScheduler
+from mittn.fuzzer.clustering import ResponseClusters, response_signature
 from mittn.fuzzer.target import Target
-from mittn.config import Config
+from mittn.fuzzer.hooks import Hooks
+from mittn.config import Config, config_bool
 from mittn.fuzzer.fuzzerissue import FuzzerIssue
+from mittn.metrics import Metrics, MetricsWriter, PhaseProfiler, Tracer
+
+# The phases the metrics of a run are timed in, see Metrics.phase()
+PHASES = ('fuzz', 'generate', 'radamsa', 'serialize', 'valid_case', 'send', 'check', 'archive')
 
 class MittnFuzzer(object):
 
     def __init__(self, archiver=None, radamsa=None, generator=None,
-            checker=None, client=None,config=None):
+            checker=None, client=None,config=None, hooks=None):
         self.config = config or Config("fuzzer","mittn.conf")
+        # Counters, latencies and phase timings of the last run, see fuzz()
+        self.metrics = Metrics()
+        if self.config.trace_file:
+            self.metrics.tracer = Tracer(int(self.config.trace_limit))
+        if self.config.profile_phase:
+            if self.config.profile_phase not in PHASES:
+                raise ValueError("Unknown profile_phase %s, use one of %s"
+                        % (self.config.profile_phase, ', '.join(PHASES)))
+            if not self.config.profile_file:
+                raise ValueError("profile_phase needs a profile_file to write to")
+            self.metrics.profiler = PhaseProfiler(self.config.profile_phase,
+                    self.config.profile_file, self.config.profile_mode)
+        # Callbacks for the steps of the runs, see Hooks
+        self.hooks = hooks or Hooks()
         db_url = None
         if hasattr(self.config,'db_url'):
             db_url = self.config.db_url
-        self.archiver = archiver or Archiver(db_url)
-        radamsa = radamsa or PythonRadamsa(self.config.radamsa_path)
+        self.archiver = archiver or Archiver(db_url,
+                fingerprint_cache=config_bool(self.config.fingerprint_cache),
+                batch_size=int(self.config.insert_batch_size),
+                run_id=self.config.run_id or None,
+                background=config_bool(self.config.background_archiver),
+                queue_size=int(self.config.archiver_queue_size))
+        if self.config.injection not in ('fuzz', 'static', 'both'):
+            raise ValueError("Unknown injection %s, use fuzz, static or both"
+                    % self.config.injection)
+        if not radamsa:
+            seed = int(self.config.seed) if self.config.seed else None
+            if self.config.corpus_cache and seed is None:
+                # A random seed makes new fuzz values every run, so the
+                # cache would never be hit
+                raise ValueError("corpus_cache needs a fixed seed")
+            if self.config.mutator == 'builtin':
+                radamsa = PythonMutator(seed)
+            elif self.config.mutator == 'radamsa':
+                radamsa = PythonRadamsa(self.config.radamsa_path, seed=seed)
+            else:
+                raise ValueError("Unknown mutator %s, use radamsa or builtin"
+                        % self.config.mutator)
+            if self.config.corpus_cache:
+                radamsa = CorpusCache(radamsa, self.config.corpus_cache,
+                        int(self.config.corpus_cache_size) * 1024 * 1024)
         self.generator = generator or AnomalyGenerator(radamsa)
         self.checker = checker or Checker(
 			self.config.allowed_status_codes,
 			self.config.disallowed_status_codes,
-			self.config.body_errors)
-        self.client = client or Client()
+			self.config.body_errors,
+			int(self.config.body_scan_limit) if self.config.body_scan_limit else None)
+        if not client:
+            if self.config.http_engine == 'requests':
+                client = Client(
+                        keepalive=config_bool(self.config.keepalive),
+                        pool_size=int(self.config.pool_size))
+            elif self.config.http_engine == 'raw':
+                client = RawClient(
+                        keepalive=config_bool(self.config.keepalive),
+                        pool_size=int(self.config.pool_size),
+                        pipeline=int(self.config.pipeline),
+                        body_limit=int(self.config.response_body_limit) if self.config.response_body_limit else None)
+            else:
+                raise ValueError("Unknown http_engine %s, use requests or raw"
+                        % self.config.http_engine)
+        self.client = client
         self.client.timeout = int(self.config.timeout)
+        # The parts count in the metrics of the fuzzer, also the ones
+        # passed in
+        backend = self.generator.radamsa
+        for part in (self.archiver, self.checker, self.client, backend,
+                getattr(backend, 'backend', None)):
+            if hasattr(part, 'metrics'):
+                part.metrics = self.metrics
+        controller_factory = None
+        if config_bool(self.config.adaptive):
+            controller_factory = functools.partial(AdaptiveController,
+                    min_concurrency=int(self.config.min_concurrency),
+                    max_concurrency=int(self.config.host_concurrency or self.config.concurrency),
+                    min_rate=float(self.config.min_rate) if self.config.min_rate else None,
+                    max_rate=float(self.config.max_rate) if self.config.max_rate else None,
+                    latency_target=float(self.config.latency_target) if self.config.latency_target else None)
+        self.sendpool = SendPool(self.client, self.config.concurrency, controller_factory,
+                self.config.host_concurrency or None)
+        # The slice of the cases this run sends, e.g. '2/4'
+        self.shard = Shard.parse(self.config.shard)
 
         self.targets = []
+        # The BudgetScheduler of the last run with a time budget, with the
+        # coverage of the run
+        self.scheduler = None
+        # The static anomalies with their encoded variants, created once
+        self.static_anomalies = None
 
     def init(self):
         #create and test database connection
@@ -39,25 +133,354 @@ class MittnFuzzer(object):
         pass
 
     def fuzz(self):
-        methods = self.config.methods
+        """Fuzz all the added targets. The metrics of the run are written
+        to the files in metrics_json and metrics_prometheus at the end, and
+        every metrics_interval seconds during the run if it is set. The
+        spans and the profile, if configured, are written at the end.
+        The metrics and the spans start over with every run.
+        """
+        self.metrics.reset()
+        writer = MetricsWriter(self.metrics,
+                float(self.config.metrics_interval or 0),
+                self.config.metrics_json or None,
+                self.config.metrics_prometheus or None,
+                tool=FuzzerIssue.tool)
+        if self.config.metrics_interval and (writer.json_path or writer.prometheus_path):
+            writer.start()
+        try:
+            with self.metrics.phase('fuzz'):
+                self._fuzz()
+        finally:
+            writer.stop()
+            if self.metrics.tracer is not None:
+                self.metrics.tracer.write(self.config.trace_file)
+            if self.metrics.profiler is not None:
+                self.metrics.profiler.write()
+
+    def _fuzz(self):
+        scheduler = None
+        if self.config.time_budget:
+            # Generating the fuzz values counts against the budget
+            scheduler = BudgetScheduler(float(self.config.time_budget),
+                    self.config.coverage_file or None,
+                    turn_cases=int(self.config.turn_cases))
+            scheduler.start()
+            self.scheduler = scheduler
+
+        fuzzed_anomalies = self._anomalies(self.targets)
+
+        processes = int(self.config.processes)
+        if self.config.time_budget:
+            if processes > 1:
+                raise ValueError("time_budget cannot be used with more than one process")
+            self._fuzz_budgeted(fuzzed_anomalies, scheduler)
+            self.archiver.flush()
+            return
+
+        if processes > 1:
+            self._fuzz_processes(fuzzed_anomalies, processes)
+            self.archiver.flush()
+            return
+
+        if config_bool(self.config.interleave):
+            self._fuzz_interleaved(fuzzed_anomalies)
+            self.archiver.flush()
+            return
+
         #fuzz and inject all the added targets
+        for target, anomalies in zip(self.targets, fuzzed_anomalies):
+            self._check_valid(target)
+            cases = self._cases(target, anomalies, self.shard)
+            # Check and archive each response as soon as it arrives, so that
+            # only the requests in flight are held in memory. With
+            # clustering, only one issue per cluster is held until the
+            # target is done.
+            clusters = self._clusters()
+            try:
+                for case, response in self.sendpool.send(target, cases):
+                    newissue = self._check(target, response, case)
+                    if newissue is not None:
+                        self._found(newissue, clusters)
+            finally:
+                self._archive_clusters(clusters)
+        self.archiver.flush()
+
+    def _fuzz_budgeted(self, fuzzed_anomalies, scheduler):
+        """Fuzz the targets in turns until the time budget runs out, see
+        BudgetScheduler.
+        """
+        amount = self._amount()
+        turns = scheduler.schedule(self.targets, amount)
         for target in self.targets:
-			#TODO: authentication or re-authentication should be done before thesting the valid target.
+            self._check_valid(target)
+
+        anomalies = dict(zip([id(target) for target in self.targets], fuzzed_anomalies))
+        clusters = self._clusters()
+        try:
+            for target, index in turns:
+                cases = scheduler.cases(target, index,
+                        self._cases(target, anomalies[id(target)], self.shard, [index]),
+                        amount)
+                for case, response in self.sendpool.send(target, cases):
+                    newissue = self._check(target, response, case)
+                    if newissue is not None:
+                        self._found(newissue, clusters)
+                if scheduler.cut:
+                    # The next run continues from the first case not sent
+                    break
+        finally:
+            self._archive_clusters(clusters)
+            scheduler.save()
+
+    def _fuzz_interleaved(self, fuzzed_anomalies):
+        """Fuzz all the targets at the same time, see SendPool.send_all()"""
+        for target in self.targets:
+            self._check_valid(target)
+
+        clusters = self._clusters()
+        try:
+            for target, case, response in self.sendpool.send_all(self._streams(fuzzed_anomalies, self.shard)):
+                newissue = self._check(target, response, case)
+                if newissue is not None:
+                    self._found(newissue, clusters)
+        finally:
+            self._archive_clusters(clusters)
+
+    def _streams(self, fuzzed_anomalies, shard):
+        # The cases of each target for SendPool.send_all()
+        return [(target, self._cases(target, anomalies, shard))
+                for target, anomalies in zip(self.targets, fuzzed_anomalies)]
+
+    def _fuzz_processes(self, fuzzed_anomalies, processes):
+        """Split this run's shard between worker processes. The workers only
+        send and check, the issues they find are archived here in the same
+        order as a single process would have.
+        """
+        for target in self.targets:
+            self._check_valid(target)
+
+        found = []
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_find_issues, self, fuzzed_anomalies, shard)
+                       for shard in self.shard.split(processes)]
+            for future in futures:
+                worker_found, snapshot = future.result()
+                found.extend(worker_found)
+                self.metrics.merge(snapshot)
+
+        found.sort(key=lambda item: item[0])
+        clusters = self._clusters()
+        for order, newissue in found:
+            self._found(newissue, clusters)
+        self._archive_clusters(clusters)
+
+    def _anomalies(self, targets):
+        """The anomaly dicts of the targets, with the fuzz values, the
+        static anomalies or both, as configured in injection. The static
+        anomalies come after the fuzz values under every key, so their
+        anomaly indices start from the number of fuzz values.
+        """
+        self.hooks.call('before_generate', targets)
+        with self.metrics.phase('generate'):
+            fuzzed_anomalies = self._generate_anomalies(targets)
+        self.hooks.call('after_generate', targets, fuzzed_anomalies)
+        return fuzzed_anomalies
+
+    def _generate_anomalies(self, targets):
+        if self.config.injection == 'static':
+            # The same dict serves every target
+            return [{None: self._static_anomalies()}] * len(targets)
+
+        # Fuzz the values of all targets in one batch
+        fuzzed_anomalies = self.generator.fuzz_submissions(
+                [[target.valid_submission] for target in targets],
+                int(self.config.anomalies))
+        if self.config.injection == 'both':
+            static = self._static_anomalies()
+            fuzzed_anomalies = [dict((key, values + static) for key, values in anomalies.items())
+                                for anomalies in fuzzed_anomalies]
+        return fuzzed_anomalies
+
+    def _static_anomalies(self):
+        if self.static_anomalies is None:
+            self.static_anomalies = list(self.generator.generate_static(
+                    encodings=self.config.static_encodings or ('raw',)))
+        return self.static_anomalies
+
+    def _amount(self):
+        # The number of anomalies injected at each point
+        amount = 0
+        if self.config.injection in ('fuzz', 'both'):
+            amount += int(self.config.anomalies)
+        if self.config.injection in ('static', 'both'):
+            amount += len(self._static_anomalies())
+        return amount
+
+    def _clusters(self):
+        # Holds the issues to archive, if responses are clustered
+        if config_bool(self.config.cluster_responses):
+            return ResponseClusters(int(self.config.cluster_distance))
+        return None
+
+    def _found(self, newissue, clusters):
+        self.hooks.call('on_issue', newissue)
+        if clusters is None:
+            self.archiver.add_if_not_found(newissue)
+        else:
+            clusters.add(newissue)
+
+    def _archive_clusters(self, clusters):
+        # Archive one issue per cluster, with the hits of the cluster
+        if clusters is not None:
+            for newissue in clusters.issues():
+                self.archiver.add_if_not_found(newissue)
+
+    def _find_issues(self, fuzzed_anomalies, shard):
+        """Fuzz the cases of a shard and return the issues found as a list
+        of (sort key, issue), without archiving them.
+        """
+        found = []
+        if config_bool(self.config.interleave):
+            target_nos = dict((id(target), target_no) for target_no, target in enumerate(self.targets))
+            for target, case, response in self.sendpool.send_all(self._streams(fuzzed_anomalies, shard)):
+                newissue = self._check(target, response, case)
+                if newissue is not None:
+                    found.append(((target_nos[id(target)],) + case.order, newissue))
+            return found
+
+        for target_no, (target, anomalies) in enumerate(zip(self.targets, fuzzed_anomalies)):
+            for case, response in self.sendpool.send(target, self._cases(target, anomalies, shard)):
+                newissue = self._check(target, response, case)
+                if newissue is not None:
+                    found.append(((target_no,) + case.order, newissue))
+        return found
+
+    def _check_valid(self, target):
+        #TODO: authentication or re-authentication should be done before thesting the valid target.
+        with self.metrics.phase('valid_case'):
             resp = self.client.do_target(target, target.method, target.valid_submission);
-            if self.checker.check(resp):
-                #the request either returned a bad code or an exception occured.
-                #since this is testing a vlid case, this should not happen, fail
-                #the test run and print some diagnostics.
-                raise Exception("The valid case for %s failed, check that the target is up and reachable." % (target.scenario_id))
-            responses = []
-            for payload in self.generator.generate_anomalies(target.valid_submission,
-                    [target.valid_submission],
-                    int(self.config.anomalies)):
-				#TODO: here valic case instrumentation should be done
-                for method in methods:
-                    responses.append( self.client.do_target(target, method, payload))
-			#TODO: inject with static anomalies here. The current AnomalyGenerator is broken.
-            for response in responses:
-                if self.checker.check(response):
-                    newissue = FuzzerIssue.from_resp_or_exc(target.scenario_id, response)
-                    self.archiver.add_if_not_found(newissue)
+        if self.checker.check(resp):
+            #the request either returned a bad code or an exception occured.
+            #since this is testing a vlid case, this should not happen, fail
+            #the test run and print some diagnostics.
+            raise Exception("The valid case for %s failed, check that the target is up and reachable." % (target.scenario_id))
+
+    def _check(self, target, response, case=None):
+        # Returns a new issue if the response failed the checks
+        self.metrics.count('cases_sent', target=target.scenario_id)
+        self.hooks.call('after_send', target, case, response)
+        failed = self.checker.check(response)
+        self.hooks.call('after_check', target, case, response, failed)
+        if failed:
+            self.metrics.count('cases_failed', target=target.scenario_id)
+            issue = FuzzerIssue.from_resp_or_exc(target.scenario_id, response,
+                    case_id=case.case_id if case is not None else None,
+                    seed=self.seed)
+            if config_bool(self.config.cluster_responses):
+                issue.signature = response_signature(response)
+            return issue
+        return None
+
+    @property
+    def seed(self):
+        """The seed of the fuzzer backend, which makes the run repeatable"""
+        return getattr(self.generator.radamsa, 'seed', None)
+
+    def replay(self, case_id, seed=None):
+        """Create a single fuzz case again from its case id, and send it.
+
+        The case is created the same way as in the run that found it, so
+        the target must have been added, and the mutator and the number of
+        anomalies must be configured as they were in that run. The case id
+        and the seed of the run are stored in the issues of the run.
+
+        :param case_id: The case_id of a FuzzerIssue
+        :param seed: The seed of the run, if not the configured one
+        :return: (FuzzCase, Response or RequestException, new FuzzerIssue
+            or None if the response now passes the checks). The issue is
+            not archived.
+
+        """
+        scenario_id, index, point_index, method = FuzzCase.parse_case_id(case_id)
+        targets = [target for target in self.targets if target.scenario_id == scenario_id]
+        if not targets:
+            raise ValueError("No target with scenario id %s has been added" % scenario_id)
+        target = targets[0]
+        amount = self._amount()
+        if index >= amount:
+            raise ValueError("Case %s needs at least %d anomalies, %d configured"
+                    % (case_id, index + 1, amount))
+        # The point index is in the full plan, even if the plan of the
+        # target has been narrowed down since
+        plan = InjectionPlan.from_submission(target.valid_submission)
+        if point_index >= len(plan):
+            raise ValueError("Case %s has no injection point %d, the valid submission of %s has %d"
+                    % (case_id, point_index, scenario_id, len(plan)))
+        point = plan[point_index]
+
+        backend = self.generator.radamsa
+        run_seed = self.seed
+        if seed is not None:
+            backend.seed = int(seed)
+        try:
+            # Only the values of this target are fuzzed
+            anomalies = self._anomalies([target])[0]
+        finally:
+            if seed is not None:
+                backend.seed = run_seed
+
+        injection = dict((key, values[index]) for key, values in anomalies.items())
+        methods = self.config.methods
+        method_no = methods.index(method) if method in methods else len(methods)
+        case = FuzzCase(target, index, point, method_no, method, injection,
+                self._body(target, point, injection))
+
+        response = self.client.send_body(target, case.method, case.body)
+        issue = self._check(target, response, case)
+        if issue is not None and seed is not None:
+            issue.seed = str(seed)
+        return case, response, issue
+
+    def _cases(self, target, anomalies, shard, indices=None):
+        # FuzzCases for every anomaly (or the ones with the given indices)
+        # of the target that belong to the shard
+        methods = self.config.methods
+        for index, point, injection in self.generator.generate_cases(target.valid_submission,
+                [target.valid_submission],
+                self._amount(),
+                anomalies,
+                target.plan,
+                indices):
+            #TODO: here valic case instrumentation should be done
+            body = None
+            for method_no, method in enumerate(methods):
+                if not shard.owns(target.scenario_id, index, point.index, method):
+                    continue
+                if body is None:
+                    body = self._body(target, point, injection)
+                self.metrics.count('cases_generated', target=target.scenario_id)
+                case = FuzzCase(target, index, point, method_no, method, injection, body)
+                self.hooks.call('after_serialize', case)
+                yield case
+
+    def _body(self, target, point, injection):
+        # The serialised submission of a case. Only the injected value is
+        # serialised, unless the template cannot splice it.
+        with self.metrics.phase('serialize'):
+            body = target.template.render(point, injection)
+            if body is None:
+                body = self.client.serialise(target, point.apply(target.valid_submission, injection))
+        return body
+
+    def __getstate__(self):
+        # Worker processes get a copy of the fuzzer, but the database
+        # stays with the parent
+        state = self.__dict__.copy()
+        state['archiver'] = Archiver()
+        return state
+
+
+def _find_issues(fuzzer, fuzzed_anomalies, shard):
+    # Entry point of the worker processes. The metrics of the worker are
+    # added to the parent's.
+    return fuzzer._find_issues(fuzzed_anomalies, shard), fuzzer.metrics.snapshot(spans=True)
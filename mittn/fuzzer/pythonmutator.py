@@ -0,0 +1,238 @@
+import random
+import re
+import zlib
+from collections import OrderedDict
+
+from mittn.fuzzer.utils import sample_values
+
+# Splits samples into numbers, words, whitespace runs and single other bytes
+TOKEN_RE = re.compile(rb'\d+|[A-Za-z]+|\s+|.', re.DOTALL)
+
+# Values that tend to sit on the edges of parsers and integer types
+BOUNDARY_VALUES = [
+    b'', b'0', b'-0', b'1', b'-1', b'00', b'0x0',
+    b'127', b'128', b'255', b'256', b'-129',
+    b'32767', b'32768', b'65535', b'65536',
+    b'2147483647', b'2147483648', b'-2147483648', b'-2147483649',
+    b'4294967295', b'4294967296',
+    b'9223372036854775807', b'9223372036854775808',
+    b'-9223372036854775808', b'-9223372036854775809',
+    b'18446744073709551616', str(2 ** 256).encode(),
+    b'1e309', b'-1e309', b'1e-400', b'0.1', b'NaN', b'Infinity', b'-Infinity',
+    b'true', b'false', b'null', b'None', b'undefined', b'[]', b'{}',
+]
+
+# Bytes that are meaningful to parsers, escapers and C strings
+INTERESTING_BYTES = b'\x00\x01\x07\x08\x0a\x0d\x09\x1a\x1b\x7f\x80\xc0\xfe\xff' \
+                    b' "\'\\%&;<>{}[]()|`$,=#'
+
+# Byte sequences that break or confuse Unicode decoders
+ENCODING_SEQUENCES = [
+    b'\xc0\xaf', b'\xe0\x80\xaf',  # Overlong '/'
+    b'\xc0\x80',  # Overlong NUL
+    b'\xc3', b'\xe2\x82', b'\xf0\x9f\x92',  # Truncated sequences
+    b'\x80', b'\xbf',  # Lone continuation bytes
+    b'\xed\xa0\x80', b'\xed\xbf\xbf',  # UTF-16 surrogates
+    b'\xf4\x90\x80\x80',  # Beyond U+10FFFF
+    b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff',  # Byte order marks
+    '\u202e'.encode('utf-8'),  # Right-to-left override
+    '\u0130'.encode('utf-8'),  # Changes length when lowercased
+    '\ufdd0'.encode('utf-8'),  # Noncharacter
+    '\U0001f4a9'.encode('utf-8'),  # Outside the BMP
+]
+
+
+class PythonMutator(object):
+    """In-process fuzzer backend with the same interface as PythonRadamsa.
+
+    It does not need the Radamsa binary, and every value is reproducible:
+    case number n of a key depends only on the seed, the valid values of
+    the key and n. The valid values are tokenised once per batch and the
+    tokens are shared by all the cases created from them.
+    """
+
+    name = 'builtin'
+
+    def __init__(self, seed=None, max_mutations=3):
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 32)
+        self.seed = seed
+        # How many byte-level mutations can be stacked on one case
+        self.max_mutations = max_mutations
+        self.byte_mutations = [
+            self._flip_bit,
+            self._replace_byte,
+            self._insert_byte,
+            self._delete_range,
+            self._repeat_range,
+            self._insert_encoding,
+        ]
+        self.token_mutations = [
+            self._swap_number,
+            self._repeat_token,
+            self._delete_token,
+            self._swap_tokens,
+        ]
+        self.value_mutations = [
+            self._boundary_value,
+            self._percent_encode,
+            self._utf16,
+            self._overlong,
+        ]
+
+    def fuzz_values(self, valuedict, no_of_fuzzcases):
+        """Run every key's valid value list through a fuzzer.
+
+        :param valuedict: Dict of collected valid values
+        :param no_of_fuzzcases: How many injection cases to produce
+
+        """
+        return self.fuzz_batch([valuedict], no_of_fuzzcases)[0]
+
+    def fuzz_batch(self, valuedicts, no_of_fuzzcases):
+        """Run the valid value lists of several value dicts through the
+        fuzzer. Keys with the same valid values share the same fuzz cases.
+
+        :param valuedicts: List of dicts of collected valid values
+        :param no_of_fuzzcases: How many injection cases to produce per key
+        :return: List of fuzz dicts, one for each value dict
+
+        """
+        fuzzlists = OrderedDict()
+        fuzzes = []  # Will hold the result
+        for valuedict in valuedicts:
+            fuzz = {}
+            for key in valuedict.keys():
+                samples = sample_values(valuedict, key)
+                if samples not in fuzzlists:
+                    fuzzlists[samples] = self._get_fuzz(samples, no_of_fuzzcases)
+                fuzz[key] = fuzzlists[samples]
+            fuzzes.append(fuzz)
+        return fuzzes
+
+    def _get_fuzz(self, samples, no_of_fuzzcases):
+        """Create fuzz cases from a set of valid values.
+
+        :param samples: Valid values as bytes
+        :param no_of_fuzzcases: Number of fuzz cases to generate
+        :return: List of fuzz cases as bytes
+
+        """
+        samples = samples or (b'',)
+        tokenised = [TOKEN_RE.findall(sample) for sample in samples]
+        # Identifies this set of samples in the per-case seeds
+        sample_hash = zlib.crc32(b'\x00'.join(samples))
+
+        fuzzlist = []
+        for case_no in range(no_of_fuzzcases):
+            rnd = random.Random('%d:%d:%d' % (self.seed, sample_hash, case_no))
+            index = rnd.randrange(len(samples))
+            kind = rnd.random()
+            if kind < 0.15:
+                data = rnd.choice(self.value_mutations)(rnd, samples[index])
+            elif kind < 0.5:
+                tokens = list(tokenised[index])
+                data = b''.join(rnd.choice(self.token_mutations)(rnd, tokens))
+            else:
+                data = samples[index]
+            for _ in range(rnd.randint(0 if kind < 0.5 else 1, self.max_mutations)):
+                data = rnd.choice(self.byte_mutations)(rnd, data)
+            fuzzlist.append(data)
+        return fuzzlist
+
+    # Byte-level mutations
+
+    @staticmethod
+    def _flip_bit(rnd, data):
+        if not data:
+            return bytes([1 << rnd.randrange(8)])
+        pos = rnd.randrange(len(data))
+        return data[:pos] + bytes([data[pos] ^ (1 << rnd.randrange(8))]) + data[pos + 1:]
+
+    @staticmethod
+    def _replace_byte(rnd, data):
+        if not data:
+            return bytes([rnd.choice(INTERESTING_BYTES)])
+        pos = rnd.randrange(len(data))
+        return data[:pos] + bytes([rnd.choice(INTERESTING_BYTES)]) + data[pos + 1:]
+
+    @staticmethod
+    def _insert_byte(rnd, data):
+        pos = rnd.randint(0, len(data))
+        return data[:pos] + bytes([rnd.choice(INTERESTING_BYTES)]) + data[pos:]
+
+    @staticmethod
+    def _delete_range(rnd, data):
+        if not data:
+            return data
+        start = rnd.randrange(len(data))
+        end = rnd.randint(start + 1, len(data))
+        return data[:start] + data[end:]
+
+    @staticmethod
+    def _repeat_range(rnd, data):
+        if not data:
+            return b'A' * (2 ** rnd.randint(1, 16))
+        start = rnd.randrange(len(data))
+        end = rnd.randint(start + 1, min(len(data), start + 16))
+        return data[:end] + data[start:end] * (2 ** rnd.randint(1, 12)) + data[end:]
+
+    @staticmethod
+    def _insert_encoding(rnd, data):
+        pos = rnd.randint(0, len(data))
+        return data[:pos] + rnd.choice(ENCODING_SEQUENCES) + data[pos:]
+
+    # Token-level mutations, these operate on a list of tokens
+
+    @staticmethod
+    def _swap_number(rnd, tokens):
+        numbers = [i for i, token in enumerate(tokens) if token.isdigit()]
+        pos = rnd.choice(numbers) if numbers else rnd.randint(0, len(tokens))
+        tokens[pos:pos + 1] = [rnd.choice(BOUNDARY_VALUES)]
+        return tokens
+
+    @staticmethod
+    def _repeat_token(rnd, tokens):
+        if tokens:
+            pos = rnd.randrange(len(tokens))
+            tokens[pos:pos + 1] = [tokens[pos]] * (2 ** rnd.randint(1, 10))
+        return tokens
+
+    @staticmethod
+    def _delete_token(rnd, tokens):
+        if tokens:
+            del tokens[rnd.randrange(len(tokens))]
+        return tokens
+
+    @staticmethod
+    def _swap_tokens(rnd, tokens):
+        if len(tokens) > 1:
+            a, b = rnd.sample(range(len(tokens)), 2)
+            tokens[a], tokens[b] = tokens[b], tokens[a]
+        return tokens
+
+    # Whole-value replacements and encoding tricks
+
+    @staticmethod
+    def _boundary_value(rnd, data):
+        return rnd.choice(BOUNDARY_VALUES)
+
+    @staticmethod
+    def _percent_encode(rnd, data):
+        # Encode every byte, sometimes twice
+        encoded = b''.join(b'%%%02X' % c for c in data)
+        if rnd.random() < 0.5:
+            encoded = encoded.replace(b'%', b'%25')
+        return encoded
+
+    @staticmethod
+    def _utf16(rnd, data):
+        # Wide encodings, with or without a byte order mark
+        text = data.decode('utf-8', 'replace')
+        return text.encode(rnd.choice(['utf-16', 'utf-16-be', 'utf-32']))
+
+    @staticmethod
+    def _overlong(rnd, data):
+        # Two-byte overlong encoding of all ASCII characters
+        return b''.join(bytes([0xc0 | (c >> 6), 0x80 | (c & 0x3f)]) if c < 0x80
+                        else bytes([c]) for c in data)
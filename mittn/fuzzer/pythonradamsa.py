@@ -1,14 +1,31 @@
+import random
 import subprocess
 import tempfile
 import shutil
-import six
-import codecs
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from mittn.fuzzer.utils import sample_values
+from mittn.metrics import Metrics
+
+# Scratch files are kept on an in-memory filesystem when there is one
+SCRATCH_DIR = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
 
 class PythonRadamsa(object):
 
-    def __init__(self, path):
+    name = 'radamsa'
+
+    def __init__(self, path, parallelism=None, seed=None, metrics=None):
         self.radamsa_path = path
+        # Radamsa creates the same fuzz cases from the same samples and seed
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 32)
+        self.seed = seed
+        # How many Radamsa processes to run at the same time
+        self.parallelism = parallelism or os.cpu_count() or 1
+        # Counts the Radamsa runs and the time spent in them
+        self.metrics = metrics or Metrics()
 
         # Ensure that binary exists
         try:
@@ -23,64 +40,89 @@ class PythonRadamsa(object):
         :param no_of_fuzzcases: How many injection cases to produce
 
         """
-        fuzzes = {}  # Will hold the result
-        for key in valuedict.keys():
-            if len(valuedict[key]) == 0:
-                # If no values for a key, use the samples under the None key
-                fuzzes[key] = self._get_fuzz(valuedict[None], no_of_fuzzcases)
-            else:
-                # Use the samples collected for the specific key
-                fuzzes[key] = self._get_fuzz(valuedict[key], no_of_fuzzcases)
+        return self.fuzz_batch([valuedict], no_of_fuzzcases)[0]
+
+    def fuzz_batch(self, valuedicts, no_of_fuzzcases):
+        """Run the valid value lists of several value dicts (e.g. one for
+        each target) through the fuzzer in one go.
 
+        Radamsa cannot tell which of its outputs came from which samples,
+        so each distinct list of valid values still needs a run of its own.
+        Keys that have the same valid values, in any of the dicts, share a
+        run, and the runs are done in parallel in a single scratch
+        directory on an in-memory filesystem where one is available.
+
+        :param valuedicts: List of dicts of collected valid values
+        :param no_of_fuzzcases: How many injection cases to produce per key
+        :return: List of fuzz dicts, one for each value dict
+
+        """
+        samplesets = OrderedDict()
+        for valuedict in valuedicts:
+            for key in valuedict.keys():
+                samplesets[sample_values(valuedict, key)] = None
+
+        scratch_directory = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+                for index, samples in enumerate(samplesets):
+                    prefix = os.path.join(scratch_directory, str(index))
+                    samplesets[samples] = executor.submit(
+                        self._get_fuzz, samples, no_of_fuzzcases, prefix)
+            fuzzlists = dict((samples, future.result())
+                             for samples, future in samplesets.items())
+        finally:
+            shutil.rmtree(scratch_directory)
+
+        fuzzes = []  # Will hold the result
+        for valuedict in valuedicts:
+            fuzzes.append(dict(
+                (key, fuzzlists[sample_values(valuedict, key)])
+                for key in valuedict.keys()))
         return fuzzes
 
-    def _get_fuzz(self, valuelist, no_of_fuzzcases):
+    def _get_fuzz(self, samples, no_of_fuzzcases, prefix):
         """Run Radamsa on a set of valid values.
 
-        :param valuelist: Valid cases to feed to Radamsa.
+        :param samples: Valid cases to feed to Radamsa, as bytes.
         :param no_of_fuzzcases: Number of fuzz cases to generate.
-        :return:
+        :param prefix: Path prefix for the files of this run.
+        :return: List of fuzz cases as bytes
 
         """
-        # Radamsa is a file-based fuzzer so we need to write the valid strings out to file
-        # XXX: Isn't there also piping mechanism? Though writing files might be easier, still...
-        valid_case_directory = tempfile.mkdtemp()
-        fuzz_case_directory = tempfile.mkdtemp()
+        command = [
+            self.radamsa_path,
+            "-o", prefix + "-%n.fuzz",
+            "-n", str(no_of_fuzzcases),
+            "--seed", str(self.seed)
+        ]
+        if len(samples) == 1:
+            # A single sample can be piped in
+            stdin = samples[0]
+        else:
+            # Radamsa is a file-based fuzzer so multiple samples need to
+            # be written out to files
+            stdin = b''
+            for index, sample in enumerate(samples):
+                sample_path = "%s-%d.case" % (prefix, index)
+                with open(sample_path, 'wb') as fh:
+                    fh.write(sample)
+                command.append(sample_path)
 
         try:
-            for valid_string in valuelist:
-                handle, tmpfile_path = tempfile.mkstemp(suffix='.case', dir=valid_case_directory)
-
-                # Radamsa only operates on strings, so make numbers and booleans
-                # into strings. (No, this won't fuzz effectively, use static
-                # injection to cover those cases.)
-                if isinstance(valid_string, (bool, six.integer_types, float)):
-                    valid_string = str(valid_string)
-
-                with codecs.open(tmpfile_path, 'wb', 'utf-8') as fh:
-                    fh.write(valid_string)
-
-            # Run Radamsa (one execution for all files)
-            try:
-                subprocess.check_call([
-                    self.radamsa_path,
-                    "-o", fuzz_case_directory + "/%n.fuzz",
-                    "-n", str(no_of_fuzzcases),
-                    "-r", valid_case_directory
-                ])
-            except subprocess.CalledProcessError as error:
-                assert False, "Could not execute Radamsa: %s" % error
-
-            # Read the fuzz cases from the output directory and return as list
-            fuzzlist = []
-            for filename in os.listdir(fuzz_case_directory):
-                # XXX: Radamsa produces even broken bytearrays, so we need to read contents as bytestr!
-                # FIXME: Python 3?
-                with open(os.path.join(fuzz_case_directory, filename), 'rb') as fh:
-                    fuzzlist.append(fh.read())
-
-        finally:
-            shutil.rmtree(valid_case_directory)
-            shutil.rmtree(fuzz_case_directory)
+            with self.metrics.phase('radamsa'):
+                subprocess.run(command, input=stdin, stdout=subprocess.DEVNULL,
+                        check=True)
+        except subprocess.CalledProcessError as error:
+            assert False, "Could not execute Radamsa: %s" % error
+        self.metrics.count('radamsa_runs')
+        self.metrics.count('fuzz_values', no_of_fuzzcases)
+
+        # Read the fuzz cases from the output files and return as list
+        fuzzlist = []
+        for case_no in range(1, no_of_fuzzcases + 1):
+            # XXX: Radamsa produces even broken bytearrays, so we need to read contents as bytestr!
+            with open("%s-%d.fuzz" % (prefix, case_no), 'rb') as fh:
+                fuzzlist.append(fh.read())
 
         return fuzzlist
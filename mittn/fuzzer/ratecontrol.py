@@ -0,0 +1,122 @@
+import threading
+import time
+
+from requests import RequestException
+
+# Responses that tell the host is overloaded, as opposed to a 500 that a
+# fuzz case is likely to have caused on its own
+OVERLOAD_STATUS_CODES = (429, 502, 503, 504)
+
+
+class AdaptiveController(object):
+    """Controls how many requests are in flight to a host, and optionally
+    how many are sent per second, with AIMD (additive increase,
+    multiplicative decrease) like TCP congestion control.
+
+    Every response that comes back in time without an overload status code
+    increases the limits: by one per round of responses, or doubles them
+    per round until the first overload ("slow start"). A timeout, a failed
+    connection, an overload status code, or a smoothed latency above the
+    latency target halves them, at most once per round trip. The limits
+    stay within the configured bounds.
+
+    The latency target is either configured, or four times the lowest
+    smoothed latency seen, i.e. the latency of the host when it is not
+    loaded.
+    """
+
+    def __init__(self, min_concurrency=1, max_concurrency=10, min_rate=None,
+                 max_rate=None, latency_target=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.concurrency = float(self.min_concurrency)
+        # Requests per second, None if the rate is not limited
+        self.min_rate = min_rate or 1.0
+        self.max_rate = max_rate
+        self.rate = float(self.min_rate) if max_rate else None
+        self.latency_target = latency_target
+        self.clock = clock
+        self.sleep = sleep
+
+        self.slow_start = True
+        self.latency = None       # Smoothed latency
+        self.min_latency = None   # Lowest smoothed latency
+        self.last_decrease = None
+        self.next_send = None
+        self.lock = threading.Lock()
+
+    @property
+    def limit(self):
+        """How many requests can be in flight"""
+        return int(self.concurrency)
+
+    def wait(self):
+        """Wait until the next request can be sent within the rate limit"""
+        if self.rate is None:
+            return
+        with self.lock:
+            now = self.clock()
+            send_at = max(self.next_send or now, now)
+            self.next_send = send_at + 1.0 / self.rate
+        if send_at > now:
+            self.sleep(send_at - now)
+
+    def delay(self):
+        """Seconds until the next request can be sent within the rate
+        limit, without waiting
+        """
+        with self.lock:
+            if self.rate is None or self.next_send is None:
+                return 0.0
+            return max(0.0, self.next_send - self.clock())
+
+    def record(self, resp_or_exc, latency):
+        """Adjust the limits after a response (or an exception) that took
+        latency seconds.
+        """
+        with self.lock:
+            if isinstance(resp_or_exc, RequestException):
+                overloaded = True
+            else:
+                overloaded = resp_or_exc.status_code in OVERLOAD_STATUS_CODES
+                self._update_latency(latency)
+                target = self.latency_target or 4 * self.min_latency
+                overloaded = overloaded or self.latency > target
+
+            if overloaded:
+                self._decrease()
+            else:
+                self._increase()
+
+    def _update_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        if self.min_latency is None or self.latency < self.min_latency:
+            self.min_latency = self.latency
+
+    def _increase(self):
+        # A round is as many responses as there are requests in flight
+        round_size = max(1.0, self.concurrency)
+        if self.slow_start:
+            self.concurrency += 1
+        else:
+            self.concurrency += 1 / round_size
+        self.concurrency = min(self.concurrency, self.max_concurrency)
+        if self.rate is not None:
+            self.rate += (self.rate if self.slow_start else 1.0) / round_size
+            self.rate = min(self.rate, self.max_rate)
+
+    def _decrease(self):
+        now = self.clock()
+        # The responses to requests sent before the previous decrease do
+        # not count, they were sent at the old limits
+        if self.last_decrease is not None and now - self.last_decrease < (self.latency or 0):
+            return
+        self.last_decrease = now
+        self.slow_start = False
+        self.concurrency = max(self.concurrency / 2, self.min_concurrency)
+        if self.rate is not None:
+            self.rate = max(self.rate / 2, self.min_rate)
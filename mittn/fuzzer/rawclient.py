@@ -0,0 +1,322 @@
+import datetime
+import socket
+import ssl
+import threading
+import time
+from urllib import parse
+
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+from requests.models import PreparedRequest, Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from mittn.fuzzer.client import Client
+
+# Longest status or header line, and most header lines, accepted
+MAX_LINE = 65536
+MAX_HEADERS = 100
+
+# Bytes read at a time when skipping the rest of a long body
+READ_SIZE = 65536
+
+
+class ConnectionClosed(Exception):
+    """The server closed the connection before sending a status line"""
+
+
+class RawConnection(object):
+
+    def __init__(self, sock, key):
+        self.sock = sock
+        self.file = sock.makefile('rb')
+        self.key = key  # (scheme, host, port)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class RawClient(Client):
+    """Sends the serialised submissions over plain sockets instead of
+    requests. Each request is written as is, without the URL quoting and
+    header checks of requests, and only the status, the headers and at
+    most body_limit bytes of the body of the response are kept.
+
+    With pipeline > 1, SendPool hands this many cases at a time to
+    send_bodies(), which writes them all on one connection before reading
+    the responses. Cases that the server did not answer before closing
+    the connection are sent again on a new connection.
+
+    The responses are requests Response objects and the failures requests
+    exceptions, so the checker and the issues handle them as before. The
+    body is not decompressed, so no Accept-Encoding is sent.
+    """
+
+    # Attributes kept when a client is pickled for a worker process
+    __attrs__ = Client.__attrs__ + ['pipeline', 'body_limit']
+
+    def __init__(self, keepalive=False, pool_size=10, pipeline=1, body_limit=None, metrics=None):
+        """
+        :param pipeline: How many requests to write on a connection before
+            reading their responses
+        :param body_limit: Most bytes kept of each response body, None for
+            no limit
+        """
+        super(RawClient, self).__init__(keepalive=keepalive, pool_size=pool_size,
+                                        metrics=metrics)
+        self.pipeline = max(1, int(pipeline))
+        self.body_limit = body_limit
+        self.timeout = None
+        del self.headers['Accept-Encoding']
+        if self.pipeline > 1:
+            self.headers['Connection'] = 'keep-alive'
+        self.connections = {}  # Idle connections per (scheme, host, port)
+        self.lock = threading.Lock()
+
+    def __setstate__(self, state):
+        super(RawClient, self).__setstate__(state)
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def send_body(self, target, method, body):
+        return self.send_bodies(target, [(method, body)])[0]
+
+    def send_bodies(self, target, requests):
+        """Send serialised submissions to a target, pipelined on one
+        connection when possible.
+
+        :param requests: List of (method, body)
+        :return: List of Responses or RequestExceptions, in the same order
+
+        """
+        split = parse.urlsplit(target.uri)
+        prepared = [self._prepare(target, split, method, body) for method, body in requests]
+        start = self.metrics.clock()
+        with self.metrics.phase('send', len(prepared)):
+            results = self._send_prepared(split, prepared)
+        # A pipelined request waits for the ones before it, so each one is
+        # counted with the time the whole batch took
+        seconds = self.metrics.clock() - start
+        for resp_or_exc in results:
+            self.record(target, resp_or_exc, seconds)
+        return results
+
+    def _send_prepared(self, split, prepared):
+        # The responses (or exceptions) of the prepared requests, sent
+        # again on a new connection after a connection is closed
+        results = []
+        while len(results) < len(prepared):
+            pending = prepared[len(results):]
+            try:
+                conn, reused = self._connect(split)
+            except socket.timeout as e:
+                results.append(ConnectTimeout(e, request=pending[0][0]))
+                continue
+            except OSError as e:
+                results.append(ConnectionError(e, request=pending[0][0]))
+                continue
+
+            answered = 0
+            try:
+                conn.sock.sendall(b''.join(data for request, data in pending))
+                for request, data in pending:
+                    resp, reusable = self._read_response(conn, request)
+                    results.append(resp)
+                    answered += 1
+                    if not reusable:
+                        break
+                else:
+                    self._release(conn)
+                    continue
+            except ConnectionClosed:
+                if answered == 0 and not reused:
+                    results.append(ConnectionError(
+                        'Connection closed without a response', request=pending[0][0]))
+            except socket.timeout as e:
+                results.append(ReadTimeout(e, request=pending[answered][0]))
+            except OSError as e:
+                if answered > 0 or not reused:
+                    results.append(ConnectionError(e, request=pending[answered][0]))
+            except ValueError as e:
+                # A malformed response was an answer, so it is not sent again
+                results.append(ConnectionError(e, request=pending[answered][0]))
+            # The rest of the requests are sent again on a new connection
+            conn.close()
+        return results
+
+    def _prepare(self, target, split, method, body):
+        # The PreparedRequest for the issues, and the bytes to send
+        if target.submission_type == 'urlparams':
+            url = target.uri + '?' + body
+            data = None
+        else:
+            url = target.uri
+            data = body.encode('iso-8859-1') if isinstance(body, str) else body
+        path = url[len(split.scheme) + 3 + len(split.netloc):] or '/'
+
+        headers = CaseInsensitiveDict()
+        headers['Host'] = split.netloc.rpartition('@')[2]
+        headers.update(self.headers)
+        if data is not None:
+            headers['Content-Length'] = str(len(data))
+        elif method not in ('GET', 'HEAD'):
+            headers['Content-Length'] = '0'
+
+        request = PreparedRequest()
+        request.method = method
+        request.url = url
+        request.headers = headers
+        request.body = body if data is not None else None
+
+        head = '%s %s HTTP/1.1\r\n%s\r\n' % (method, path, ''.join(
+            '%s: %s\r\n' % (name, value) for name, value in headers.items()))
+        return request, head.encode('iso-8859-1') + (data or b'')
+
+    def _connect(self, split):
+        # An idle connection from the pool, or a new one
+        port = split.port or (443 if split.scheme == 'https' else 80)
+        key = (split.scheme, split.hostname, port)
+        with self.lock:
+            idle = self.connections.get(key)
+            if idle:
+                return idle.pop(), True
+
+        sock = socket.create_connection((split.hostname, port), timeout=self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if split.scheme == 'https':
+                context = ssl.create_default_context()
+                if self.verify is False:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                sock = context.wrap_socket(sock, server_hostname=split.hostname)
+        except Exception:
+            sock.close()
+            raise
+        return RawConnection(sock, key), False
+
+    def _release(self, conn):
+        if self.headers.get('Connection', '').lower() == 'close':
+            conn.close()
+            return
+        with self.lock:
+            idle = self.connections.setdefault(conn.key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _read_response(self, conn, request):
+        """Read a response from a connection.
+
+        :return: (Response, whether the connection can be used again)
+
+        """
+        start = time.monotonic()
+        while True:
+            line = conn.file.readline(MAX_LINE + 1)
+            if not line:
+                raise ConnectionClosed()
+            version, status, reason = self._parse_status(line)
+            headers = self._read_headers(conn)
+            # Skip interim responses such as 100 Continue
+            if not 100 <= status < 200 or status == 101:
+                break
+
+        body, reusable = self._read_body(conn, request.method, status, headers)
+        connection = headers.get('Connection', '').lower()
+        if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+            reusable = False
+
+        resp = Response()
+        resp.status_code = status
+        resp.reason = reason
+        resp.headers = headers
+        resp._content = body
+        resp._content_consumed = True
+        resp.encoding = get_encoding_from_headers(headers)
+        resp.url = request.url
+        resp.request = request
+        resp.elapsed = datetime.timedelta(seconds=time.monotonic() - start)
+        return resp, reusable
+
+    @staticmethod
+    def _parse_status(line):
+        if len(line) > MAX_LINE:
+            raise ValueError('Status line too long')
+        parts = line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise ValueError('Bad status line %r' % line[:100])
+        return parts[0], int(parts[1]), parts[2] if len(parts) > 2 else ''
+
+    @staticmethod
+    def _read_headers(conn):
+        headers = CaseInsensitiveDict()
+        for _ in range(MAX_HEADERS + 1):
+            line = conn.file.readline(MAX_LINE + 1)
+            if len(line) > MAX_LINE:
+                raise ValueError('Header line too long')
+            if line in (b'\r\n', b'\n'):
+                return headers
+            if not line:
+                raise ValueError('Connection closed in the headers')
+            name, sep, value = line.decode('iso-8859-1').partition(':')
+            if not sep:
+                raise ValueError('Bad header line %r' % line[:100])
+            name, value = name.strip(), value.strip()
+            # Repeated headers are joined, as in requests
+            headers[name] = headers[name] + ', ' + value if name in headers else value
+        raise ValueError('Too many headers')
+
+    def _read_body(self, conn, method, status, headers):
+        # The body, or as much of it as is kept, and whether the connection
+        # can be used again
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            return b'', True
+        kept = bytearray()
+        if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            while True:
+                line = conn.file.readline(MAX_LINE + 1)
+                try:
+                    size = int(line.split(b';')[0].strip(), 16)
+                except ValueError:
+                    raise ValueError('Bad chunk size line %r' % line[:100])
+                if size == 0:
+                    break
+                self._read_exactly(conn, size, kept)
+                self._read_exactly(conn, 2, None)
+            # Trailers
+            self._read_headers(conn)
+            return bytes(kept), True
+        if 'Content-Length' in headers:
+            try:
+                length = int(headers['Content-Length'].split(',')[0])
+            except ValueError:
+                raise ValueError('Bad Content-Length %r' % headers['Content-Length'])
+            self._read_exactly(conn, length, kept)
+            return bytes(kept), True
+
+        # The body ends when the server closes the connection; it is only
+        # read up to the limit
+        limit = self.body_limit
+        while limit is None or limit > 0:
+            data = conn.file.read1(READ_SIZE if limit is None else min(limit, READ_SIZE))
+            if not data:
+                break
+            kept.extend(data)
+            if limit is not None:
+                limit -= len(data)
+        return bytes(kept), False
+
+    def _read_exactly(self, conn, size, kept):
+        # Read size bytes, keeping them in kept up to body_limit bytes in all
+        while size > 0:
+            data = conn.file.read(min(size, READ_SIZE))
+            if not data:
+                raise ValueError('Connection closed in the body')
+            size -= len(data)
+            if kept is None:
+                continue
+            if self.body_limit is not None:
+                data = data[:max(0, self.body_limit - len(kept))]
+            kept.extend(data)
@@ -0,0 +1,114 @@
+import itertools
+import json
+import os
+import time
+
+
+class BudgetScheduler(object):
+    """Spreads a wall-clock time budget over all the targets of a run.
+
+    The targets take turns: each turn sends the cases of one anomaly
+    index of a target, i.e. every injection point with every method, but
+    at most turn_cases of them. An anomaly index with more cases takes
+    several turns, so all the targets get fuzzed however short the
+    budget is. When the budget runs out, no more cases are started.
+
+    With a coverage file, each target continues from the first case the
+    previous runs did not send, so that the coverage grows over
+    successive runs, and the targets that have had the fewest turns go
+    first. This is most useful with a fixed seed, which makes every run
+    create the same fuzz values.
+    """
+
+    def __init__(self, budget, coverage_file=None, clock=time.monotonic, turn_cases=100):
+        self.budget = budget  # Seconds
+        self.coverage_file = coverage_file
+        self.clock = clock
+        self.turn_cases = max(1, int(turn_cases))
+        self.deadline = None
+        self.cut = False      # Whether the budget ran out in the middle of a turn
+        self.state = {}       # Per scenario id, as kept in the coverage file
+        self.coverage = {}    # Per scenario id, the anomaly indices done in this run
+
+    def start(self):
+        """Start the clock and read the coverage of the earlier runs"""
+        self.deadline = self.clock() + self.budget
+        if self.coverage_file and os.path.exists(self.coverage_file):
+            with open(self.coverage_file) as fh:
+                self.state = json.load(fh)
+
+    def expired(self):
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def schedule(self, targets, amount):
+        """Yield (target, anomaly index) turns until every target has had
+        every index or the budget has run out. The cases of each turn are
+        sent through cases().
+        """
+        if amount < 1:
+            raise ValueError("A time budget needs at least one anomaly to inject")
+        for target in targets:
+            state = self._state(target)
+            if state['next'] >= amount:
+                # Fewer anomalies than in the earlier runs
+                state['next'] = state['next'] % amount
+                state['offset'] = 0
+            self.coverage[target.scenario_id] = []
+        return self._turns(targets, amount)
+
+    def _turns(self, targets, amount):
+        # sorted() keeps the order of the targets with as many turns
+        active = sorted(targets, key=lambda target: self._state(target)['turns'])
+        while active:
+            for target in list(active):
+                if self.expired():
+                    return
+                yield target, self._state(target)['next']
+                if len(self.coverage[target.scenario_id]) >= amount:
+                    active.remove(target)
+
+    def cases(self, target, index, cases, amount):
+        """Pass the cases of a turn through: the cases of the anomaly index
+        that the earlier turns and runs did not send, at most turn_cases of
+        them, until the budget runs out.
+        """
+        state = self._state(target)
+        offset = state['offset'] if state['next'] == index else 0
+        self.cut = False
+        sent = 0
+        finished = False
+        try:
+            for case in itertools.islice(cases, offset, None):
+                if self.expired():
+                    self.cut = True
+                    return
+                if sent >= self.turn_cases:
+                    return
+                yield case
+                sent += 1
+            finished = True
+        finally:
+            state['turns'] += 1
+            if finished:
+                self.coverage[target.scenario_id].append(index)
+                state['next'] = (index + 1) % amount
+                state['offset'] = 0
+                state['anomalies_done'] += 1
+            else:
+                state['offset'] = offset + sent
+
+    def _state(self, target):
+        # The progress of a target, as kept in the coverage file
+        state = self.state.setdefault(target.scenario_id, {})
+        for key in ['next', 'offset', 'anomalies_done', 'turns']:
+            state.setdefault(key, 0)
+        return state
+
+    def save(self):
+        """Write the coverage file for the next run"""
+        if not self.coverage_file:
+            return
+        temp_path = self.coverage_file + '.tmp'
+        with open(temp_path, 'w') as fh:
+            json.dump(self.state, fh, indent=2, sort_keys=True)
+        os.replace(temp_path, self.coverage_file)
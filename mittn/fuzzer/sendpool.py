@@ -0,0 +1,227 @@
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib import parse
+
+
+class SendPool(object):
+    """Sends fuzz cases through a Client with a bounded number of requests
+    in flight. Results are yielded in the order the cases were given, so
+    the checker and the archiver see the same sequence as they would with
+    one request at a time.
+
+    With a controller factory, the number of requests in flight (and
+    possibly their rate) to each host is set by a controller made with it,
+    see ratecontrol.py. The concurrency is then the most threads used.
+
+    send_all() sends the cases of several targets at the same time, with
+    at most host_concurrency requests in flight to each host.
+    """
+
+    def __init__(self, client, concurrency=1, controller_factory=None, host_concurrency=None):
+        self.client = client
+        self.concurrency = max(1, int(concurrency))
+        self.host_concurrency = int(host_concurrency) if host_concurrency else None
+        self.controller_factory = controller_factory
+        self.controllers = {}  # Per host
+        self.lock = threading.Lock()
+
+    def controller(self, target):
+        """The controller of the host of a target, or None"""
+        if self.controller_factory is None:
+            return None
+        host = parse.urlsplit(target.uri).netloc
+        with self.lock:
+            if host not in self.controllers:
+                self.controllers[host] = self.controller_factory()
+            return self.controllers[host]
+
+    def send(self, target, cases):
+        """Send cases to a target and yield the responses (or exceptions).
+
+        :param target: The Target the cases are sent to
+        :param cases: Iterable of FuzzCases
+        :return: generator of (FuzzCase, Response or RequestException)
+
+        """
+        controller = self.controller(target)
+        pipeline = getattr(self.client, 'pipeline', 1)
+        if pipeline > 1:
+            for result in self._send_pipelined(target, cases, controller, pipeline):
+                yield result
+            return
+        if self.concurrency == 1 and controller is None:
+            # No point in spinning up threads for a single request
+            for case in cases:
+                yield case, self.client.send_body(target, case.method, case.body)
+            return
+
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for case in cases:
+                # Wait for the oldest request before going over the limit
+                limit = controller.limit if controller is not None else self.concurrency
+                while len(in_flight) >= limit:
+                    yield self._result(in_flight.popleft())
+                if controller is not None:
+                    controller.wait()
+                    future = executor.submit(self._send_controlled, controller, target, case)
+                else:
+                    future = executor.submit(
+                        self.client.send_body, target, case.method, case.body)
+                in_flight.append((case, future))
+            while in_flight:
+                yield self._result(in_flight.popleft())
+
+    def send_all(self, streams):
+        """Send the cases of several targets interleaved, and yield the
+        responses (or exceptions) as they arrive.
+
+        The targets take turns in starting requests, so that every host
+        gets its share. A host has at most host_concurrency requests (or
+        pipelined batches) in flight, or as many as its controller allows,
+        and all the hosts together at most concurrency. The results of
+        each target are yielded in the order of its cases; the results of
+        different targets are mixed.
+
+        :param streams: List of (Target, iterable of FuzzCases)
+        :return: generator of (Target, FuzzCase, Response or RequestException)
+
+        """
+        pipeline = getattr(self.client, 'pipeline', 1)
+        active = [_Stream(target, batches(cases, pipeline), self.controller(target))
+                  for target, cases in streams]
+        busy = Counter()  # Batches in flight per host
+        in_flight = 0
+        turn = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while active:
+                started = False
+                delay = None
+                # Start a batch for each stream that has room, taking turns
+                for offset in range(len(active)):
+                    stream = active[(turn + offset) % len(active)]
+                    if in_flight >= self.concurrency:
+                        break
+                    if stream.batches is None or busy[stream.host] >= self._host_limit(stream):
+                        continue
+                    if stream.controller is not None and stream.controller.delay() > 0:
+                        # Over the rate limit of the host for now
+                        delay = min(delay or 1.0, stream.controller.delay())
+                        continue
+                    batch = next(stream.batches, None)
+                    if batch is None:
+                        stream.batches = None
+                        continue
+                    if stream.controller is not None:
+                        stream.controller.wait()
+                    stream.pending.append((batch, executor.submit(
+                        self._send_batch, stream.controller, stream.target, batch)))
+                    busy[stream.host] += 1
+                    in_flight += 1
+                    started = True
+                turn += 1
+
+                # Yield what has arrived, in order within each stream
+                finished = False
+                for stream in active:
+                    while stream.pending and stream.pending[0][1].done():
+                        batch, future = stream.pending.popleft()
+                        busy[stream.host] -= 1
+                        in_flight -= 1
+                        finished = True
+                        for case, result in zip(batch, future.result()):
+                            yield stream.target, case, result
+                active = [stream for stream in active if stream.batches is not None or stream.pending]
+
+                if not started and not finished and active:
+                    heads = [stream.pending[0][1] for stream in active if stream.pending]
+                    if heads:
+                        wait(heads, timeout=delay, return_when=FIRST_COMPLETED)
+                    elif delay:
+                        time.sleep(delay)
+
+    def _host_limit(self, stream):
+        if stream.controller is not None:
+            return stream.controller.limit
+        return self.host_concurrency or self.concurrency
+
+    def _send_pipelined(self, target, cases, controller, pipeline):
+        # Like send(), but each thread sends pipeline cases at a time on a
+        # connection, see RawClient.send_bodies()
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for batch in batches(cases, pipeline):
+                limit = controller.limit if controller is not None else self.concurrency
+                while len(in_flight) >= limit:
+                    for result in self._batch_results(in_flight.popleft()):
+                        yield result
+                if controller is not None:
+                    controller.wait()
+                in_flight.append((batch, executor.submit(self._send_batch, controller, target, batch)))
+            while in_flight:
+                for result in self._batch_results(in_flight.popleft()):
+                    yield result
+
+    def _send_batch(self, controller, target, batch):
+        start = time.monotonic()
+        if len(batch) == 1:
+            results = [self.client.send_body(target, batch[0].method, batch[0].body)]
+        else:
+            results = self.client.send_bodies(target, [(case.method, case.body) for case in batch])
+        if controller is not None:
+            latency = time.monotonic() - start
+            for resp_or_exc in results:
+                controller.record(resp_or_exc, latency)
+        return results
+
+    @staticmethod
+    def _batch_results(item):
+        batch, future = item
+        return zip(batch, future.result())
+
+    def _send_controlled(self, controller, target, case):
+        start = time.monotonic()
+        resp_or_exc = self.client.send_body(target, case.method, case.body)
+        controller.record(resp_or_exc, time.monotonic() - start)
+        return resp_or_exc
+
+    @staticmethod
+    def _result(item):
+        case, future = item
+        return case, future.result()
+
+    def __getstate__(self):
+        # Worker processes control their own requests
+        state = self.__dict__.copy()
+        state['controllers'] = {}
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+class _Stream(object):
+    # The cases of a target in SendPool.send_all()
+
+    def __init__(self, target, batches, controller):
+        self.target = target
+        self.host = parse.urlsplit(target.uri).netloc
+        self.batches = batches        # None when all the batches have been started
+        self.controller = controller
+        self.pending = deque()        # (batch, future) not yielded yet
+
+
+def batches(iterable, size):
+    """Split an iterable into lists of size items, the last may be shorter"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,47 @@
+import zlib
+
+
+class Shard(object):
+    """A deterministic slice of the fuzz case space.
+
+    Every case is assigned to one of count shards by hashing its target,
+    anomaly index, injection point and method, so runs that split the
+    same cases over several processes or machines cover each case
+    exactly once.
+    """
+
+    def __init__(self, index=0, count=1):
+        if not 0 <= index < count:
+            raise ValueError("Shard %d is not between 0 and %d" % (index, count - 1))
+        self.index = index  # zero-based
+        self.count = count
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a shard specification like '2/4' (the second of four
+        shards). An empty specification means all cases.
+        """
+        if not spec:
+            return cls()
+        try:
+            number, count = [int(part) for part in spec.split('/')]
+        except ValueError:
+            raise ValueError("Shard %s is invalid. Must be of the form i/N" % spec)
+        return cls(number - 1, count)
+
+    def __repr__(self):
+        return '<Shard %d/%d>' % (self.index + 1, self.count)
+
+    def owns(self, scenario_id, index, point, method):
+        """Whether a case belongs to this shard."""
+        if self.count == 1:
+            return True
+        key = '%s\x00%d\x00%d\x00%s' % (scenario_id, index, point, method)
+        return zlib.crc32(key.encode('utf-8')) % self.count == self.index
+
+    def split(self, parts):
+        """Split this shard into parts shards, which together own the same
+        cases as this one.
+        """
+        return [Shard(self.index + self.count * part, self.count * parts)
+                for part in range(parts)]
@@ -24,8 +24,7 @@ STATIC_ANOMALIES = [
     # Valid cases
     "A harmless string",  # Something easy to start with
     str(b'\xc3\xa5\xc3\xa4\xc3\xb6', 'utf-8'),  # Scandinavian characters as Unicode UTF-8
-]
-"""
+
     # SQL and NoSQL injections
     "' --",  # SQL: End statement, start comment
     "' or 'x'='x' --",  # SQL: always true for strings
@@ -217,4 +216,3 @@ STATIC_ANOMALIES = [
     ":-) =) XD o_O" * 10000,  # Rendering a lot of animated emoticons can cause pain
     "A" * (1024 * 1024)  # 1 MB
 ]
-"""
@@ -1,4 +1,6 @@
 from mittn.fuzzer.utils import urlparams_to_dict
+from mittn.fuzzer.injectionplan import InjectionPlan
+from mittn.fuzzer.template import RequestTemplate
 from urllib import parse
 import json
 
@@ -18,3 +20,17 @@ class Target():
 
         elif self.submission_type == 'urlencode':
             self.valid_submission = parse.parse_qs(valid_submission)
+
+        # Where anomalies are injected in the valid submission. This can be
+        # replaced with a filtered or sampled plan before fuzzing.
+        self.plan = InjectionPlan.from_submission(self.valid_submission)
+        self._template = None
+
+    @property
+    def template(self):
+        """The RequestTemplate of the valid submission, compiled when the
+        first case is made
+        """
+        if self._template is None:
+            self._template = RequestTemplate(self.submission_type, self.valid_submission)
+        return self._template
@@ -0,0 +1,195 @@
+import json
+from urllib import parse
+
+from mittn.fuzzer.utils import bytedecoder, serialise_to_url
+
+
+class RequestTemplate(object):
+    """The valid submission of a target serialised once, as Client sends it,
+    with the place of each injection point in the text. The body of a fuzz
+    case is then made by serialising only the injected key or value and
+    splicing it between the text around the point, instead of serialising
+    the whole fuzzed submission.
+
+    render() gives the same text as Client.serialise() of the fuzzed
+    submission, or None for the few cases that cannot be spliced, e.g.
+    when an injected key replaces another key of the same dict. Those
+    have to be serialised in full.
+    """
+
+    def __init__(self, submission_type, submission):
+        self.submission_type = submission_type
+        self.submission = submission
+        self.values = {}   # Path of a value -> (start, end) of the value in body
+        self.members = {}  # Path of a dict -> [(start, value start, end)] of its members
+        self.keys = {}     # Path of a dict -> {key: index in members}
+        if submission_type == 'json':
+            self.separator = ', '
+            self.body = self._compile_json(submission)
+        elif submission_type == 'urlencode':
+            self.separator = '&'
+            self.body = self._compile_url(submission)
+        elif submission_type == 'urlparams':
+            self.separator = ';'
+            self.body = self._compile_urlparams(submission)
+        else:
+            raise NotImplementedError
+
+    def render(self, point, anomaly_dict):
+        """The serialised submission with the anomaly from anomaly_dict
+        injected at an InjectionPoint, or None if it has to be serialised
+        in full.
+        """
+        anomaly = point.anomaly(anomaly_dict)
+        if point.kind == 'value':
+            span = self.values.get(point.path)
+            value = self._encode_value(point.path, anomaly)
+            if span is None or value is None:
+                return None
+            return self.body[:span[0]] + value + self.body[span[1]:]
+
+        dict_path, key = point.path[:-1], point.path[-1]
+        members = self.members.get(dict_path)
+        if members is None:
+            return None
+        keys = self.keys[dict_path]
+        if anomaly in keys and anomaly != key:
+            # The other member would get the value, in its own place
+            return None
+
+        # The member with the injected key moves to the end of the dict,
+        # as in replace_key()
+        index = keys[key]
+        start, value_start, end = members[index]
+        member = self._encode_member(key, anomaly, value_start, end)
+        if index == len(members) - 1:
+            return self.body[:start] + member + self.body[end:]
+        last_end = members[-1][2]
+        return (self.body[:start] + self.body[members[index + 1][0]:last_end]
+                + self.separator + member + self.body[last_end:])
+
+    def _encode_value(self, path, value):
+        if self.submission_type == 'json':
+            return json.dumps(value, ensure_ascii=True, default=bytedecoder)
+        if self.submission_type == 'urlencode':
+            if len(path) == 1 and isinstance(value, list):
+                # Would become a pair for each item
+                return None
+            return parse.quote(str(value))
+        return '' if value is None else parse.quote_plus(str(value))
+
+    def _encode_member(self, key, new_key, value_start, end):
+        if self.submission_type == 'json':
+            return json.dumps(new_key) + ': ' + self.body[value_start:end]
+        if self.submission_type == 'urlencode':
+            return serialise_to_url({new_key: self.submission[key]})
+        return parse.quote_plus(new_key) + '=' + self.body[value_start:end]
+
+    def _compile_json(self, submission):
+        # As serialise_to_json(), with the default separators
+        parts = []
+        length = 0
+        # Walk with an explicit stack like InjectionPlan.from_submission().
+        # The stack has nodes to write as ('node', path, node), text as
+        # ('text', text), and the start and end of dict members as
+        # ('key', path of the dict, key) and ('end', path of the dict).
+        stack = [('node', (), submission)]
+        while stack:
+            item = stack.pop()
+            if item[0] == 'text':
+                text = item[1]
+            elif item[0] == 'key':
+                path, key = item[1], item[2]
+                start = length
+                text = json.dumps(key) + ': '
+                self.keys[path][key] = len(self.members[path])
+                self.members[path].append((start, start + len(text), None))
+            elif item[0] == 'end':
+                members = self.members[item[1]]
+                members[-1] = members[-1][:2] + (length,)
+                continue
+            else:
+                path, node = item[1], item[2]
+                if isinstance(node, dict):
+                    self.members[path] = []
+                    self.keys[path] = {}
+                    todo = [('text', '{')]
+                    for key, value in node.items():
+                        if len(todo) > 1:
+                            todo.append(('text', ', '))
+                        todo.extend([('key', path, key), ('node', path + (key,), value), ('end', path)])
+                    todo.append(('text', '}'))
+                    stack.extend(reversed(todo))
+                    continue
+                elif isinstance(node, list):
+                    todo = [('text', '[')]
+                    for i, value in enumerate(node):
+                        if i:
+                            todo.append(('text', ', '))
+                        todo.append(('node', path + (i,), value))
+                    todo.append(('text', ']'))
+                    stack.extend(reversed(todo))
+                    continue
+                text = json.dumps(node, ensure_ascii=True, default=bytedecoder)
+                self.values[path] = (length, length + len(text))
+            parts.append(text)
+            length += len(text)
+        return ''.join(parts)
+
+    def _compile_url(self, submission):
+        # As serialise_to_url(): a key=value pair for each value of a key
+        parts = []
+        length = 0
+        members = []
+        for key, value in submission.items():
+            prefix = parse.quote(str(key)) + '='
+            if isinstance(value, list):
+                items = [((key, i), item) for i, item in enumerate(value)]
+            else:
+                items = [((key,), value)]
+            if not items:
+                # Nothing is written for the key, so it cannot be moved
+                members = None
+            start = length + (1 if parts else 0)
+            for path, item in items:
+                text = parse.quote(str(item))
+                if parts:
+                    parts.append('&')
+                    length += 1
+                parts.append(prefix + text)
+                length += len(prefix) + len(text)
+                self.values[path] = (length - len(text), length)
+            if members is not None:
+                self.keys.setdefault((), {})[key] = len(members)
+                members.append((start, None, length))
+        if members is not None:
+            self.members[()] = members
+        return ''.join(parts)
+
+    def _compile_urlparams(self, submission):
+        # As dict_to_urlparams(): key=value,value for each key
+        parts = []
+        length = 0
+        members = self.members[()] = []
+        keys = self.keys[()] = {}
+        for key, value in submission.items():
+            if parts:
+                parts.append(';')
+                length += 1
+            start = length
+            text = parse.quote_plus(key) + '='
+            parts.append(text)
+            length += len(text)
+            value_start = length
+            for i, item in enumerate(value):
+                if i:
+                    parts.append(',')
+                    length += 1
+                text = '' if item is None else parse.quote_plus(str(item))
+                parts.append(text)
+                length += len(text)
+                if isinstance(value, list):
+                    self.values[(key, i)] = (length - len(text), length)
+            keys[key] = len(members)
+            members.append((start, value_start, length))
+        return ''.join(parts)
@@ -0,0 +1,61 @@
+import json
+import sys
+import unittest
+
+from mittn.fuzzer.anomalygenerator import AnomalyGenerator
+
+
+class test_anomalygenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = AnomalyGenerator(None)
+        self.anomalies = {None: 'generic', 'baz': 'specific'}
+
+    def test_iter_anomalies(self):
+        # The variants of the recursive walker this replaced, in its order.
+        # Serialised, so that the order of the keys is compared too: a
+        # replaced key moves to the end.
+        submission = {'foo': 1, 'bar': {'baz': ['x', {'q': None}]}, 'list': [[True]]}
+        self.assertEqual([json.dumps(variant)
+                          for variant in self.generator.iter_anomalies(submission, self.anomalies)], [
+            '{"bar": {"baz": ["x", {"q": null}]}, "list": [[true]], "generic": 1}',
+            '{"foo": 1, "list": [[true]], "generic": {"baz": ["x", {"q": null}]}}',
+            '{"foo": 1, "bar": {"baz": ["x", {"q": null}]}, "generic": [[true]]}',
+            '{"foo": "generic", "bar": {"baz": ["x", {"q": null}]}, "list": [[true]]}',
+            '{"foo": 1, "bar": {"generic": ["x", {"q": null}]}, "list": [[true]]}',
+            '{"foo": 1, "bar": {"baz": ["specific", {"q": null}]}, "list": [[true]]}',
+            '{"foo": 1, "bar": {"baz": ["x", {"generic": null}]}, "list": [[true]]}',
+            '{"foo": 1, "bar": {"baz": ["x", {"q": "generic"}]}, "list": [[true]]}',
+            '{"foo": 1, "bar": {"baz": ["x", {"q": null}]}, "list": [["generic"]]}'])
+        # The valid submission is not modified
+        self.assertEqual(submission, {'foo': 1, 'bar': {'baz': ['x', {'q': None}]}, 'list': [[True]]})
+        self.assertEqual(self.generator.create_anomalies(submission, self.anomalies),
+                         list(self.generator.iter_anomalies(submission, self.anomalies)))
+
+    def test_deep_nesting(self):
+        # Deeper than the recursion limit: {"baz": [[...[{"q": "x"}]...]]}
+        depth = sys.getrecursionlimit() * 2
+        innermost = {'q': 'x'}
+        nested = innermost
+        for _ in range(depth):
+            nested = [nested]
+        submission = {'baz': nested}
+
+        variants = list(self.generator.iter_anomalies(submission, self.anomalies))
+        self.assertEqual(len(variants), 3)
+        self.assertEqual(list(variants[0]), ['generic'])
+        self.assertIs(variants[0]['generic'], nested)
+        for variant, expected in zip(variants[1:], [{'generic': 'x'}, {'q': 'generic'}]):
+            branch = variant['baz']
+            for _ in range(depth):
+                self.assertEqual(len(branch), 1)
+                branch = branch[0]
+            self.assertEqual(branch, expected)
+        self.assertEqual(innermost, {'q': 'x'})
+
+        values = {}
+        self.generator.collect_values(submission, values)
+        self.assertEqual(values, {None: ['x'], 'baz': [], 'q': ['x']})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,9 +4,12 @@ import tempfile
 import unittest
 import uuid
 import copy
+import sqlite3
 
+from sqlalchemy import event
 from sqlalchemy.orm.session import Session
-from mittn.archiver import Archiver
+from mittn.archiver import Archiver, ArchiverError
+from mittn.blob import Blob, store_pending_blobs
 from mittn.fuzzer.fuzzerissue import FuzzerIssue as Issue
 
 class test_archiver(unittest.TestCase):
@@ -111,6 +114,194 @@ class test_archiver(unittest.TestCase):
         self.assertEqual(a.known_false_positive(test_issue),
                          True, "A duplicate case not detected")
 
+    def test_fingerprint_cache(self):
+        # Known issues are read into memory when the database is opened
+        a = Archiver(self.db_url)
+        a.init(Issue)
+        a.add_issue(default_issue())
+
+        a = Archiver(self.db_url, fingerprint_cache=True, batch_size=10)
+        a.init(Issue)
+        self.assertEqual(len(a.fingerprints), 1)
+        self.assertTrue(a.known_false_positive(default_issue()))
+
+        # Values that the database would convert are normalised
+        test_issue = default_issue()
+        test_issue.resp_statuscode = 500
+        self.assertFalse(a.known_false_positive(test_issue))
+        a.add_if_not_found(test_issue)
+        a.add_if_not_found(default_issue())
+        test_issue = default_issue()
+        test_issue.resp_statuscode = '500'
+        self.assertTrue(a.known_false_positive(test_issue))
+
+        # New issues are only committed in batches, or when flushed
+        self.assertEqual(a.pending, 1)
+        a.flush()
+        self.assertEqual(a.pending, 0)
+        a = Archiver(self.db_url, fingerprint_cache=True)
+        a.init(Issue)
+        self.assertEqual(len(a.fingerprints), 2)
+
+    def test_migrate_legacy_table(self):
+        # A table created before issues had fingerprints
+        db = sqlite3.connect(self.db_file)
+        db.execute('CREATE TABLE httpfuzzer_issues (issue_no INTEGER PRIMARY KEY, '
+                   'new_issue BOOLEAN, timestamp DATETIME, test_runner_host VARCHAR, '
+                   'scenario_id VARCHAR, url VARCHAR, server_protocol_error VARCHAR, '
+                   'server_timeout BOOLEAN, server_error_text_detected BOOLEAN, '
+                   'server_error_text_matched VARCHAR, req_method VARCHAR, '
+                   'req_headers BLOB, req_body BLOB, resp_statuscode VARCHAR, '
+                   'resp_headers BLOB, resp_body BLOB, resp_history BLOB)')
+        db.execute("INSERT INTO httpfuzzer_issues VALUES (1, 1, '2016-01-01 00:00:00', "
+                   "'testhost', '1', 'url', '0', 0, 0, 'matched_text', 'method', "
+                   "NULL, NULL, 'statuscode', NULL, X'626f6479', NULL)")
+        db.commit()
+        db.close()
+
+        a = Archiver(self.db_url)
+        a.init(Issue)
+        self.assertEqual(a.session.query(Issue.fingerprint).scalar(),
+                         default_issue().compute_fingerprint())
+        self.assertTrue(a.known_false_positive(default_issue()))
+        # Inline data has been moved into the blob table
+        issue = a.session.query(Issue).one()
+        self.assertIsNone(issue._resp_body)
+        self.assertEqual(issue.resp_body, b'body')
+
+        db = sqlite3.connect(self.db_file)
+        indexes = [row[1] for row in db.execute("PRAGMA index_list('httpfuzzer_issues')")]
+        db.close()
+        self.assertIn('ix_httpfuzzer_issues_fingerprint', indexes)
+
+    def test_blobs(self):
+        a = Archiver(self.db_url)
+        a.init(Issue)
+        for scenario_id in range(3):
+            test_issue = default_issue()
+            test_issue.scenario_id = scenario_id
+            test_issue.resp_body = b'Internal error ' * 1000
+            a.add_issue(test_issue)
+
+        # Only the sessions of the archiver store blobs
+        self.assertTrue(event.contains(a.Session, 'before_flush', store_pending_blobs))
+        self.assertFalse(event.contains(Session, 'before_flush', store_pending_blobs))
+
+        # Same content is stored once, compressed
+        blobs = a.session.query(Blob).filter(Blob.size == 15000).all()
+        self.assertEqual(len(blobs), 1)
+        self.assertLess(len(blobs[0].data), 1000)
+
+        # and read back when accessed
+        a = Archiver(self.db_url)
+        a.init(Issue)
+        issues = a.session.query(Issue).all()
+        self.assertEqual(len(issues), 3)
+        self.assertEqual(set(issue.resp_body_digest for issue in issues), set([blobs[0].digest]))
+        self.assertEqual(issues[2].resp_body, b'Internal error ' * 1000)
+        self.assertEqual(issues[2].req_body, b'body')
+
+    def test_background_writer(self):
+        a = Archiver(self.db_url, background=True, queue_size=2, batch_size=3)
+        a.init(Issue)
+        for scenario_id in [1, 2, 1, 3, 2]:
+            test_issue = default_issue()
+            test_issue.new_issue = True
+            test_issue.scenario_id = scenario_id
+            a.add_if_not_found(test_issue)
+        # Duplicates are dropped by the writer thread
+        self.assertEqual(a.new_issue_count(), 3)
+
+        # Database errors are raised in the thread adding the issues
+        test_issue = default_issue()
+        test_issue.timestamp = None
+        a.add_issue(test_issue)
+        self.assertRaises(Exception, a.flush)
+
+        a.add_issue(default_issue())
+        a.close()
+        self.assertIsNone(a.writer)
+        self.assertEqual(a.session.query(Issue).count(), 4)
+
+    def test_bad_issue_in_batch(self):
+        # Only the issue that cannot be stored is lost, and it is reported
+        for background in [False, True]:
+            a = Archiver(self.db_url, fingerprint_cache=True, batch_size=10,
+                         background=background)
+            a.init(Issue)
+            issues = []
+            for scenario_id in range(5):
+                test_issue = default_issue()
+                test_issue.scenario_id = scenario_id
+                test_issue.resp_body = ('Error %d' % scenario_id).encode()
+                if scenario_id in (1, 3):
+                    test_issue.timestamp = None
+                issues.append(test_issue)
+                a.add_if_not_found(test_issue)
+            with self.assertRaises(ArchiverError) as raised:
+                a.flush()
+            self.assertEqual(len(raised.exception.errors), 2)
+
+            stored = a.session.query(Issue).order_by(Issue.scenario_id).all()
+            self.assertEqual([issue.scenario_id for issue in stored], ['0', '2', '4'])
+            self.assertEqual(stored[2].resp_body, b'Error 4')
+            # The issues that failed are not taken for known ones
+            self.assertEqual(len(a.fingerprints), 3)
+            issues[1].timestamp = datetime.datetime.utcnow()
+            self.assertFalse(a.known_false_positive(issues[1]))
+            a.close()
+            os.unlink(self.db_file)
+
+    def test_bad_issue_in_queue(self):
+        # An issue that fails when it is checked or added in the writer
+        # thread does not take the other queued issues with it
+        def broken_fingerprint():
+            raise ValueError('broken')
+
+        a = Archiver(self.db_url, batch_size=10, background=True)
+        a.init(Issue)
+        for scenario_id in range(6):
+            test_issue = default_issue()
+            test_issue.scenario_id = scenario_id
+            if scenario_id == 1:
+                # Fails when the query for issue 2 flushes the batch
+                test_issue.timestamp = None
+            if scenario_id == 4:
+                test_issue.compute_fingerprint = broken_fingerprint
+            a.add_if_not_found(test_issue)
+        with self.assertRaises(ArchiverError) as raised:
+            a.flush()
+        self.assertEqual(len(raised.exception.errors), 2)
+        self.assertIsInstance(raised.exception.errors[1], ValueError)
+
+        stored = a.session.query(Issue).order_by(Issue.scenario_id).all()
+        self.assertEqual([issue.scenario_id for issue in stored], ['0', '2', '3', '5'])
+        a.close()
+
+    def test_summary(self):
+        a = Archiver(self.db_url, run_id='run1')
+        a.init(Issue)
+        test_issue = default_issue()
+        test_issue.new_issue = True
+        a.add_issue(test_issue)
+        test_issue = default_issue()
+        test_issue.new_issue = True
+        test_issue.resp_statuscode = '500'
+        a.add_issue(test_issue)
+        test_issue = default_issue()
+        test_issue.scenario_id = 2
+        test_issue.run_id = 'run0'
+        a.add_issue(test_issue)
+
+        self.assertEqual(a.new_issue_count(), 2)
+        self.assertEqual(a.summary(), [
+            {'scenario_id': '1', 'new': 2, 'known': 0, 'total': 2},
+            {'scenario_id': '2', 'new': 0, 'known': 1, 'total': 1}])
+        self.assertEqual(a.summary(['tool', 'resp_statuscode'], run_id='run1'), [
+            {'tool': 'httpfuzzer', 'resp_statuscode': '500', 'new': 1, 'known': 0, 'total': 1},
+            {'tool': 'httpfuzzer', 'resp_statuscode': 'statuscode', 'new': 1, 'known': 0, 'total': 1}])
+        self.assertRaises(ValueError, a.summary, ['issuetype'])
+
     def tearDown(self):
         try:
             os.unlink(self.db_file)
@@ -0,0 +1,66 @@
+import unittest
+
+from requests.models import Response
+
+from mittn.fuzzer.checker import Checker
+
+
+def response(body, status_code=200):
+    resp = Response()
+    resp.status_code = status_code
+    resp._content = body
+    resp.encoding = 'utf-8'
+    return resp
+
+
+class test_checker(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = Checker(['200'], None,
+                               ['server error', 'error', 'mysql', 'root:', 'l.*ck', 'ölö'])
+
+    def test_status_codes(self):
+        self.assertTrue(self.checker.check(response(b'', 500)))
+        self.assertFalse(self.checker.check(response(b'all fine')))
+
+    def test_body_errors(self):
+        resp = response(b'Internal Server Error from MySQL')
+        self.assertTrue(self.checker.check(resp))
+        # Overlapping patterns are all reported, in the configured order
+        self.assertEqual(resp.server_error_text_matched, 'server error, error, mysql')
+
+        resp = response(b'ROOT:x:0:0 is locked')
+        self.assertTrue(self.checker.check(resp))
+        self.assertEqual(resp.server_error_text_matched, 'root:, l.*ck')
+
+    def test_non_ascii_pattern(self):
+        resp = response('ÖLÖ'.encode('utf-8'))
+        self.assertTrue(self.checker.check(resp))
+        self.assertEqual(resp.server_error_text_matched, 'ölö')
+
+    def test_regex_patterns(self):
+        # Each pattern keeps its own groups, backreferences and flags
+        checker = Checker(['200'], None, [r'(\w+) \1', '(?-i:Fatal)', r'(a)(b)\2'])
+        resp = response(b'bye bye, fatal abb')
+        self.assertTrue(checker.check(resp))
+        self.assertEqual(resp.server_error_text_matched, r'(\w+) \1, (a)(b)\2')
+        self.assertFalse(checker.check(response(b'bye now, fatal ab')))
+
+    def test_body_encoding(self):
+        # The body is decoded as the response says before matching
+        resp = response('Server Error: ölö'.encode('utf-16'))
+        resp.encoding = 'utf-16'
+        self.assertTrue(self.checker.check(resp))
+        self.assertEqual(resp.server_error_text_matched, 'server error, error, ölö')
+        resp = response('Mysql: ölö'.encode('latin-1'))
+        resp.encoding = 'latin-1'
+        self.assertTrue(self.checker.check(resp))
+        self.assertEqual(resp.server_error_text_matched, 'mysql, ölö')
+
+    def test_scan_limit(self):
+        checker = Checker(['200'], None, ['error'], scan_limit=10)
+        self.assertTrue(checker.check(response(b'error' + b' ' * 100)))
+        self.assertFalse(checker.check(response(b' ' * 100 + b'error')))
+
+if __name__ == '__main__':
+    unittest.main()
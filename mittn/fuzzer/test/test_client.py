@@ -0,0 +1,101 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from requests.exceptions import ConnectionError, Timeout
+
+from mittn.fuzzer.client import Client
+from mittn.fuzzer.target import Target
+
+
+class KeepaliveHandler(BaseHTTPRequestHandler):
+    # Closes the connection without answering: on /idle the second request
+    # on a connection, as a server does when its idle timeout hits; on any
+    # path a "kill" body, as a payload that crashes the server does.
+    # Answers /slow after a while.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.served = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.path, body))
+        self.served += 1
+        if body == b'"kill"' or (self.path == '/idle' and self.served == 2):
+            self.close_connection = True
+            return
+        if self.path == '/slow':
+            time.sleep(0.5)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepaliveServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class test_client(unittest.TestCase):
+
+    def setUp(self):
+        self.server = KeepaliveServer(('127.0.0.1', 0), KeepaliveHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def target(self, path):
+        return Target('keepalive', 'POST', 'http://127.0.0.1:%d%s' % (self.server.server_port, path),
+                      'json', '{"a": 1}')
+
+    def client(self, keepalive=True):
+        client = Client(keepalive=keepalive)
+        client.timeout = 5
+        return client
+
+    def send(self, client, path, body):
+        return client.send_body(self.target(path), 'POST', body)
+
+    def test_dropped_pooled_connection(self):
+        client = self.client()
+        self.assertEqual(self.send(client, '/idle', '"a"').content, b'"a"')
+        # Sent again on a new connection
+        self.assertEqual(self.send(client, '/idle', '"b"').content, b'"b"')
+        self.assertEqual(self.server.requests, [('/idle', b'"a"'), ('/idle', b'"b"'),
+                                                ('/idle', b'"b"')])
+
+    def test_payload_kills_connection(self):
+        client = self.client()
+        self.assertEqual(self.send(client, '/echo', '"a"').content, b'"a"')
+        # Sent again on a new connection, where it fails too
+        self.assertIsInstance(self.send(client, '/echo', '"kill"'), ConnectionError)
+        self.assertEqual(self.server.requests.count(('/echo', b'"kill"')), 2)
+
+        # Not sent again when it fails on a new connection
+        del self.server.requests[:]
+        self.assertIsInstance(self.send(self.client(), '/echo', '"kill"'), ConnectionError)
+        self.assertIsInstance(self.send(self.client(False), '/echo', '"kill"'), ConnectionError)
+        self.assertEqual(self.server.requests, [('/echo', b'"kill"')] * 2)
+
+    def test_timeout(self):
+        client = self.client()
+        client.timeout = 0.1
+        self.assertEqual(self.send(client, '/echo', '"a"').content, b'"a"')
+        self.assertIsInstance(self.send(client, '/slow', '"b"'), Timeout)
+        self.assertEqual(self.server.requests, [('/echo', b'"a"'), ('/slow', b'"b"')])
+
+if __name__ == '__main__':
+    unittest.main()
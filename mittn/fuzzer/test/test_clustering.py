@@ -0,0 +1,60 @@
+import unittest
+
+from requests.exceptions import ConnectionError
+from requests.models import Response
+
+from mittn.fuzzer.clustering import ResponseClusters, response_signature, simhash
+from mittn.fuzzer.fuzzerissue import FuzzerIssue
+
+ERROR_PAGE = (b'<html><body><h1>Internal Server Error</h1><p>Traceback (most recent call last): '
+              b'File "app.py", line %d, in handler: ValueError: invalid literal for int() '
+              b'with base 10: %s</p><p>Please contact the administrator.</p></body></html>')
+
+
+def response(body, status_code=500, headers=None):
+    resp = Response()
+    resp.status_code = status_code
+    resp._content = body
+    resp.headers.update(headers or {'Content-Type': 'text/html'})
+    return resp
+
+
+def issue(resp_or_exc, scenario_id='scenario'):
+    newissue = FuzzerIssue(scenario_id=scenario_id, req_method='POST')
+    newissue.signature = response_signature(resp_or_exc)
+    return newissue
+
+
+class test_clustering(unittest.TestCase):
+
+    def test_simhash(self):
+        a = simhash(ERROR_PAGE % (12, b"'abc'"))
+        b = simhash(ERROR_PAGE % (12, b"'xyz'"))
+        c = simhash(b'<html><body>Service temporarily unavailable, try again later</body></html>')
+        self.assertLess(bin(a ^ b).count('1'), 16)
+        self.assertGreater(bin(a ^ c).count('1'), 16)
+
+    def test_signature(self):
+        self.assertEqual(response_signature(response(b'')).split(':')[:2], ['500', '0'])
+        self.assertEqual(response_signature(response(b'x' * 100)).split(':')[:2], ['500', '7'])
+        self.assertTrue(response_signature(ConnectionError('refused')).startswith('ConnectionError:0:'))
+        self.assertNotEqual(response_signature(response(b'x', headers={'Content-Type': 'text/html'})),
+                            response_signature(response(b'x', headers={'Server': 'x'})))
+
+    def test_clusters(self):
+        clusters = ResponseClusters(max_distance=10)
+        first = issue(response(ERROR_PAGE % (12, b"'abc'")))
+        self.assertTrue(clusters.add(first))
+        for value in [b"'abc'", b"'abd'", b"'1234567'"]:
+            self.assertFalse(clusters.add(issue(response(ERROR_PAGE % (12, value)))))
+        # Other status, scenario or body make clusters of their own
+        self.assertTrue(clusters.add(issue(response(ERROR_PAGE % (12, b"'abc'"), 502))))
+        self.assertTrue(clusters.add(issue(response(ERROR_PAGE % (12, b"'abc'")), 'other')))
+        self.assertTrue(clusters.add(issue(response(b'Service temporarily unavailable'))))
+
+        self.assertEqual(len(clusters), 4)
+        self.assertIs(clusters.issues()[0], first)
+        self.assertEqual(first.hit_count, 4)
+
+if __name__ == '__main__':
+    unittest.main()
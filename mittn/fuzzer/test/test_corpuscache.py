@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mittn.fuzzer.corpuscache import CorpusCache
+from mittn.fuzzer.pythonmutator import PythonMutator
+
+
+class CountingMutator(PythonMutator):
+    # Counts the lists of valid values that are fuzzed
+
+    def __init__(self, seed):
+        super(CountingMutator, self).__init__(seed)
+        self.fuzzed = 0
+
+    def _get_fuzz(self, samples, no_of_fuzzcases):
+        self.fuzzed += 1
+        return super(CountingMutator, self)._get_fuzz(samples, no_of_fuzzcases)
+
+
+class test_corpuscache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.values = {'foo': ['abc 123'], 'bar': [], None: ['abc 123', 42, None]}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_values(self):
+        expected = PythonMutator(seed=1).fuzz_values(self.values, 20)
+
+        backend = CountingMutator(seed=1)
+        self.assertEqual(CorpusCache(backend, self.directory).fuzz_values(self.values, 20), expected)
+        self.assertEqual(backend.fuzzed, 2)
+
+        # Read back from the files
+        backend = CountingMutator(seed=1)
+        self.assertEqual(CorpusCache(backend, self.directory).fuzz_values(self.values, 20), expected)
+        self.assertEqual(backend.fuzzed, 0)
+
+        # Another seed or amount is not in the cache
+        backend = CountingMutator(seed=2)
+        CorpusCache(backend, self.directory).fuzz_values(self.values, 20)
+        self.assertEqual(backend.fuzzed, 2)
+        backend = CountingMutator(seed=1)
+        CorpusCache(backend, self.directory).fuzz_values(self.values, 10)
+        self.assertEqual(backend.fuzzed, 2)
+
+    def test_corrupt_file(self):
+        cache = CorpusCache(CountingMutator(seed=1), self.directory)
+        expected = cache.fuzz_values(self.values, 20)
+        for name in os.listdir(self.directory):
+            with open(os.path.join(self.directory, name), 'r+b') as f:
+                f.truncate(20)
+        self.assertEqual(cache.fuzz_values(self.values, 20), expected)
+        self.assertEqual(cache.backend.fuzzed, 4)
+
+    def test_eviction(self):
+        cache = CorpusCache(CountingMutator(seed=1), self.directory)
+        cache.fuzz_values({None: ['abc']}, 20)
+        old_file = os.path.join(self.directory, os.listdir(self.directory)[0])
+        os.utime(old_file, (0, 0))
+
+        # The least recently used file is removed when the cache is full
+        cache.max_size = os.path.getsize(old_file) + 10
+        cache.fuzz_values({None: ['def']}, 20)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertFalse(os.path.exists(old_file))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import unittest
+
+from mittn.fuzzer.injectionplan import InjectionPlan
+
+
+class test_injectionplan(unittest.TestCase):
+
+    def setUp(self):
+        self.submission = {'foo': 1, 'bar': {'baz': ['x', 'y']}}
+        self.plan = InjectionPlan.from_submission(self.submission)
+
+    def test_points(self):
+        self.assertEqual([(p.kind, p.pointer, p.key) for p in self.plan],
+                         [('key', '/foo', 'foo'),
+                          ('key', '/bar', 'bar'),
+                          ('value', '/foo', 'foo'),
+                          ('key', '/bar/baz', 'baz'),
+                          ('value', '/bar/baz/0', 'baz'),
+                          ('value', '/bar/baz/1', 'baz')])
+        self.assertEqual(self.plan[4].value_type, str)
+
+    def test_apply(self):
+        anomalies = {None: 'generic', 'baz': 'specific'}
+        self.assertEqual(self.plan[1].apply(self.submission, anomalies),
+                         {'foo': 1, 'generic': {'baz': ['x', 'y']}})
+        fuzzed = self.plan[5].apply(self.submission, anomalies)
+        self.assertEqual(fuzzed, {'foo': 1, 'bar': {'baz': ['x', 'specific']}})
+        # The valid submission is not modified
+        self.assertEqual(self.submission['bar']['baz'], ['x', 'y'])
+
+    def test_same_cases_as_generator(self):
+        # The variants of the recursive walker the plan replaced, in its
+        # order, with a replaced key moved to the end
+        anomalies = {None: 'generic', 'baz': 'specific'}
+        self.assertEqual([json.dumps(p.apply(self.submission, anomalies)) for p in self.plan], [
+            '{"bar": {"baz": ["x", "y"]}, "generic": 1}',
+            '{"foo": 1, "generic": {"baz": ["x", "y"]}}',
+            '{"foo": "generic", "bar": {"baz": ["x", "y"]}}',
+            '{"foo": 1, "bar": {"generic": ["x", "y"]}}',
+            '{"foo": 1, "bar": {"baz": ["specific", "y"]}}',
+            '{"foo": 1, "bar": {"baz": ["x", "specific"]}}'])
+
+    def test_filter_and_sample(self):
+        values = self.plan.filter(kind='value')
+        self.assertEqual(len(values), 3)
+        self.assertEqual([p.index for p in values.filter(keys=['baz'])], [4, 5])
+        sampled = self.plan.sample(3, seed=1)
+        self.assertEqual(len(sampled), 3)
+        self.assertEqual([p.index for p in sampled], sorted(p.index for p in sampled))
+        self.assertEqual([p.index for p in sampled],
+                         [p.index for p in self.plan.sample(3, seed=1)])
+
+if __name__ == '__main__':
+    unittest.main()
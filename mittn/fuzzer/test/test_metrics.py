@@ -0,0 +1,145 @@
+import os
+import pickle
+import tempfile
+import tracemalloc
+import unittest
+import uuid
+
+from mittn.metrics import Metrics, PhaseProfiler, Tracer
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class test_metrics(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = Metrics(self.clock)
+
+    def test_summary(self):
+        self.metrics.count('cases_sent', target='a')
+        self.metrics.count('cases_sent', 3, target='a')
+        self.metrics.count('cases_sent', target='b')
+        for latency in [0.002] * 90 + [0.2] * 9 + [100.0]:
+            self.metrics.observe('request_seconds', latency, target='a')
+        with self.metrics.phase('check'):
+            self.clock.now += 1.5
+        self.clock.now += 0.5
+
+        summary = self.metrics.summary()
+        self.assertEqual(summary['elapsed'], 2.0)
+        self.assertEqual(summary['counters']['cases_sent'], [
+            {'labels': {'target': 'a'}, 'value': 4, 'per_second': 2.0},
+            {'labels': {'target': 'b'}, 'value': 1, 'per_second': 0.5}])
+        histogram = summary['histograms']['request_seconds'][0]
+        self.assertEqual(histogram['count'], 100)
+        self.assertEqual((histogram['p50'], histogram['p90'], histogram['p99']),
+                         (0.0025, 0.0025, 0.25))
+        self.assertEqual(histogram['buckets']['+Inf'], 1)
+        self.assertEqual(summary['phases'], {'check': {'seconds': 1.5, 'calls': 1}})
+
+    def test_reset(self):
+        self.metrics.tracer = Tracer()
+        self.clock.now += 10.0
+        self.metrics.count('cases_sent')
+        self.metrics.observe('request_seconds', 0.003)
+        self.metrics.add_phase('send', 0.5, start=1.0)
+        self.metrics.reset()
+        self.clock.now += 2.0
+
+        summary = self.metrics.summary()
+        self.assertEqual(summary['elapsed'], 2.0)
+        self.assertEqual((summary['counters'], summary['histograms'], summary['phases']),
+                         ({}, {}, {}))
+        self.assertEqual([event for event in self.metrics.tracer.events() if event['ph'] == 'X'], [])
+
+    def test_prometheus(self):
+        self.metrics.count('requests', target='a"b', outcome='500')
+        self.metrics.observe('request_seconds', 0.003, target='a')
+        self.metrics.add_phase('check', 0.5, 2)
+        self.metrics.add_phase('generate', 1.0)
+        lines = self.metrics.prometheus(tool='httpfuzzer').splitlines()
+
+        self.assertIn('mittn_requests_total{tool="httpfuzzer",outcome="500",target="a\\"b"} 1', lines)
+        self.assertIn('mittn_request_seconds_bucket{tool="httpfuzzer",target="a",le="0.0025"} 0', lines)
+        self.assertIn('mittn_request_seconds_bucket{tool="httpfuzzer",target="a",le="0.005"} 1', lines)
+        self.assertIn('mittn_request_seconds_bucket{tool="httpfuzzer",target="a",le="+Inf"} 1', lines)
+        self.assertIn('mittn_request_seconds_count{tool="httpfuzzer",target="a"} 1', lines)
+        self.assertIn('mittn_phase_calls_total{tool="httpfuzzer",phase="check"} 2', lines)
+        # The samples of a metric follow its TYPE line
+        index = lines.index('# TYPE mittn_phase_seconds_total counter')
+        self.assertEqual(lines[index + 1:index + 3], [
+            'mittn_phase_seconds_total{tool="httpfuzzer",phase="check"} 0.5',
+            'mittn_phase_seconds_total{tool="httpfuzzer",phase="generate"} 1.0'])
+
+    def test_merge(self):
+        self.metrics.count('cases_sent', target='a')
+        self.metrics.observe('request_seconds', 0.003)
+        # A worker process gets an empty copy
+        worker = pickle.loads(pickle.dumps(self.metrics))
+        self.assertEqual(worker.snapshot()['counters'], {})
+        worker.count('cases_sent', 2, target='a')
+        worker.observe('request_seconds', 0.003)
+        worker.add_phase('check', 1.0)
+
+        self.metrics.merge(pickle.loads(pickle.dumps(worker.snapshot())))
+        summary = self.metrics.summary()
+        self.assertEqual(summary['counters']['cases_sent'][0]['value'], 3)
+        self.assertEqual(summary['histograms']['request_seconds'][0]['count'], 2)
+        self.assertEqual(summary['phases']['check'], {'seconds': 1.0, 'calls': 1})
+
+    def test_tracer(self):
+        self.metrics.tracer = Tracer(max_spans=3)
+        with self.metrics.phase('generate'):
+            self.clock.now += 2.0
+        self.metrics.add_phase('send', 0.5, 4, start=3.0)
+        # Without a start time there is no span
+        self.metrics.add_phase('send', 0.5)
+        # A worker process traces too, and sends its spans back
+        worker = pickle.loads(pickle.dumps(self.metrics))
+        worker.add_phase('check', 0.25, start=4.0)
+        worker.add_phase('check', 0.25, start=5.0)
+        self.metrics.merge(pickle.loads(pickle.dumps(worker.snapshot(spans=True))))
+
+        events = [event for event in self.metrics.tracer.events() if event['ph'] == 'X']
+        self.assertEqual([(event['name'], event['ts'], event['dur'], event['args']['calls'])
+                          for event in events],
+                         [('generate', 0.0, 2e6, 1), ('send', 3e6, 5e5, 4), ('check', 4e6, 2.5e5, 1)])
+        self.assertEqual(self.metrics.tracer.dropped, 1)
+        self.assertEqual(self.metrics.summary()['phases']['check']['calls'], 2)
+
+    def test_profiler(self):
+        path = os.path.join(tempfile.gettempdir(), 'mittn_unittest.' + str(uuid.uuid4()))
+        # Nothing is written if the phase never ran
+        PhaseProfiler('generate', path).write()
+        self.assertFalse(os.path.exists(path))
+        self.metrics.profiler = PhaseProfiler('generate', path, 'tracemalloc')
+        kept = []
+        try:
+            with self.metrics.phase('check'):
+                kept.append(bytearray(1000000))
+            with self.metrics.phase('generate'):
+                kept.append(bytearray(2000000))
+            with self.metrics.phase('generate'):
+                kept.append(bytearray(10))
+            self.assertFalse(tracemalloc.is_tracing())
+            self.metrics.profiler.write()
+            snapshot = tracemalloc.Snapshot.load(path)
+        finally:
+            os.unlink(path)
+        # The snapshot of the call that held the most, without the
+        # memory allocated outside of the phase
+        size = sum(stat.size for stat in snapshot.statistics('filename'))
+        self.assertTrue(2000000 <= size < 3000000, size)
+        with self.assertRaises(ValueError):
+            PhaseProfiler('generate', path, 'perf')
+
+if __name__ == '__main__':
+    unittest.main()
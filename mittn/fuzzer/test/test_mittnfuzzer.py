@@ -0,0 +1,309 @@
+import json
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from mittn.archiver import Archiver
+from mittn.config import Config
+from mittn.fuzzer.fuzzerissue import FuzzerIssue
+from mittn.fuzzer.hooks import Hooks
+from mittn.fuzzer.mittnfuzzer import MittnFuzzer
+from mittn.fuzzer.rawclient import RawClient
+from mittn.fuzzer.target import Target
+from mittn.metrics import PhaseProfiler
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    # Fails on every third request body length
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(500 if len(body) % 3 == 0 else 200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class test_mittnfuzzer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.db_file = os.path.join(tempfile.gettempdir(), 'mittn_unittest.' + str(uuid.uuid4()))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            os.unlink(self.db_file)
+        except OSError:
+            pass
+
+    def fuzzer(self, seed):
+        config = Config('fuzzer', None)
+        config.mutator = 'builtin'
+        config.seed = seed
+        config.anomalies = '10'
+        config.methods = ['POST']
+        fuzzer = MittnFuzzer(archiver=Archiver('sqlite:///' + self.db_file), config=config)
+        fuzzer.init()
+        # The valid submission is 28 bytes long, so it passes
+        fuzzer.add_target(Target('scenario:1', 'POST',
+                                 'http://127.0.0.1:%d/' % self.server.server_port,
+                                 'json', '{"a": "hello", "b": [1, 22]}'))
+        return fuzzer
+
+    def test_replay(self):
+        self.fuzzer('5').fuzz()
+        archiver = self.fuzzer('5').archiver
+        issues = archiver.session.query(FuzzerIssue).all()
+        self.assertTrue(issues)
+        for issue in issues:
+            self.assertEqual(issue.seed, '5')
+            self.assertTrue(issue.case_id.startswith('scenario:1:'))
+
+        # The same case is sent again, also from a differently seeded fuzzer
+        issue = issues[-1]
+        case, response, replayed = self.fuzzer('6').replay(issue.case_id, seed=issue.seed)
+        self.assertEqual(case.case_id, issue.case_id)
+        self.assertEqual(replayed.req_body, issue.req_body)
+        self.assertEqual(replayed.seed, '5')
+
+        self.assertRaises(ValueError, self.fuzzer('5').replay, 'unknown:0:0:POST')
+        self.assertRaises(ValueError, self.fuzzer('5').replay, 'scenario:1:0:5:POST')
+
+    def test_time_budget(self):
+        coverage_file = self.db_file + '.coverage'
+        fuzzer = self.fuzzer('5')
+        fuzzer.config.time_budget = '60'
+        fuzzer.config.coverage_file = coverage_file
+        try:
+            fuzzer.fuzz()
+            self.assertEqual(fuzzer.scheduler.coverage, {'scenario:1': list(range(10))})
+            self.assertTrue(os.path.exists(coverage_file))
+        finally:
+            os.unlink(coverage_file)
+
+    def test_corpus_cache_needs_seed(self):
+        config = Config('fuzzer', None)
+        config.mutator = 'builtin'
+        config.corpus_cache = self.db_file + '.corpus'
+        with self.assertRaises(ValueError):
+            MittnFuzzer(archiver=Archiver('sqlite:///' + self.db_file), config=config)
+        self.assertFalse(os.path.exists(config.corpus_cache))
+
+    def test_static_injection(self):
+        fuzzer = self.fuzzer('5')
+        fuzzer.config.injection = 'static'
+        fuzzer.generator.fuzz_submissions = None  # The mutator is not used
+        static = fuzzer._static_anomalies()
+        self.assertEqual(static[:8], ['A harmless string', 'A%20harmless%20string', '\xe5\xe4\xf6',
+                                      '%C3%A5%C3%A4%C3%B6', b'\xc3\xa5\xc3\xa4\xc3\xb6',
+                                      "' --", '%27%20--', "' or 'x'='x' --"])
+        self.assertIn(None, static)
+        self.assertIn('A' * (1024 * 1024), static)
+        target = fuzzer.targets[0]
+        cases = list(fuzzer._cases(target, fuzzer._anomalies([target])[0], fuzzer.shard))
+        # Every static anomaly at each of the five points
+        self.assertEqual(len(cases), 5 * len(static))
+        values = [case for case in cases if case.point.pointer == '/a' and case.point.kind == 'value']
+        self.assertEqual([case.payload['a'] for case in values], static)
+        # The UTF-8 bytes are sent one character per byte, i.e. double encoded
+        self.assertEqual(json.loads(values[4].body)['a'], '\xc3\xa5\xc3\xa4\xc3\xb6')
+        self.assertIs(fuzzer._static_anomalies(), fuzzer._static_anomalies())
+        fuzzer.fuzz()
+        self.assertTrue(fuzzer.archiver.session.query(FuzzerIssue).count())
+
+        # With both, the static anomalies come after the fuzz values
+        fuzzer = self.fuzzer('5')
+        fuzzer.config.injection = 'both'
+        anomalies = fuzzer._anomalies(fuzzer.targets)[0]
+        self.assertEqual(fuzzer._amount(), 10 + len(static))
+        self.assertEqual(anomalies['a'][10:], static)
+
+    def test_cluster_responses(self):
+        fuzzer = self.fuzzer('5')
+        fuzzer.fuzz()
+        failed = fuzzer.metrics.summary()['counters']['cases_failed'][0]['value']
+        self.assertTrue(failed > 1)
+        issues = fuzzer.archiver.session.query(FuzzerIssue).all()
+        # Without clustering, the signatures are not computed
+        self.assertEqual(set(issue.signature for issue in issues), set([None]))
+        os.unlink(self.db_file)
+
+        # The failing responses are all the same
+        fuzzer = self.fuzzer('5')
+        fuzzer.config.cluster_responses = 'true'
+        fuzzer.fuzz()
+        clustered = fuzzer.archiver.session.query(FuzzerIssue).all()
+        self.assertEqual(len(clustered), 1)
+        self.assertEqual(clustered[0].hit_count, failed)
+        self.assertTrue(clustered[0].signature.startswith('500:2:'))
+
+    def test_streaming(self):
+        # Each case is generated when it is about to be sent, and its
+        # response is checked before the next cases are generated
+        for concurrency in [1, 3]:
+            fuzzer = self.fuzzer('5')
+            fuzzer.sendpool.concurrency = concurrency
+            steps = []
+            fuzzer.hooks.register('after_serialize', lambda case: steps.append(1))
+            fuzzer.hooks.register('after_check', lambda *args: steps.append(-1))
+            fuzzer.fuzz()
+            os.unlink(self.db_file)
+
+            self.assertEqual(len(steps), 2 * 5 * 10)
+            ahead = [sum(steps[:i]) for i in range(len(steps))]
+            self.assertEqual(max(ahead), concurrency + 1 if concurrency > 1 else 1)
+
+    def test_raw_engine(self):
+        def case_ids(fuzzer):
+            fuzzer.fuzz()
+            issues = fuzzer.archiver.session.query(FuzzerIssue).filter_by(run_id=fuzzer.archiver.run_id)
+            return sorted(issue.case_id for issue in issues)
+
+        expected = case_ids(self.fuzzer('5'))
+        self.assertTrue(expected)
+        # A new database, so that the issues are not known yet
+        os.unlink(self.db_file)
+        fuzzer = self.fuzzer('5')
+        fuzzer.client = fuzzer.sendpool.client = RawClient(pipeline=3)
+        fuzzer.client.timeout = 5
+        self.assertEqual(case_ids(fuzzer), expected)
+
+    def test_interleave(self):
+        def case_ids(interleave):
+            fuzzer = self.fuzzer('5')
+            fuzzer.add_target(Target('scenario:2', 'POST',
+                                     'http://127.0.0.1:%d/' % self.server.server_port,
+                                     'json', '{"a": "hello", "b": [1, 22]}'))
+            fuzzer.config.interleave = interleave
+            fuzzer.sendpool.concurrency = 4
+            fuzzer.fuzz()
+            issues = fuzzer.archiver.session.query(FuzzerIssue).all()
+            os.unlink(self.db_file)
+            return sorted(issue.case_id for issue in issues)
+
+        expected = case_ids('false')
+        self.assertEqual(len(set(case_id.split(':')[1] for case_id in expected)), 2)
+        self.assertEqual(case_ids('true'), expected)
+
+    def test_metrics(self):
+        fuzzer = self.fuzzer('5')
+        fuzzer.config.processes = '2'
+        fuzzer.config.metrics_json = self.db_file + '.json'
+        fuzzer.config.metrics_prometheus = self.db_file + '.prom'
+        try:
+            fuzzer.fuzz()
+            with open(fuzzer.config.metrics_json) as fh:
+                summary = json.load(fh)
+            with open(fuzzer.config.metrics_prometheus) as fh:
+                prometheus = fh.read()
+        finally:
+            for path in [fuzzer.config.metrics_json, fuzzer.config.metrics_prometheus]:
+                os.unlink(path)
+
+        counters = dict((name, sum(item['value'] for item in items))
+                        for name, items in summary['counters'].items())
+        # The cases were generated and sent in the worker processes
+        self.assertEqual(counters['cases_generated'], counters['cases_sent'])
+        self.assertEqual(counters['requests'], counters['cases_sent'] + 1)
+        self.assertTrue(0 < counters['cases_failed'] < counters['cases_sent'])
+        self.assertEqual(summary['histograms']['request_seconds'][0]['count'],
+                         counters['requests'])
+        for phase in ['fuzz', 'generate', 'valid_case', 'check', 'archive']:
+            self.assertIn(phase, summary['phases'])
+        self.assertIn('mittn_cases_sent_total{tool="httpfuzzer",target="scenario:1"} %d'
+                      % counters['cases_sent'], prometheus)
+
+        # Another run counts from its own start
+        started = fuzzer.metrics.started
+        fuzzer.config.processes = '1'
+        fuzzer.config.metrics_json = fuzzer.config.metrics_prometheus = None
+        fuzzer.fuzz()
+        self.assertGreater(fuzzer.metrics.started, started)
+        again = fuzzer.metrics.summary()
+        self.assertEqual(sum(item['value'] for item in again['counters']['cases_sent']),
+                         counters['cases_sent'])
+        self.assertEqual(again['phases']['fuzz']['calls'], 1)
+
+    def test_hooks_and_tracing(self):
+        config = Config('fuzzer', None)
+        config.mutator = 'builtin'
+        config.seed = '5'
+        config.anomalies = '10'
+        config.methods = ['POST']
+        config.trace_file = self.db_file + '.trace'
+        config.profile_phase = 'generate'
+        config.profile_file = self.db_file + '.prof'
+        calls = dict((name, []) for name in ['before_generate', 'after_serialize',
+                                             'after_check', 'on_issue'])
+        hooks = Hooks()
+        for name, args in calls.items():
+            hooks.register(name, lambda *a, args=args: args.append(a))
+        with self.assertRaises(ValueError):
+            hooks.register('after_everything', print)
+
+        fuzzer = MittnFuzzer(archiver=Archiver('sqlite:///' + self.db_file), config=config,
+                             hooks=hooks)
+        fuzzer.init()
+        fuzzer.add_target(Target('scenario:1', 'POST',
+                                 'http://127.0.0.1:%d/' % self.server.server_port,
+                                 'json', '{"a": "hello", "b": [1, 22]}'))
+        try:
+            fuzzer.fuzz()
+            with open(config.trace_file) as fh:
+                events = json.load(fh)['traceEvents']
+            profile = pstats.Stats(config.profile_file)
+        finally:
+            for path in [config.trace_file, config.profile_file]:
+                os.unlink(path)
+
+        self.assertEqual(calls['before_generate'], [(fuzzer.targets,)])
+        cases = [args[0] for args in calls['after_serialize']]
+        self.assertEqual([args[1] for args in calls['after_check']], cases)
+        failed = [case for target, case, response, failed in calls['after_check'] if failed]
+        self.assertEqual([issue.case_id for issue, in calls['on_issue']],
+                         [case.case_id for case in failed])
+        self.assertTrue(failed)
+
+        spans = [event['name'] for event in events if event['ph'] == 'X']
+        self.assertEqual(spans.count('send'), len(cases) + 1)
+        self.assertEqual(spans.count('serialize'), len(cases))
+        for phase in ['fuzz', 'generate', 'valid_case', 'check', 'archive']:
+            self.assertIn(phase, spans)
+        # Only the generate phase was profiled
+        functions = set(function for filename, line, function in profile.stats)
+        self.assertIn('_generate_anomalies', functions)
+        self.assertNotIn('_send_body', functions)
+
+    def test_profile_send(self):
+        config = Config('fuzzer', None)
+        config.profile_phase = 'sending'
+        config.profile_file = self.db_file + '.prof'
+        with self.assertRaises(ValueError):
+            MittnFuzzer(archiver=Archiver('sqlite:///' + self.db_file), config=config)
+
+        fuzzer = self.fuzzer('5')
+        fuzzer.metrics.profiler = PhaseProfiler('send', config.profile_file)
+        try:
+            fuzzer.fuzz()
+            profile = pstats.Stats(config.profile_file)
+        finally:
+            os.unlink(config.profile_file)
+        functions = set(function for filename, line, function in profile.stats)
+        self.assertIn('_send_body', functions)
+        self.assertNotIn('_generate_anomalies', functions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import random
+import unittest
+from urllib import parse
+
+from mittn.fuzzer.pythonmutator import PythonMutator
+
+
+class test_pythonmutator(unittest.TestCase):
+
+    def setUp(self):
+        self.values = {'foo': ['abc 123'], 'bar': [], None: ['abc 123', 42, None]}
+
+    def test_fuzz_values(self):
+        fuzzes = PythonMutator(seed=1).fuzz_values(self.values, 50)
+        self.assertEqual(set(fuzzes.keys()), set(self.values.keys()))
+        for fuzzlist in fuzzes.values():
+            self.assertEqual(len(fuzzlist), 50)
+            self.assertTrue(all(isinstance(v, bytes) for v in fuzzlist))
+        # Keys without values are fuzzed from the None key's values
+        self.assertEqual(fuzzes['bar'], fuzzes[None])
+
+    def test_reproducible(self):
+        self.assertEqual(PythonMutator(seed=1).fuzz_values(self.values, 20),
+                         PythonMutator(seed=1).fuzz_values(self.values, 20))
+        self.assertNotEqual(PythonMutator(seed=1).fuzz_values(self.values, 20),
+                            PythonMutator(seed=2).fuzz_values(self.values, 20))
+        # Case n does not depend on how many cases are asked for
+        self.assertEqual(PythonMutator(seed=1).fuzz_values(self.values, 5)['foo'],
+                         PythonMutator(seed=1).fuzz_values(self.values, 20)['foo'][:5])
+
+    def test_percent_encode(self):
+        data = b'a/b \xc3\xa5%Z9'
+        for once, twice in [(0.9, False), (0.1, True)]:
+            rnd = random.Random()
+            rnd.random = lambda: once
+            encoded = PythonMutator._percent_encode(rnd, data)
+            # Every byte is encoded, exactly once or twice
+            self.assertEqual(len(encoded), len(data) * (5 if twice else 3))
+            decoded = parse.unquote_to_bytes(encoded)
+            if twice:
+                decoded = parse.unquote_to_bytes(decoded)
+            self.assertEqual(decoded, data)
+
+    def test_random_seed_is_kept(self):
+        mutator = PythonMutator()
+        self.assertIsInstance(mutator.seed, int)
+
+if __name__ == '__main__':
+    unittest.main()
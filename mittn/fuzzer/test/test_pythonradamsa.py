@@ -0,0 +1,86 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from mittn.fuzzer.anomalygenerator import AnomalyGenerator
+from mittn.fuzzer.pythonradamsa import PythonRadamsa
+
+# A stand-in for the Radamsa binary. It understands the command line
+# options PythonRadamsa uses, logs every run, and "fuzzes" by tagging
+# the samples with the case number.
+FAKE_RADAMSA = """#!%(python)s
+import sys
+args = sys.argv[1:]
+if '--help' in args:
+    sys.exit(0)
+with open(%(log)r, 'a') as fh:
+    fh.write(' '.join(args) + '\\n')
+pattern = args[args.index('-o') + 1]
+count = int(args[args.index('-n') + 1])
+files = [a for i, a in enumerate(args)
+         if not a.startswith('-') and args[i - 1] not in ('-o', '-n', '--seed')]
+if files:
+    samples = [open(f, 'rb').read() for f in files]
+else:
+    samples = [sys.stdin.buffer.read()]
+for n in range(1, count + 1):
+    with open(pattern.replace('%%n', str(n)), 'wb') as fh:
+        fh.write(samples[(n - 1) %% len(samples)] + b'/' + str(n).encode())
+"""
+
+
+class test_pythonradamsa(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, 'runs.log')
+        self.path = os.path.join(self.directory, 'radamsa')
+        with open(self.path, 'w') as fh:
+            fh.write(FAKE_RADAMSA % {'python': sys.executable, 'log': self.log})
+        os.chmod(self.path, stat.S_IRWXU)
+
+    def runs(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as fh:
+            return len(fh.readlines())
+
+    def test_missing_binary(self):
+        with self.assertRaises(ValueError):
+            PythonRadamsa(os.path.join(self.directory, 'nonexistent'))
+
+    def test_fuzz_values(self):
+        radamsa = PythonRadamsa(self.path)
+        fuzzes = radamsa.fuzz_values({'foo': ['abc'], 'bar': [1, True], None: ['abc', 1, True]}, 3)
+        self.assertEqual(fuzzes['foo'], [b'abc/1', b'abc/2', b'abc/3'])
+        self.assertEqual(fuzzes['bar'], [b'1/1', b'True/2', b'1/3'])
+        self.assertEqual(len(fuzzes[None]), 3)
+
+    def test_batch_shares_runs(self):
+        # Keys with the same valid values share a run, also across targets
+        radamsa = PythonRadamsa(self.path)
+        generator = AnomalyGenerator(radamsa)
+        fuzzes = generator.fuzz_submissions([[{'foo': 'abc', 'bar': 'abc'}],
+                                             [{'baz': 'abc'}],
+                                             [{'foo': 'xyz'}]], 2)
+        self.assertEqual(len(fuzzes), 3)
+        self.assertEqual(fuzzes[0]['foo'], [b'abc/1', b'abc/2'])
+        self.assertEqual(fuzzes[1]['baz'], [b'abc/1', b'abc/2'])
+        self.assertEqual(fuzzes[2]['foo'], [b'xyz/1', b'xyz/2'])
+        # 'abc', ('abc', 'abc') for the first None key, and 'xyz'
+        self.assertEqual(self.runs(), 3)
+
+    def test_seed(self):
+        PythonRadamsa(self.path, seed=7).fuzz_values({None: ['abc']}, 2)
+        with open(self.log) as fh:
+            self.assertIn('--seed 7', fh.read())
+        self.assertIsInstance(PythonRadamsa(self.path).seed, int)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+if __name__ == '__main__':
+    unittest.main()
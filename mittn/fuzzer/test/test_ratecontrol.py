@@ -0,0 +1,102 @@
+import unittest
+
+from requests.exceptions import Timeout
+from requests.models import Response
+
+from mittn.fuzzer.ratecontrol import AdaptiveController
+
+
+def response(status_code=200):
+    resp = Response()
+    resp.status_code = status_code
+    return resp
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class test_ratecontrol(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def controller(self, **kwargs):
+        return AdaptiveController(clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_increase_and_decrease(self):
+        controller = self.controller(min_concurrency=2, max_concurrency=16)
+        self.assertEqual(controller.limit, 2)
+        for _ in range(20):
+            controller.record(response(), 0.1)
+        self.assertEqual(controller.limit, 16)
+
+        # Halved once per round trip
+        controller.record(response(503), 0.1)
+        controller.record(response(503), 0.1)
+        self.assertEqual(controller.limit, 8)
+        self.clock.now += 1
+        controller.record(Timeout(), 30)
+        self.assertEqual(controller.limit, 4)
+        self.clock.now += 1
+        for _ in range(10):
+            controller.record(response(503), 0.1)
+            self.clock.now += 1
+        self.assertEqual(controller.limit, 2)
+
+        # After the first decrease, by one per round
+        for _ in range(6):
+            controller.record(response(), 0.1)
+        self.assertEqual(controller.limit, 4)
+
+    def test_fuzz_case_errors_do_not_slow_down(self):
+        controller = self.controller(max_concurrency=4)
+        for _ in range(10):
+            controller.record(response(500), 0.1)
+        self.assertEqual(controller.limit, 4)
+
+    def test_latency(self):
+        controller = self.controller(max_concurrency=8)
+        for _ in range(10):
+            controller.record(response(), 0.1)
+        self.assertEqual(controller.limit, 8)
+        controller.record(response(), 5.0)
+        self.assertEqual(controller.limit, 4)
+
+        controller = self.controller(max_concurrency=8, latency_target=10)
+        for _ in range(10):
+            controller.record(response(), 5.0)
+        self.assertEqual(controller.limit, 8)
+
+    def test_rate(self):
+        controller = self.controller(min_rate=2, max_rate=4)
+        self.assertEqual(controller.rate, 2)
+        self.assertEqual(controller.delay(), 0)
+        controller.wait()
+        self.assertEqual(controller.delay(), 0.5)
+        controller.wait()
+        self.assertEqual(self.clock.slept, [0.5])
+        for _ in range(10):
+            controller.record(response(), 0.1)
+        self.assertEqual(controller.rate, 4)
+        controller.record(response(429), 0.1)
+        self.assertEqual(controller.rate, 2)
+
+        # Not limited without max_rate
+        controller = self.controller()
+        controller.wait()
+        controller.wait()
+        self.assertIsNone(controller.rate)
+
+if __name__ == '__main__':
+    unittest.main()
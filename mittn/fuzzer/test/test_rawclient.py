@@ -0,0 +1,136 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from requests.exceptions import ConnectionError, Timeout
+
+from mittn.fuzzer.fuzzcase import FuzzCase
+from mittn.fuzzer.rawclient import RawClient
+from mittn.fuzzer.sendpool import SendPool
+from mittn.fuzzer.target import Target
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    # Answers on the path: /echo with the request, /chunked with a chunked
+    # body, /drop by closing the connection, /garbage with a malformed
+    # status line, /slow after a while
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.path, body))
+        if self.path == '/garbage' and body == b'"garbage"':
+            self.wfile.write(b'HTTP/1.1 two hundred OK\r\nContent-Length: 0\r\n\r\n')
+            self.close_connection = True
+            return
+        if self.path == '/drop' and body == b'"drop"':
+            self.close_connection = True
+            return
+        if self.path == '/slow':
+            time.sleep(0.5)
+        if self.path == '/chunked':
+            self.send_response(500)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in [body, b'-' * 100, b'end']:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Test', 'a')
+        self.send_header('X-Test', 'b')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EchoServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+
+class test_rawclient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EchoServer(('127.0.0.1', 0), EchoHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def target(self, path='/echo'):
+        return Target('raw', 'POST', 'http://127.0.0.1:%d%s' % (self.server.server_port, path),
+                      'json', '{"a": 1}')
+
+    def test_send(self):
+        client = RawClient()
+        resp = client.do_target(self.target(), 'POST', {'a': [1, 'x']})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b'{"a": [1, "x"]}')
+        self.assertEqual(resp.headers['x-test'], 'a, b')
+        self.assertEqual(resp.request.body, '{"a": [1, "x"]}')
+        self.assertEqual(resp.request.headers['Content-Length'], '15')
+
+    def test_pipeline(self):
+        client = RawClient(pipeline=5, body_limit=10)
+        bodies = ['"%s"' % ('x' * i) for i in range(5)]
+        results = client.send_bodies(self.target(), [('POST', body) for body in bodies])
+        self.assertEqual([resp.content for resp in results],
+                         [body.encode()[:10] for body in bodies])
+        # All on one connection, which is kept for the next requests
+        client.send_bodies(self.target('/chunked'), [('POST', '"a"'), ('POST', '"b"')])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_chunked(self):
+        client = RawClient(body_limit=10)
+        results = client.send_bodies(self.target('/chunked'), [('POST', '"a"'), ('POST', '"b"')])
+        self.assertEqual([resp.status_code for resp in results], [500, 500])
+        self.assertEqual(results[1].content, b'"b"-------')
+
+    def test_dropped_connection(self):
+        client = RawClient(pipeline=3)
+        results = client.send_bodies(self.target('/drop'), [('POST', '"a"'), ('POST', '"drop"'),
+                                                            ('POST', '"c"')])
+        self.assertEqual(results[0].content, b'"a"')
+        self.assertIsInstance(results[1], ConnectionError)
+        self.assertEqual(results[2].content, b'"c"')
+
+    def test_malformed_response(self):
+        client = RawClient(keepalive=True)
+        self.assertEqual(client.send_body(self.target('/garbage'), 'POST', '"a"').content, b'"a"')
+        # Not sent again, although the connection was reused
+        self.assertIsInstance(client.send_body(self.target('/garbage'), 'POST', '"garbage"'),
+                              ConnectionError)
+        self.assertEqual(self.server.requests, [('/garbage', b'"a"'), ('/garbage', b'"garbage"')])
+
+    def test_timeout(self):
+        client = RawClient()
+        client.timeout = 0.1
+        self.assertIsInstance(client.send_body(self.target('/slow'), 'POST', '{}'), Timeout)
+
+    def test_sendpool(self):
+        client = RawClient(pipeline=4)
+        target = self.target()
+        cases = [FuzzCase(target, i, target.plan[0], 0, 'POST', None, '"%d"' % i) for i in range(10)]
+        results = list(SendPool(client, concurrency=2).send(target, cases))
+        self.assertEqual([case.index for case, resp in results], list(range(10)))
+        self.assertEqual([resp.content for case, resp in results],
+                         [case.body.encode() for case in cases])
+        self.assertEqual(self.server.connections, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mittn.fuzzer.scheduler import BudgetScheduler
+
+
+class FakeTarget(object):
+
+    def __init__(self, scenario_id):
+        self.scenario_id = scenario_id
+
+
+class test_scheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.directory = tempfile.mkdtemp()
+        self.coverage_file = os.path.join(self.directory, 'coverage.json')
+        self.targets = [FakeTarget('a'), FakeTarget('b')]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def clock(self):
+        return self.now
+
+    def fuzz_turns(self, budget, amount=4, cases=1, turn_cases=100):
+        # Run the scheduler, each case taking a second
+        scheduler = BudgetScheduler(budget, self.coverage_file, self.clock, turn_cases)
+        scheduler.start()
+        turns = []
+        for target, index in scheduler.schedule(self.targets, amount):
+            sent = []
+            for case in scheduler.cases(target, index, iter(range(cases)), amount):
+                sent.append(case)
+                self.now += 1
+            if sent:
+                turns.append((target.scenario_id, index) if cases == 1 else
+                             (target.scenario_id, index, sent))
+            if scheduler.cut:
+                break
+        scheduler.save()
+        return turns, scheduler
+
+    def test_turns(self):
+        turns, scheduler = self.fuzz_turns(100)
+        self.assertEqual(turns, [('a', 0), ('b', 0), ('a', 1), ('b', 1),
+                                 ('a', 2), ('b', 2), ('a', 3), ('b', 3)])
+        self.assertEqual(scheduler.coverage, {'a': [0, 1, 2, 3], 'b': [0, 1, 2, 3]})
+
+    def test_budget_and_coverage_file(self):
+        turns, scheduler = self.fuzz_turns(3)
+        self.assertEqual(turns, [('a', 0), ('b', 0), ('a', 1)])
+        self.assertEqual(scheduler.coverage, {'a': [0, 1], 'b': [0]})
+
+        # The next run continues where this one stopped, starting with
+        # the target that had fewer turns
+        turns, scheduler = self.fuzz_turns(3)
+        self.assertEqual(turns, [('b', 1), ('a', 2), ('b', 2)])
+
+        # and starts over after the last anomaly
+        turns, scheduler = self.fuzz_turns(4)
+        self.assertEqual(turns, [('a', 3), ('b', 3), ('a', 0), ('b', 0)])
+
+    def test_long_turns(self):
+        # An anomaly index with more cases than fit in the budget
+        turns, scheduler = self.fuzz_turns(10, amount=2, cases=10, turn_cases=4)
+        self.assertEqual(turns, [('a', 0, [0, 1, 2, 3]), ('b', 0, [0, 1, 2, 3]),
+                                 ('a', 0, [4, 5])])
+        self.assertEqual(scheduler.coverage, {'a': [], 'b': []})
+
+        # The next run sends the rest of the cases, starting with the
+        # target that had fewer turns
+        turns, scheduler = self.fuzz_turns(10, amount=2, cases=10, turn_cases=4)
+        self.assertEqual(turns, [('b', 0, [4, 5, 6, 7]), ('a', 0, [6, 7, 8, 9]),
+                                 ('b', 0, [8, 9])])
+        self.assertEqual(scheduler.coverage, {'a': [0], 'b': [0]})
+
+    def test_no_anomalies(self):
+        scheduler = BudgetScheduler(1, clock=self.clock)
+        scheduler.start()
+        self.assertRaises(ValueError, scheduler.schedule, self.targets, 0)
+
+    def test_cut(self):
+        scheduler = BudgetScheduler(1, clock=self.clock)
+        scheduler.start()
+        target = self.targets[0]
+        next(scheduler.schedule([target], 1))
+        cases = scheduler.cases(target, 0, iter(range(10)), 1)
+        self.assertEqual(next(cases), 0)
+        self.now = 1
+        self.assertEqual(list(cases), [])
+        self.assertTrue(scheduler.cut)
+        self.assertEqual(scheduler.state['a']['offset'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
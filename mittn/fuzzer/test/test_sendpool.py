@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from mittn.fuzzer.client import Client
+from mittn.fuzzer.fuzzcase import FuzzCase
+from mittn.fuzzer.sendpool import SendPool
+from mittn.fuzzer.target import Target
+
+
+class FakeClient(object):
+    # Takes a while to answer, and counts the requests in flight
+
+    def __init__(self, delay=lambda body: 0.01):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = Counter()
+        self.most = Counter()
+        self.most_total = 0
+
+    def send_body(self, target, method, body):
+        with self.lock:
+            self.in_flight[target.uri] += 1
+            self.most[target.uri] = max(self.most[target.uri], self.in_flight[target.uri])
+            self.most_total = max(self.most_total, sum(self.in_flight.values()))
+        time.sleep(self.delay(body))
+        with self.lock:
+            self.in_flight[target.uri] -= 1
+        return body
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    # Answers with the request body, and counts the connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EchoServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def cases(target, amount):
+    return [FuzzCase(target, i, target.plan[0], 0, 'POST', None, '%s %d' % (target.scenario_id, i))
+            for i in range(amount)]
+
+
+class test_sendpool(unittest.TestCase):
+
+    def test_send(self):
+        # Every third case takes longer, so the responses arrive out of order
+        client = FakeClient(lambda body: 0.03 if int(body.split()[1]) % 3 == 0 else 0.001)
+        pool = SendPool(client, concurrency=4)
+        target = Target('a', 'POST', 'http://a/', 'json', '{"a": 1}')
+        sent = cases(target, 30)
+        results = list(pool.send(target, sent))
+
+        # In the order of the cases
+        self.assertEqual([case for case, result in results], sent)
+        self.assertEqual([result for case, result in results], ['a %d' % i for i in range(30)])
+        # At most concurrency requests in flight
+        self.assertEqual(client.most_total, 4)
+
+    def test_shared_session(self):
+        # The threads of the pool share the Session of the client and its
+        # connection pool
+        server = EchoServer(('127.0.0.1', 0), EchoHandler)
+        server.connections = set()
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        try:
+            client = Client(keepalive=True, pool_size=4)
+            client.timeout = 5
+            pool = SendPool(client, concurrency=4)
+            target = Target('a', 'POST', 'http://127.0.0.1:%d/' % server.server_port, 'json', '{"a": 1}')
+            results = list(pool.send(target, cases(target, 100)))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual([(response.status_code, response.text) for case, response in results],
+                         [(200, 'a %d' % i) for i in range(100)])
+        # The connections were kept and reused
+        self.assertLessEqual(len(server.connections), 4)
+
+    def test_send_all(self):
+        client = FakeClient()
+        pool = SendPool(client, concurrency=6, host_concurrency=2)
+        targets = [Target(name, 'POST', 'http://%s/' % name, 'json', '{"a": 1}')
+                   for name in ['a', 'b', 'c', 'd']]
+        results = list(pool.send_all([(target, cases(target, 10)) for target in targets]))
+
+        self.assertEqual(len(results), 40)
+        for target in targets:
+            # In order within each target
+            self.assertEqual([result for t, case, result in results if t is target],
+                             ['%s %d' % (target.scenario_id, i) for i in range(10)])
+            self.assertLessEqual(client.most[target.uri], 2)
+        self.assertEqual(client.most_total, 6)
+        # The targets were fuzzed at the same time
+        self.assertNotEqual([t.scenario_id for t, case, result in results[:8]], ['a'] * 8)
+
+if __name__ == '__main__':
+    unittest.main()
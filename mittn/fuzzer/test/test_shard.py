@@ -0,0 +1,37 @@
+import unittest
+
+from mittn.fuzzer.shard import Shard
+
+
+class test_shard(unittest.TestCase):
+
+    def setUp(self):
+        self.cases = [('scenario', index, point, method)
+                      for index in range(10)
+                      for point in range(10)
+                      for method in ('GET', 'POST')]
+
+    def owned(self, shard):
+        return set(case for case in self.cases if shard.owns(*case))
+
+    def test_parse(self):
+        shard = Shard.parse('2/4')
+        self.assertEqual((shard.index, shard.count), (1, 4))
+        self.assertEqual(Shard.parse('').count, 1)
+        self.assertRaises(ValueError, Shard.parse, '5/4')
+        self.assertRaises(ValueError, Shard.parse, 'x')
+
+    def test_shards_cover_all_cases_once(self):
+        shards = [Shard(i, 3) for i in range(3)]
+        owned = [self.owned(shard) for shard in shards]
+        self.assertEqual(sum(len(o) for o in owned), len(self.cases))
+        self.assertEqual(set.union(*owned), set(self.cases))
+
+    def test_split(self):
+        shard = Shard(1, 3)
+        parts = [self.owned(part) for part in shard.split(4)]
+        self.assertEqual(sum(len(p) for p in parts), len(self.owned(shard)))
+        self.assertEqual(set.union(*parts), self.owned(shard))
+
+if __name__ == '__main__':
+    unittest.main()
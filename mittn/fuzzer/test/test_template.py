@@ -0,0 +1,42 @@
+import unittest
+
+from mittn.fuzzer.client import Client
+from mittn.fuzzer.target import Target
+
+ANOMALIES = ['', 'x', '"quoted" & ;,=', '\xe5\xe4\xf6', b'\xff\x00"', None, 0, -1.5,
+             float('nan'), True, [], {}, 'b', 'd']
+
+
+class test_template(unittest.TestCase):
+
+    def assertSpliced(self, target):
+        # Every case renders the same text as serialising it in full
+        client = Client()
+        spliced = 0
+        for point in target.plan:
+            for anomaly in ANOMALIES:
+                injection = {None: anomaly}
+                body = target.template.render(point, injection)
+                expected = client.serialise(target, point.apply(target.valid_submission, injection))
+                if body is not None:
+                    self.assertEqual(body, expected, (point, anomaly))
+                    spliced += 1
+        return spliced
+
+    def test_json(self):
+        target = Target('json', 'POST', 'http://localhost/', 'json',
+                        '{"a": "hello", "b": [1, 2.5, null, {"c": true, "d": []}], "e": {}}')
+        self.assertEqual(target.template.body, Client().serialise(target, target.valid_submission))
+        # Only injecting an existing key into another member is not spliced
+        self.assertEqual(self.assertSpliced(target), len(target.plan) * len(ANOMALIES) - 3)
+
+    def test_urlencode(self):
+        target = Target('urlencode', 'POST', 'http://localhost/', 'urlencode', 'a=1&b=x+y&a=2&c=%26')
+        self.assertEqual(self.assertSpliced(target), len(target.plan) * len(ANOMALIES) - 2)
+
+    def test_urlparams(self):
+        target = Target('urlparams', 'GET', 'http://localhost/', 'urlparams', 'a=1,2;b=x y;c=')
+        self.assertEqual(self.assertSpliced(target), len(target.plan) * len(ANOMALIES) - 2)
+
+if __name__ == '__main__':
+    unittest.main()
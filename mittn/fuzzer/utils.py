@@ -35,6 +35,29 @@ def dict_to_urlparams(paramdict, delimiter=';'):
         params.append(parse.quote_plus(key) + '=' + ','.join(values))
     return delimiter.join(params)
 
+def sample_values(valuedict, key):
+    """Return the valid values to use as fuzzer samples for a key of a
+    dict created by AnomalyGenerator.collect_values(), as a tuple of bytes.
+    """
+    if len(valuedict[key]) == 0:
+        # If no values for a key, use the samples under the None key
+        valuelist = valuedict[None]
+    else:
+        # Use the samples collected for the specific key
+        valuelist = valuedict[key]
+
+    samples = []
+    for valid_string in valuelist:
+        # Fuzzers only operate on strings, so make numbers and booleans
+        # into strings. (No, this won't fuzz effectively, use static
+        # injection to cover those cases.)
+        if valid_string is None:
+            valid_string = ''
+        elif isinstance(valid_string, (bool, six.integer_types, float)):
+            valid_string = str(valid_string)
+        samples.append(codecs.encode(valid_string, 'utf-8'))
+    return tuple(samples)
+
 def serialise_to_url(dictionary, encode=True):
     """Take a dictionary and URL-encode it for HTTP submission
     :param dictionary: A dictionary to be serialised
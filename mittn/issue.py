@@ -1,4 +1,5 @@
 from sqlalchemy import Column, types
+import hashlib
 
 
 class Issue(object):
@@ -14,9 +15,59 @@ class Issue(object):
             if col.default and not callable(col.default.arg):
                 kwargs[attr.key] = col.default.arg
 
+    # Name of the tool that finds these issues
+    tool = None
+
     issue_no = Column(types.Integer, primary_key=True, nullable=False)
     new_issue = Column(types.Boolean, default=False, nullable=False)
     timestamp = Column(types.DateTime(timezone=True), nullable=False)
     test_runner_host = Column(types.String, nullable=False)
     scenario_id = Column(types.String, nullable=False)
     url = Column(types.String, nullable=False)
+    # The test run that found the issue
+    run_id = Column(types.String, index=True)
+    # Hash of the unique fields, see fingerprint()
+    fingerprint = Column(types.String(64), index=True)
+
+    def unique_fields(self):
+        """ Returns class attributes and fields used when checking for false
+        positives already present in the database
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def unique_columns(cls):
+        """ The class attributes of unique_fields() """
+        return [cls_attr for cls_attr, attr in cls().unique_fields()]
+
+    def compute_fingerprint(self):
+        return fingerprint(*zip(*self.unique_fields()))
+
+
+def fingerprint(columns, values):
+    """Hash the values of the unique fields of an issue. The values are
+    first converted to the types they have when read back from the
+    database, so that an issue that has not been stored yet gets the same
+    fingerprint as its stored copy.
+    """
+    values = tuple(normalise(column, value) for column, value in zip(columns, values))
+    return hashlib.sha256(repr(values).encode('utf-8')).hexdigest()
+
+
+def normalise(column, value):
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if isinstance(value, python_type):
+        return value
+    if python_type is bytes and isinstance(value, str):
+        return value.encode('utf-8')
+    if python_type is str and isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if python_type is str and isinstance(value, bool):
+        # Booleans are bound as integers
+        return str(int(value))
+    return python_type(value)
@@ -0,0 +1,426 @@
+import bisect
+import cProfile
+import json
+import math
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefix of the metric names in the Prometheus textfile
+PROMETHEUS_PREFIX = 'mittn_'
+
+# Stack frames kept of each allocation when profiling with tracemalloc
+TRACEMALLOC_FRAMES = 25
+
+
+class Metrics(object):
+    """Counters, histograms and phase timings of a test run.
+
+    Counters and histograms have a name and labels, e.g.
+    count('cases_sent', target='login'). Phases sum up the time spent in
+    a part of the run, e.g. with metrics.phase('check'): ... Time spent
+    in several threads at once is added up, so the phases of a run with
+    concurrency can add up to more than the run took.
+
+    The metrics are safe to update from several threads. A copy sent to a
+    worker process starts empty; the worker sends back its snapshot(),
+    which the parent adds to its own with merge().
+
+    With a tracer, every timed call of a phase is also recorded as a span,
+    and with a profiler, the calls of one phase are profiled.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., count above, sum]
+        self.phases = {}      # name -> [seconds, calls]
+        self.tracer = None    # Tracer
+        self.profiler = None  # PhaseProfiler, only profiles this process
+
+    def __getstate__(self):
+        return {'clock': self.clock, 'tracer': self.tracer}
+
+    def __setstate__(self, state):
+        self.__init__(state['clock'])
+        self.tracer = state['tracer']
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a value, e.g. a latency in seconds, to a histogram with the
+        LATENCY_BUCKETS
+        """
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def add_phase(self, name, seconds, calls=1, start=None):
+        """Add time spent in a phase. With a tracer, a span is recorded if
+        the start time (from the clock) is given.
+        """
+        with self.lock:
+            phase = self.phases.setdefault(name, [0.0, 0])
+            phase[0] += seconds
+            phase[1] += calls
+        if self.tracer is not None and start is not None:
+            self.tracer.add(name, start, seconds, calls)
+
+    @contextmanager
+    def phase(self, name, calls=1):
+        """Time a block of code as a part of a phase, as the given number
+        of calls of it
+        """
+        profiler = self.profiler
+        profiling = profiler is not None and profiler.phase == name and profiler.enter()
+        start = self.clock()
+        try:
+            yield
+        finally:
+            seconds = self.clock() - start
+            if profiling:
+                profiler.exit()
+            self.add_phase(name, seconds, calls, start=start)
+
+    def reset(self):
+        """Start over, e.g. at the start of a new run: clear the metrics
+        and the spans of the tracer, and restart the clock
+        """
+        with self.lock:
+            self.started = self.clock()
+            self.counters = {}
+            self.histograms = {}
+            self.phases = {}
+        if self.tracer is not None:
+            self.tracer.reset()
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def snapshot(self, spans=False):
+        """The metrics as plain data, see merge(). The spans of the tracer
+        are only included if asked for.
+        """
+        with self.lock:
+            snapshot = {'counters': dict(self.counters),
+                        'histograms': dict((key, list(value)) for key, value in self.histograms.items()),
+                        'phases': dict((key, list(value)) for key, value in self.phases.items())}
+        if spans and self.tracer is not None:
+            snapshot['spans'] = self.tracer.snapshot()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the metrics of a snapshot, e.g. from a worker process"""
+        for (name, labels), value in snapshot['counters'].items():
+            self.count(name, value, **dict(labels))
+        with self.lock:
+            for key, values in snapshot['histograms'].items():
+                histogram = self.histograms.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    histogram[index] += value
+        for name, (seconds, calls) in snapshot['phases'].items():
+            self.add_phase(name, seconds, calls)
+        if self.tracer is not None and snapshot.get('spans'):
+            self.tracer.merge(snapshot['spans'])
+
+    def summary(self):
+        """The metrics as a dict that can be written as JSON, with the
+        rate of each counter and latency percentiles estimated from the
+        histogram buckets
+        """
+        snapshot = self.snapshot()
+        elapsed = self.elapsed()
+        counters = {}
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            counters.setdefault(name, []).append({
+                'labels': dict(labels),
+                'value': value,
+                'per_second': value / elapsed if elapsed > 0 else 0.0})
+        histograms = {}
+        for (name, labels), values in sorted(snapshot['histograms'].items()):
+            count = sum(values[:-1])
+            histograms.setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': count,
+                'sum': values[-1],
+                'mean': values[-1] / count if count else None,
+                'p50': percentile(values, 0.5),
+                'p90': percentile(values, 0.9),
+                'p99': percentile(values, 0.99),
+                'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                    values[:-1]))})
+        phases = dict((name, {'seconds': seconds, 'calls': calls})
+                      for name, (seconds, calls) in sorted(snapshot['phases'].items()))
+        return {'elapsed': elapsed, 'counters': counters,
+                'histograms': histograms, 'phases': phases}
+
+    def prometheus(self, **labels):
+        """The metrics in the Prometheus text format, e.g. for the textfile
+        collector of the node exporter. The labels are added to every
+        metric.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        names = set()
+
+        def header(name, kind):
+            if name not in names:
+                names.add(name)
+                lines.append('# TYPE %s %s' % (name, kind))
+
+        for (name, metric_labels), value in sorted(snapshot['counters'].items()):
+            name = PROMETHEUS_PREFIX + name + '_total'
+            header(name, 'counter')
+            lines.append('%s%s %s' % (name, label_text(labels, metric_labels), number(value)))
+        for (name, metric_labels), values in sorted(snapshot['histograms'].items()):
+            name = PROMETHEUS_PREFIX + name
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, value in zip(list(LATENCY_BUCKETS) + ['+Inf'], values[:-1]):
+                cumulative += value
+                lines.append('%s_bucket%s %d' % (
+                    name, label_text(labels, metric_labels + (('le', str(bound)),)), cumulative))
+            lines.append('%s_sum%s %s' % (name, label_text(labels, metric_labels), number(values[-1])))
+            lines.append('%s_count%s %d' % (name, label_text(labels, metric_labels), cumulative))
+        for index, name in enumerate(['phase_seconds_total', 'phase_calls_total']):
+            for phase, values in sorted(snapshot['phases'].items()):
+                header(PROMETHEUS_PREFIX + name, 'counter')
+                lines.append('%s%s%s %s' % (PROMETHEUS_PREFIX, name,
+                                            label_text(labels, (('phase', phase),)), number(values[index])))
+        header(PROMETHEUS_PREFIX + 'elapsed_seconds', 'gauge')
+        lines.append('%selapsed_seconds%s %s' % (PROMETHEUS_PREFIX, label_text(labels, ()),
+                                                 number(self.elapsed())))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, prometheus_path=None, **labels):
+        """Write the JSON summary and the Prometheus textfile, replacing
+        the earlier ones, so readers never see half a file
+        """
+        if json_path:
+            write_file(json_path, json.dumps(self.summary(), indent=2, sort_keys=True))
+        if prometheus_path:
+            write_file(prometheus_path, self.prometheus(**labels))
+
+
+class Tracer(object):
+    """Records a span, with the start time, the duration, the process
+    and the thread, for every timed call of a phase. The spans are
+    written in the Chrome trace event format, which the Perfetto UI
+    (ui.perfetto.dev) and chrome://tracing show as a timeline.
+
+    At most max_spans spans are kept, the rest are only counted. A copy
+    sent to a worker process starts empty, see Metrics.merge().
+    """
+
+    def __init__(self, max_spans=100000):
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.spans = []    # (name, start, seconds, calls, process id, thread id)
+        self.threads = {}  # (process id, thread id) -> thread name
+        self.dropped = 0
+
+    def __getstate__(self):
+        return {'max_spans': self.max_spans}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_spans'])
+
+    def add(self, name, start, seconds, calls=1):
+        thread = threading.current_thread()
+        key = (os.getpid(), thread.ident)
+        with self.lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self.spans.append((name, start, seconds, calls) + key)
+            if key not in self.threads:
+                self.threads[key] = thread.name
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.dropped = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {'spans': list(self.spans), 'threads': dict(self.threads),
+                    'dropped': self.dropped}
+
+    def merge(self, snapshot):
+        with self.lock:
+            room = max(0, self.max_spans - len(self.spans))
+            self.spans.extend(snapshot['spans'][:room])
+            self.dropped += snapshot['dropped'] + max(0, len(snapshot['spans']) - room)
+            self.threads.update(snapshot['threads'])
+
+    def events(self):
+        """The spans as Chrome trace events, times in microseconds"""
+        snapshot = self.snapshot()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': name}}
+                  for (pid, tid), name in sorted(snapshot['threads'].items())]
+        for name, start, seconds, calls, pid, tid in snapshot['spans']:
+            events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': start * 1e6, 'dur': seconds * 1e6,
+                           'args': {'calls': calls}})
+        return events
+
+    def write(self, path):
+        write_file(path, json.dumps({'traceEvents': self.events(),
+                                     'otherData': {'dropped_spans': self.dropped}}))
+
+
+class PhaseProfiler(object):
+    """Profiles the calls of one phase, see Metrics.phase(), with
+    cProfile or tracemalloc, and writes what it found to a file.
+
+    cProfile writes the statistics of all the calls, to be read with
+    pstats (python -m pstats file). It only sees the thread that runs a
+    call. tracemalloc writes the snapshot of the memory allocated and not
+    yet freed at the end of the call that held the most, to be read with
+    tracemalloc.Snapshot.load(). Taking the snapshots is slow, so it is
+    best used with phases that run a few times, such as generate.
+
+    One call is profiled at a time; calls of the phase in other threads
+    meanwhile are not. If no call was profiled, no file is written.
+    """
+
+    def __init__(self, phase, path, mode='cprofile'):
+        if mode not in ('cprofile', 'tracemalloc'):
+            raise ValueError("Unknown profile mode %s, use cprofile or tracemalloc" % mode)
+        self.phase = phase
+        self.path = path
+        self.mode = mode
+        # Held while a call is profiled
+        self.lock = threading.Lock()
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+        self.snapshot = None
+        self.size = -1
+        self.started_tracing = False
+        self.calls = 0  # Calls profiled
+
+    def enter(self):
+        """Start profiling a call, unless one already is"""
+        if not self.lock.acquire(False):
+            return False
+        if self.profile is not None:
+            self.profile.enable()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.started_tracing = True
+        return True
+
+    def exit(self):
+        self.calls += 1
+        try:
+            if self.profile is not None:
+                self.profile.disable()
+                return
+            size = tracemalloc.get_traced_memory()[0]
+            if size > self.size:
+                self.snapshot = tracemalloc.take_snapshot()
+                self.size = size
+            if self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+        finally:
+            self.lock.release()
+
+    def write(self):
+        if not self.calls:
+            return
+        if self.profile is not None:
+            self.profile.dump_stats(self.path)
+        elif self.snapshot is not None:
+            self.snapshot.dump(self.path)
+
+
+class MetricsWriter(object):
+    """Writes the metrics every interval seconds in a thread of its own,
+    while a run is going on.
+    """
+
+    def __init__(self, metrics, interval, json_path=None, prometheus_path=None, **labels):
+        self.metrics = metrics
+        self.interval = interval
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.labels = labels
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='metrics writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread and write the final metrics"""
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        self.write()
+
+    def write(self):
+        self.metrics.write(self.json_path, self.prometheus_path, **self.labels)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+
+def percentile(values, fraction):
+    """Estimate a percentile from histogram bucket counts: the upper bound
+    of the bucket it falls in, None if it is above the last bound or there
+    are no values
+    """
+    counts = values[:-1]
+    total = sum(counts)
+    if not total:
+        return None
+    wanted = math.ceil(total * fraction)
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, counts):
+        cumulative += count
+        if cumulative >= wanted:
+            return bound
+    return None
+
+
+def label_text(labels, metric_labels):
+    pairs = sorted(labels.items()) + list(metric_labels)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def write_file(path, text):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as fh:
+        fh.write(text)
+    os.replace(temp_path, path)
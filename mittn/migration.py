@@ -0,0 +1,67 @@
+from sqlalchemy import inspect
+from sqlalchemy.sql import text
+
+from mittn.blob import blob_fields, store_blob
+from mittn.issue import fingerprint
+
+
+def migrate(engine, session, issuecls, batch_size=1000):
+    """Bring the table of an issue class created by an earlier version up
+    to date, in place: add the missing columns and indexes, and fill in
+    the fingerprints of the issues stored before the fingerprint column
+    existed, and move the data stored inline before the blob table existed
+    into the blob table.
+    """
+    table = issuecls.__table__
+    inspector = inspect(engine)
+
+    existing = set(column['name'] for column in inspector.get_columns(table.name))
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        if not column.nullable:
+            # Existing rows would have no value for it
+            raise RuntimeError("Cannot add the required column %s to the table %s, "
+                               "please migrate the database by hand."
+                               % (column.name, table.name))
+        engine.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (
+            table.name, column.name, column.type.compile(dialect=engine.dialect))))
+
+    existing = set(index['name'] for index in inspector.get_indexes(table.name))
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(engine)
+
+    backfill_fingerprints(session, issuecls, batch_size)
+    move_inline_blobs(session, issuecls, batch_size)
+
+
+def backfill_fingerprints(session, issuecls, batch_size=1000):
+    # Only the primary key and the unique fields are read, not the
+    # request and response bodies
+    columns = issuecls.unique_columns()
+    key = issuecls.issue_no
+    while True:
+        rows = session.query(key, *columns).filter(
+            issuecls.fingerprint.is_(None)).limit(batch_size).all()
+        if not rows:
+            break
+        session.bulk_update_mappings(issuecls, [
+            {key.key: row[0], 'fingerprint': fingerprint(columns, row[1:])}
+            for row in rows])
+        session.commit()
+
+
+def move_inline_blobs(session, issuecls, batch_size=1000):
+    key = issuecls.issue_no
+    for field in blob_fields(issuecls):
+        inline = getattr(issuecls, field.inline_attr)
+        while True:
+            rows = session.query(key, inline).filter(inline.isnot(None)).limit(batch_size).all()
+            if not rows:
+                break
+            session.bulk_update_mappings(issuecls, [
+                {key.key: row[0], field.inline_attr: None,
+                 field.digest_attr: store_blob(session, row[1])}
+                for row in rows])
+            session.commit()
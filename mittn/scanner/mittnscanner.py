@@ -1,4 +1,4 @@
-from mittn.config import Config
+from mittn.config import Config, config_bool
 from mittn.archiver import Archiver
 from mittn.scanner.pythonburp import PythonBurp
 from mittn.scanner.scannerissue import ScannerIssue
@@ -9,7 +9,12 @@ class MittnScanner(object):
         db_url = None
         if hasattr(self.config,'db_url'):
             db_url = self.config.db_url
-        self.archiver = archiver or Archiver(db_url)
+        self.archiver = archiver or Archiver(db_url,
+                fingerprint_cache=config_bool(self.config.fingerprint_cache),
+                batch_size=int(self.config.insert_batch_size),
+                run_id=self.config.run_id or None,
+                background=config_bool(self.config.background_archiver),
+                queue_size=int(self.config.archiver_queue_size))
         self.scanner = scanner or PythonBurp(self.config.cmdline +
                 " " + self.config.path,
                 self.config.proxy_address)
@@ -39,6 +44,7 @@ class MittnScanner(object):
                     self.archiver.add_if_not_found(issue)
                     self.results.append(r)
         finally:
+            self.archiver.flush()
             self.scanner.kill()
 
     def get_results(self):
@@ -5,6 +5,11 @@ class ScannerDefaults(object):
         self.defaults = """
 [scanner]
 db_url=sqlite:////tmp/mittn_scanner_issues.db
+fingerprint_cache=false
+insert_batch_size=1
+run_id=
+background_archiver=false
+archiver_queue_size=1000
 cmdline=java -jar -Xmx1g -Djava.awt.headless=true
 proxy_address=127.0.0.1:8080
 timeout=1
@@ -2,6 +2,7 @@ from sqlalchemy import Column, types
 import datetime
 
 from mittn.issue import Issue
+from mittn.blob import BlobField
 from sqlalchemy.ext.declarative.api import declarative_base
 
 import json
@@ -12,8 +13,10 @@ HOSTNAME = socket.gethostbyname(socket.gethostname())
 Base = declarative_base(cls=Issue)
 class ScannerIssue(Base):
     __tablename__ = 'headlessscanner_issues'
+    tool = 'headlessscanner'
 
-    # We use LargeBinary in message because it can be very big
+    # The messages can be very big, so they are stored compressed in the
+    # blob table, see blob.py
 
     # XXX fields that are used in all tools come from issue.py
 
@@ -25,7 +28,10 @@ class ScannerIssue(Base):
     host = Column(types.Text)
     port = Column(types.Text)
     protocol = Column(types.Text)
-    messages = Column(types.LargeBinary)
+    messages = BlobField('messages')
+    messages_digest = Column(types.String(64))
+    # Issues stored before the blob table have the messages inline
+    _messages = Column('messages', types.LargeBinary)
 
     def unique_fields(self):
         """ These fields are used when checking for false